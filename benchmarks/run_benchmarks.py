@@ -0,0 +1,312 @@
+# coding=utf-8
+"""
+Offline benchmarks of the comparison tools on synthetic output trees.
+Run from the repository root, e.g.,
+
+    python -m benchmarks.run_benchmarks --scales 4 16 64 --out before.json
+    python -m benchmarks.run_benchmarks --scales 4 16 64 --out after.json \
+        --compare before.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import nibabel as nb
+import numpy as np
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from datetime import datetime
+
+try:
+    from benchmarks.synthetic_tree import make_cpac_run, make_fmriprep_run, \
+                                         make_func_pair, subject_list
+    from configs.defaults import motion_list, regressor_list
+    from configs.subjects import generate_subject_list_for_directory
+    from correlation_matrix import Correlation_Matrix, Subject_Session_Feature
+    from corr_two_ts import streaming_voxelwise_corr, voxelwise_corr
+    from heatmaps import generate_heatmap, reshape_corrs
+    from parse_cache import parsed_files
+except ModuleNotFoundError:
+    from .synthetic_tree import make_cpac_run, make_fmriprep_run, \
+                                make_func_pair, subject_list
+    from ..configs.defaults import motion_list, regressor_list
+    from ..configs.subjects import generate_subject_list_for_directory
+    from ..correlation_matrix import Correlation_Matrix, \
+                                     Subject_Session_Feature
+    from ..corr_two_ts import streaming_voxelwise_corr, voxelwise_corr
+    from ..heatmaps import generate_heatmap, reshape_corrs
+    from ..parse_cache import parsed_files
+
+FEATURES = regressor_list + motion_list
+
+NIFTI_SHAPES = {"small": (24, 24, 24, 100), "large": (64, 64, 40, 200)}
+
+
+def time_call(function, repeat=3, setup=None):
+    """
+    Function to time a function, keeping the result of its last call
+
+    Parameters
+    ----------
+    function: function
+        called without arguments
+
+    repeat: int
+
+    setup: function or None
+        called without arguments before each timed call, untimed
+
+    Returns
+    -------
+    timing: dict
+        {"seconds": list of float, "min": float, "median": float}
+
+    result: any
+        return value of the last call
+    """
+    seconds = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = function()
+        seconds.append(time.perf_counter() - start)
+    return({
+        "seconds": seconds,
+        "min": min(seconds),
+        "median": float(np.median(seconds))
+    }, result)
+
+
+def _get_all_paths(subjects, run_path, software):
+    return([
+        Subject_Session_Feature.get_paths(
+            *subject.split("_", 1)[:1], feature, run_path, software,
+            subject.split("_", 1)[1]
+        ) for subject in subjects for feature in FEATURES
+    ])
+
+
+def _read_all_features(cell_paths, software):
+    reader = Subject_Session_Feature.__new__(Subject_Session_Feature)
+    return([
+        reader.read_feature(paths, feature, software) for paths, feature in
+        zip(cell_paths, FEATURES * (len(cell_paths) // len(FEATURES)))
+    ])
+
+
+def benchmark_scale(work_dir, n_subjects, n_timepoints=200, repeat=3):
+    """
+    Function to time the tree-level tools for one number of participants
+
+    Parameters
+    ----------
+    work_dir: str
+
+    n_subjects: int
+
+    n_timepoints: int
+
+    repeat: int
+
+    Returns
+    -------
+    results: list of dicts
+    """
+    subjects = subject_list(n_subjects)
+    root = os.path.join(work_dir, f"scale_{n_subjects}")
+    runs = [{"software": "C-PAC", "run_path": os.path.join(root, f"cpac_{i}/")}
+            for i in range(2)]
+    fmriprep = {"software": "fmriprep",
+                "run_path": os.path.join(root, "fmriprep/")}
+    if not os.path.exists(root):
+        for i, run in enumerate(runs):
+            make_cpac_run(run["run_path"], subjects, n_timepoints, seed=i)
+        make_fmriprep_run(fmriprep["run_path"], subjects, n_timepoints,
+                          seed=2)
+    results = []
+
+    def _record(name, timing, **details):
+        results.append({"benchmark": name, "n_subjects": n_subjects,
+                        **details, **timing})
+
+    timing, _ = time_call(lambda: generate_subject_list_for_directory(
+        runs[0]["run_path"]
+    ), repeat)
+    _record("generate_subject_list_for_directory", timing)
+
+    for run in [runs[0], fmriprep]:
+        timing, cell_paths = time_call(lambda: _get_all_paths(
+            subjects, run["run_path"], run["software"]
+        ), repeat)
+        _record("get_paths", timing, software=run["software"])
+        timing, _ = time_call(
+            lambda: _read_all_features(cell_paths, run["software"]), repeat,
+            setup=parsed_files.clear
+        )
+        _record("read_feature", timing, software=run["software"])
+
+    for name, compared in [("C-PAC vs C-PAC", runs),
+                           ("C-PAC vs fmriprep", [runs[0], fmriprep])]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            parsed_files.clear()
+            corrs = Correlation_Matrix(subjects, FEATURES, compared,
+                                       hash_check=False)
+        timing, _ = time_call(corrs.run_pearsonsr, repeat)
+        _record("run_pearsonsr", timing, runs=name)
+
+    save_path = os.path.join(root, "heatmap.png")
+    timing, _ = time_call(lambda: generate_heatmap(
+        reshape_corrs(corrs.corrs), FEATURES, subjects, save_path=save_path
+    ), repeat)
+    _record("generate_heatmap", timing)
+    return(results)
+
+
+def benchmark_corr_two_ts(work_dir, size, repeat=3):
+    """
+    Function to time `corr_two_ts.py`'s in-memory and streaming
+    correlations for one image size
+
+    Parameters
+    ----------
+    work_dir: str
+
+    size: str
+        key of NIFTI_SHAPES
+
+    repeat: int
+
+    Returns
+    -------
+    results: list of dicts
+    """
+    shape = NIFTI_SHAPES[size]
+    func1, func2 = make_func_pair(os.path.join(work_dir, "nifti"), shape)
+    results = []
+    for name, function in [
+        ("voxelwise_corr", lambda: voxelwise_corr(
+            np.asanyarray(nb.load(func1).dataobj),
+            np.asanyarray(nb.load(func2).dataobj)
+        )),
+        ("streaming_voxelwise_corr", lambda: streaming_voxelwise_corr(
+            nb.load(func1), nb.load(func2), max_memory_mb=256
+        ))
+    ]:
+        timing, _ = time_call(function, repeat)
+        results.append({"benchmark": f"corr_two_ts {name}", "size": size,
+                        "shape": list(shape), **timing})
+    return(results)
+
+
+def _metadata(args):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return({
+        "commit": commit,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "arguments": vars(args)
+    })
+
+
+def _result_key(result):
+    return(tuple([result["benchmark"]] + [
+        str(result[key]) for key in ["n_subjects", "software", "runs", "size"]
+        if key in result
+    ]))
+
+
+def compare_results(baseline, results):
+    """
+    Function to print the ratio of each median time to a baseline's
+
+    Parameters
+    ----------
+    baseline: dict
+        saved output of this script
+
+    results: dict
+        output of this script
+    """
+    baseline_times = {_result_key(result): result["median"] for result in
+                      baseline["results"]}
+    print(f"\nmedian seconds vs {baseline['metadata'].get('commit')}")
+    for result in results["results"]:
+        key = _result_key(result)
+        if key in baseline_times:
+            print(f"{' '.join(key):<60} {baseline_times[key]:>9.4f} "
+                  f"{result['median']:>9.4f} "
+                  f"{result['median'] / baseline_times[key]:>6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the comparison tools on synthetic output trees."
+    )
+
+    parser.add_argument("--scales", type=int, nargs="+", default=[4, 16, 64],
+                        help="numbers of participants (default: "
+                             "%(default)s)")
+
+    parser.add_argument("--n_timepoints", type=int, default=200)
+
+    parser.add_argument("--nifti_sizes", type=str, nargs="*",
+                        choices=list(NIFTI_SHAPES), default=["small"],
+                        help="4D image sizes for corr_two_ts (default: "
+                             "%(default)s)")
+
+    parser.add_argument("--repeat", type=int, default=3)
+
+    parser.add_argument("--work_dir", type=str,
+                        help="directory to write synthetic trees to, reused "
+                             "if it exists (default: a temporary directory)")
+
+    parser.add_argument("--out", type=str, default="benchmarks.json",
+                        help="JSON file to save results to (default: "
+                             "%(default)s)")
+
+    parser.add_argument("--compare", type=str,
+                        help="JSON file of baseline results to compare to")
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = args.work_dir or tmp_dir
+        results = {"metadata": _metadata(args), "results": []}
+        for n_subjects in args.scales:
+            results["results"] += benchmark_scale(
+                work_dir, n_subjects, args.n_timepoints, args.repeat
+            )
+        for size in args.nifti_sizes:
+            results["results"] += benchmark_corr_two_ts(
+                work_dir, size, args.repeat
+            )
+
+    for result in results["results"]:
+        print(f"{' '.join(_result_key(result)):<60} {result['median']:>9.4f}")
+
+    with open(args.out, "w") as out_file:
+        json.dump(results, out_file, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r") as baseline_file:
+            compare_results(json.load(baseline_file), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+# coding=utf-8
+"""
+Generators for synthetic C-PAC and fmriprep output trees, laid out the way
+`Subject_Session_Feature.get_paths` expects, and 4D NIfTI pairs for
+`corr_two_ts.py`. Signals are shared across runs generated with the same
+`signal_seed`, so correlations between runs are realistic rather than
+noise.
+"""
+import argparse
+import nibabel as nb
+import numpy as np
+import os
+
+from string import ascii_lowercase
+
+NUISANCE_COLUMNS = ["GlobalSignalMean0", "WhiteMatterMean0",
+                    "CerebrospinalFluidMean0"]
+
+
+def subject_list(n_subjects, n_sessions=1):
+    """
+    Function to name `n_subjects` × `n_sessions` (subject × session)s
+
+    Parameters
+    ----------
+    n_subjects: int
+
+    n_sessions: int
+
+    Returns
+    -------
+    list of str
+
+    Example
+    -------
+    >>> subject_list(1, 2)
+    ['sub-0025400_ses-1', 'sub-0025400_ses-2']
+    """
+    return([f"sub-{25400 + i:07d}_ses-{ses}" for ses in range(
+        1, n_sessions + 1
+    ) for i in range(n_subjects)])
+
+
+def _signals(subject_index, n_timepoints, n_signals, signal_seed, seed,
+             noise):
+    signal = np.random.default_rng([signal_seed, subject_index]).normal(
+        size=(n_timepoints, n_signals)
+    )
+    return(signal + noise * np.random.default_rng(
+        [seed, subject_index]
+    ).normal(size=signal.shape))
+
+
+def _write_1D(path, data, header_lines=()):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        for line in header_lines:
+            f.write(f"{line}\n")
+        np.savetxt(f, data, fmt="%.6f", delimiter="\t")
+
+
+def make_cpac_run(run_path, subjects, n_timepoints=200, seed=0,
+                  signal_seed=0, noise=0.1, pipeline="pipeline_benchmark"):
+    """
+    Function to write a synthetic C-PAC run with nuisance regressors,
+    CompCor components and framewise displacement for each
+    (subject × session)
+
+    Parameters
+    ----------
+    run_path: str
+
+    subjects: list of str
+        see `subject_list`
+
+    n_timepoints: int
+
+    seed: int
+        seed for this run's noise
+
+    signal_seed: int
+        seed for the signals shared between runs
+
+    noise: float
+        standard deviation of this run's noise
+
+    pipeline: str
+        pipeline directory name under ``output/``
+    """
+    for i, subject in enumerate(subjects):
+        working = os.path.join(
+            run_path, "working", f"resting_preproc_{subject}",
+            "nuisance_0_0", "_selector_benchmark"
+        )
+        signals = _signals(i, n_timepoints, 14, signal_seed, seed, noise)
+        _write_1D(
+            os.path.join(working, "_regressors", "build_nuisance_regressors",
+                         "nuisance_regressors.1D"),
+            np.column_stack([np.ones(n_timepoints), signals[:, :3]]),
+            ["# C-PAC benchmark", "# Nuisance regressors:",
+             "\t".join(["# Intercept"] + NUISANCE_COLUMNS)]
+        )
+        for j, compcor in enumerate(["aCompCor", "tCompCor"]):
+            _write_1D(
+                os.path.join(working, f"_{compcor}", f"{compcor}_0",
+                             f"{compcor}_components.1D"),
+                np.vstack([
+                    np.zeros((1, 5)), signals[:, 3 + 5 * j:8 + 5 * j]
+                ]),
+                ["#"]
+            )
+        _write_1D(
+            os.path.join(run_path, "output", pipeline, subject,
+                         "frame_wise_displacement_power", "_scan_rest",
+                         "FD.1D"),
+            np.abs(signals[:, 13])
+        )
+
+
+def make_fmriprep_run(run_path, subjects, n_timepoints=200, seed=0,
+                      signal_seed=0, noise=0.1):
+    """
+    Function to write a synthetic fmriprep run with a confounds TSV and
+    framewise displacement for each (subject × session), from the same
+    signals as `make_cpac_run`
+
+    Parameters
+    ----------
+    run_path: str
+
+    subjects: list of str
+        see `subject_list`
+
+    n_timepoints: int
+
+    seed: int
+
+    signal_seed: int
+
+    noise: float
+    """
+    for i, subject in enumerate(subjects):
+        sub, ses = subject.split("_", 1)
+        fmriprep_subject = f"{sub}{ascii_lowercase[int(ses[4:]) - 1]}"
+        signals = _signals(i, n_timepoints, 14, signal_seed, seed, noise)
+        columns = {
+            "global_signal": signals[:, 0],
+            "white_matter": signals[:, 1],
+            "csf": signals[:, 2],
+            "framewise_displacement": np.abs(signals[:, 13])
+        }
+        for j, compcor in enumerate(["a", "t"]):
+            for k in range(5):
+                columns[f"{compcor}_comp_cor_0{k}"] = signals[:, 3 + 5 * j + k]
+        func = os.path.join(run_path, "output", "fmriprep", fmriprep_subject,
+                            "func")
+        os.makedirs(func, exist_ok=True)
+        names = list(columns)
+        np.savetxt(
+            os.path.join(func, f"{fmriprep_subject}_task-rest_run-1"
+                               "_desc-confounds_regressors.tsv"),
+            np.column_stack([columns[name] for name in names]),
+            fmt="%.6f", delimiter="\t", header="\t".join(names), comments=""
+        )
+        _write_1D(
+            os.path.join(run_path, "working", "fmriprep_wf",
+                         f"single_subject_{fmriprep_subject[4:]}_wf",
+                         "func_preproc_task_rest_run_1_wf",
+                         "bold_confounds_wf", "fdisp", "fd_power_2012.txt"),
+            np.abs(signals[:, 13]),
+            ["FramewiseDisplacement"]
+        )
+
+
+def make_func_pair(out_dir, shape=(32, 32, 24, 100), seed=0, noise=0.5,
+                   compress=True):
+    """
+    Function to write two correlated 4D NIfTI images
+
+    Parameters
+    ----------
+    out_dir: str
+
+    shape: 4-tuple of int
+
+    seed: int
+
+    noise: float
+        standard deviation of the noise added to the second image
+
+    compress: bool
+        write .nii.gz rather than .nii
+
+    Returns
+    -------
+    func1: str
+
+    func2: str
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    ext = ".nii.gz" if compress else ".nii"
+    name = "x".join([str(dim) for dim in shape])
+    data = rng.normal(size=shape).astype(np.float32)
+    paths = []
+    for i, image in enumerate([
+        data, data + noise * rng.normal(size=shape).astype(np.float32)
+    ]):
+        paths.append(os.path.join(out_dir, f"func{i + 1}_{name}{ext}"))
+        nb.Nifti1Image(image, np.eye(4)).to_filename(paths[-1])
+    return(tuple(paths))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write synthetic C-PAC and fmriprep output trees."
+    )
+
+    parser.add_argument("out_dir", type=str)
+
+    parser.add_argument("--n_subjects", type=int, default=4)
+
+    parser.add_argument("--n_sessions", type=int, default=1)
+
+    parser.add_argument("--n_timepoints", type=int, default=200)
+
+    parser.add_argument("--n_runs", type=int, default=2,
+                        help="number of C-PAC runs to write, with different "
+                             "noise (default: %(default)s)")
+
+    parser.add_argument("--fmriprep", action="store_true",
+                        help="also write an fmriprep run")
+
+    args = parser.parse_args()
+
+    subjects = subject_list(args.n_subjects, args.n_sessions)
+    for seed in range(args.n_runs):
+        make_cpac_run(os.path.join(args.out_dir, f"cpac_{seed}"), subjects,
+                      args.n_timepoints, seed=seed)
+    if args.fmriprep:
+        make_fmriprep_run(os.path.join(args.out_dir, "fmriprep"), subjects,
+                          args.n_timepoints, seed=args.n_runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,21 @@
-
-import os
+import argparse
 import ast
+import bisect
 import datetime
+import json
+import operator
+import os
+import re
+
+from concurrent.futures import ProcessPoolExecutor
+
+# participant and session labels, and long runs of digits (unlabeled IDs)
+_PARTICIPANT_LABELS = re.compile(r"(sub|ses)-[A-Za-z0-9]+|(?<![0-9])[0-9]{5,}")
+
+# matches "key": "value" and 'key': 'value' for the fields timing needs
+_TIME_FIELDS = re.compile(
+    r"""["'](id|start|finish)["']\s*:\s*["']([^"']*)["']"""
+)
 
 
 def read_callback_lines(callback_log_file):
@@ -10,8 +24,103 @@ def read_callback_lines(callback_log_file):
     return callback_lines
 
 
-def write_out_times(sorted_time_dct):
-    out_file = os.path.join(os.getcwd(), 'sorted_node_times.txt')
+def iter_callback_lines(callback_log_file):
+    '''Function to lazily iterate over the lines of a callback log.
+
+    Parameters
+    ----------
+    callback_log_file: str
+
+    Yields
+    ------
+    str
+    '''
+    with open(callback_log_file, 'r') as f:
+        for line in f:
+            yield line
+
+
+def iter_callback_records(callback_lines):
+    '''Function to parse callback log lines into dicts, skipping lines
+    that aren't records. Lines are parsed as JSON, falling back to
+    `ast.literal_eval` for Python-literal logs.
+
+    Parameters
+    ----------
+    callback_lines: iterable of str
+
+    Yields
+    ------
+    dict
+
+    Example
+    -------
+    >>> list(iter_callback_records([
+    ...     '{"id": "a", "start": "2020-01-01T00:00:00.5"}',
+    ...     "{'id': 'b', 'finish': '2020-01-01T00:00:01'}",
+    ...     'not a record'
+    ... ]))
+    [{'id': 'a', 'start': '2020-01-01T00:00:00.5'}, {'id': 'b', 'finish': '2020-01-01T00:00:01'}]
+    '''
+    for line in callback_lines:
+        record = parse_callback_line(line)
+        if isinstance(record, dict):
+            yield record
+
+
+def parse_callback_line(line):
+    '''Function to parse one callback log line.
+
+    Parameters
+    ----------
+    line: str
+
+    Returns
+    -------
+    dict or None
+    '''
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(line)
+    except (ValueError, SyntaxError):
+        return None
+
+
+def parse_timestamp(timestamp):
+    '''Function to parse a callback log timestamp, keeping fractions of a
+    second.
+
+    Parameters
+    ----------
+    timestamp: str
+
+    Returns
+    -------
+    datetime.datetime
+
+    Example
+    -------
+    >>> parse_timestamp('2020-01-01T00:00:01.250000')
+    datetime.datetime(2020, 1, 1, 0, 0, 1, 250000)
+    '''
+    try:
+        return datetime.datetime.fromisoformat(timestamp)
+    except (AttributeError, ValueError):
+        return datetime.datetime.strptime(
+            timestamp,
+            '%Y-%m-%dT%H:%M:%S.%f' if '.' in timestamp else '%Y-%m-%dT%H:%M:%S'
+        )
+
+
+def write_out_times(sorted_time_dct, out_file=None):
+    if out_file is None:
+        out_file = os.path.join(os.getcwd(), 'sorted_node_times.txt')
     with open(out_file, 'wt') as f:
         for entry in sorted_time_dct:
             f.write(str(entry))
@@ -20,39 +129,538 @@ def write_out_times(sorted_time_dct):
 
 
 def parse_callback_times(callback_lines):
+    '''Function to calculate the duration of each node in a callback log.
+
+    The timing fields are pulled out of each line with a regular
+    expression, so most lines are never fully parsed.
+
+    Parameters
+    ----------
+    callback_lines: iterable of str or dict
+
+    Returns
+    -------
+    list of 2-tuples
+        (node id, duration in seconds), longest first
+
+    Example
+    -------
+    >>> parse_callback_times([
+    ...     '{"id": "a", "start": "2020-01-01T00:00:00.5", '
+    ...     '"finish": "2020-01-01T00:00:01.75"}',
+    ...     "{'id': 'b', 'start': '2020-01-01T00:00:00', "
+    ...     "'finish': '2020-01-01T00:00:02'}",
+    ...     '{"id": "c", "start": "2020-01-01T00:00:00"}'
+    ... ])
+    [('b', 2.0), ('a', 1.25)]
+    '''
     time_dct = {}
 
     for line in callback_lines:
-        line_dct = ast.literal_eval(line)
+        line_dct = line if isinstance(line, dict) else dict(
+            _TIME_FIELDS.findall(line)
+        )
 
-        if 'start' not in line_dct.keys() or 'finish' not in line_dct.keys():
-            continue
+        if not all(key in line_dct for key in ('id', 'start', 'finish')):
+            if isinstance(line, dict) or not all(
+                key in line for key in ('start', 'finish')
+            ):
+                continue
+            # unusual formatting; parse the whole line
+            line_dct = parse_callback_line(line)
+            if not isinstance(line_dct, dict) or not all(
+                key in line_dct for key in ('id', 'start', 'finish')
+            ):
+                continue
 
         node_id = line_dct['id']
-        start = line_dct['start']
-        end = line_dct['finish']
-
-        start_time = start.split('.')[0]
-        end_time = end.split('.')[0]
-
-        d1 = datetime.datetime.strptime(start_time, '%Y-%m-%dT%H:%M:%S')
-        d2 = datetime.datetime.strptime(end_time, '%Y-%m-%dT%H:%M:%S')
+        d1 = parse_timestamp(line_dct['start'])
+        d2 = parse_timestamp(line_dct['finish'])
         diff = (d2 - d1).total_seconds()
 
         time_dct[node_id] = diff
 
     # pre-Python 3.6 version
-    import operator
     sorted_time_dct = sorted(time_dct.items(), key=operator.itemgetter(1), reverse=True)
 
     return sorted_time_dct
 
-    for entry in sorted_time_dct:
-        print(entry)
 
+def parse_callback_logs(callback_log_files, num_cores=1):
+    '''Function to parse many callback logs (e.g., one per participant)
+    in parallel.
+
+    Parameters
+    ----------
+    callback_log_files: list of str
+
+    num_cores: int
+
+    Returns
+    -------
+    dict
+        {callback log path: sorted list of (node id, duration) tuples}
+    '''
+    if num_cores > 1 and len(callback_log_files) > 1:
+        with ProcessPoolExecutor(max_workers=num_cores) as executor:
+            parsed = list(executor.map(
+                _parse_callback_log, callback_log_files
+            ))
+    else:
+        parsed = [_parse_callback_log(path) for path in callback_log_files]
+    return dict(zip(callback_log_files, parsed))
+
+
+def _parse_callback_log(callback_log_file):
+    return parse_callback_times(iter_callback_lines(callback_log_file))
+
+
+def callback_nodes(callback_records):
+    '''Function to collect the finished nodes of callback records with
+    their resource use. Runtime thread and memory measurements are used
+    where present, estimates otherwise.
+
+    Parameters
+    ----------
+    callback_records: iterable of dict
+
+    Returns
+    -------
+    list of dicts
+        {'id', 'start', 'finish', 'seconds', 'threads', 'memory_gb'}
+    '''
+    nodes = []
+    for record in callback_records:
+        if not all(key in record for key in ('id', 'start', 'finish')):
+            continue
+        start = parse_timestamp(record['start'])
+        finish = parse_timestamp(record['finish'])
+        nodes.append({
+            'id': record['id'],
+            'start': start,
+            'finish': finish,
+            'seconds': (finish - start).total_seconds(),
+            'threads': _positive_number(
+                record.get('runtime_threads'),
+                _positive_number(record.get('num_threads'), 1)
+            ),
+            'memory_gb': _positive_number(
+                record.get('runtime_memory_gb'),
+                _positive_number(record.get('estimated_memory_gb'), 0)
+            )
+        })
+    return nodes
+
+
+def callback_timeline(nodes, min_gap_seconds=1.0):
+    '''Function to analyze how a run used the machine over time.
+
+    Parameters
+    ----------
+    nodes: list of dicts
+        from `callback_nodes`
+
+    min_gap_seconds: float
+        shortest period with no running nodes to report as idle
+
+    Returns
+    -------
+    dict
+        'start', 'finish', 'wall_seconds', 'node_seconds', 'nodes';
+        peak and time-weighted mean of concurrent 'nodes', 'threads' and
+        'memory_gb' as 'max_*' and 'mean_*'; 'timeline', a step function
+        of (time, nodes, threads, memory_gb); 'idle_gaps', a list of
+        (start, finish, seconds); and 'critical_path', the node ids of
+        the longest chain of nodes that each start after the previous one
+        finished, with its length as 'critical_path_seconds'. Callback
+        logs don't record dependencies, so that chain is an upper bound
+        on the true critical path.
+
+    Example
+    -------
+    >>> nodes = callback_nodes(iter_callback_records([
+    ...     '{"id": "a", "start": "2020-01-01T00:00:00", '
+    ...     '"finish": "2020-01-01T00:00:04", "num_threads": 2}',
+    ...     '{"id": "b", "start": "2020-01-01T00:00:02", '
+    ...     '"finish": "2020-01-01T00:00:03"}',
+    ...     '{"id": "c", "start": "2020-01-01T00:00:06", '
+    ...     '"finish": "2020-01-01T00:00:10"}']))
+    >>> timeline = callback_timeline(nodes)
+    >>> timeline['max_threads'], timeline['mean_threads']
+    (3, 1.3)
+    >>> [gap[2] for gap in timeline['idle_gaps']]
+    [2.0]
+    >>> timeline['critical_path'], timeline['critical_path_seconds']
+    (['a', 'c'], 8.0)
+    '''
+    if not nodes:
+        return {}
+    start = min(node['start'] for node in nodes)
+    finish = max(node['finish'] for node in nodes)
+    wall_seconds = (finish - start).total_seconds()
+
+    # sweep start and finish events; finishes sort before starts at a tie
+    events = sorted(
+        [(node['start'], 1, node) for node in nodes] +
+        [(node['finish'], -1, node) for node in nodes],
+        key=lambda event: (event[0], event[1])
+    )
+    running = [0, 0, 0.0]
+    peaks = [0, 0, 0.0]
+    areas = [0.0, 0.0, 0.0]
+    timeline = []
+    idle_gaps = []
+    previous = start
+    for time, sign, node in events:
+        seconds = (time - previous).total_seconds()
+        for i in range(3):
+            areas[i] += running[i] * seconds
+        if running[0] == 0 and seconds >= min_gap_seconds:
+            idle_gaps.append((previous, time, seconds))
+        running[0] += sign
+        running[1] += sign * node['threads']
+        running[2] += sign * node['memory_gb']
+        for i in range(3):
+            peaks[i] = max(peaks[i], running[i])
+        if timeline and timeline[-1][0] == time:
+            timeline[-1] = (time, *running)
+        else:
+            timeline.append((time, *running))
+        previous = time
+
+    path, path_seconds = _longest_chain(nodes)
+    return {
+        'start': start,
+        'finish': finish,
+        'wall_seconds': wall_seconds,
+        'node_seconds': sum(node['seconds'] for node in nodes),
+        'nodes': len(nodes),
+        'max_nodes': peaks[0],
+        'max_threads': peaks[1],
+        'max_memory_gb': peaks[2],
+        'mean_nodes': areas[0] / wall_seconds if wall_seconds else 0,
+        'mean_threads': areas[1] / wall_seconds if wall_seconds else 0,
+        'mean_memory_gb': areas[2] / wall_seconds if wall_seconds else 0,
+        'timeline': timeline,
+        'idle_gaps': idle_gaps,
+        'critical_path': path,
+        'critical_path_seconds': path_seconds
+    }
+
+
+def print_timeline_report(timeline, n_cpus=None, mem_gb=None, top=10):
+    '''Function to print a summary of `callback_timeline`.
+
+    Parameters
+    ----------
+    timeline: dict
+
+    n_cpus: int or None
+        number of CPUs the run was given, to report utilization against
+
+    mem_gb: float or None
+        memory the run was given, to report utilization against
+
+    top: int
+        number of nodes of the critical path to list
+    '''
+    if not timeline:
+        print('No finished nodes found.')
+        return
+    wall = timeline['wall_seconds']
+    print('Wall time: {0:.1f} s for {1} nodes ({2:.1f} node-seconds)'.format(
+        wall, timeline['nodes'], timeline['node_seconds']))
+    print('Concurrent nodes: max {0}, mean {1:.2f}'.format(
+        timeline['max_nodes'], timeline['mean_nodes']))
+    for key, label, budget in [('threads', 'Threads', n_cpus),
+                               ('memory_gb', 'Memory (GB)', mem_gb)]:
+        line = '{0}: max {1:.2f}, mean {2:.2f}'.format(
+            label, timeline['max_' + key], timeline['mean_' + key])
+        if budget:
+            line += ' of {0} ({1:.0%} mean utilization)'.format(
+                budget, timeline['mean_' + key] / budget)
+        print(line)
+    idle = sum(gap[2] for gap in timeline['idle_gaps'])
+    print('Idle: {0:.1f} s in {1} gaps ({2:.0%} of wall time)'.format(
+        idle, len(timeline['idle_gaps']), idle / wall if wall else 0))
+    print('Longest sequential chain: {0:.1f} s over {1} nodes ({2:.0%} '
+          'of wall time)'.format(
+              timeline['critical_path_seconds'],
+              len(timeline['critical_path']),
+              timeline['critical_path_seconds'] / wall if wall else 0))
+    for node_id in timeline['critical_path'][:top]:
+        print('    {0}'.format(node_id))
+    if len(timeline['critical_path']) > top:
+        print('    ...')
+
+
+def normalize_node_id(node_id):
+    '''Function to make a node id comparable across participants and
+    runs by masking participant and session labels.
+
+    Parameters
+    ----------
+    node_id: str
+
+    Returns
+    -------
+    str
+
+    Example
+    -------
+    >>> normalize_node_id('cpac_sub-0025427_ses-1.resting_preproc_'
+    ...                   'sub-0025427_ses-1.nuisance_0_0')
+    'cpac_sub-*_ses-*.resting_preproc_sub-*_ses-*.nuisance_0_0'
+    >>> normalize_node_id('resting_preproc_0025427_1.func_to_anat_0')
+    'resting_preproc_*_1.func_to_anat_0'
+    '''
+    return _PARTICIPANT_LABELS.sub(
+        lambda match: '{0}-*'.format(match.group(1)) if match.group(1)
+        else '*', node_id)
+
+
+def node_type_stats(nodes):
+    '''Function to aggregate node durations and memory by normalized
+    node id.
+
+    Parameters
+    ----------
+    nodes: list of dicts
+        from `callback_nodes`
+
+    Returns
+    -------
+    dict
+        {normalized node id: {'count', 'median_seconds', 'p95_seconds',
+                              'median_memory_gb', 'p95_memory_gb'}}
+    '''
+    grouped = {}
+    for node in nodes:
+        grouped.setdefault(normalize_node_id(node['id']), []).append(node)
+    return {node_type: {
+        'count': len(group),
+        'median_seconds': _percentile([n['seconds'] for n in group], 50),
+        'p95_seconds': _percentile([n['seconds'] for n in group], 95),
+        'median_memory_gb': _percentile([n['memory_gb'] for n in group], 50),
+        'p95_memory_gb': _percentile([n['memory_gb'] for n in group], 95)
+    } for node_type, group in grouped.items()}
+
+
+def compare_node_times(old_nodes, new_nodes, min_ratio=1.2, min_seconds=5.0):
+    '''Function to compare the median duration of each node type between
+    two runs.
+
+    Parameters
+    ----------
+    old_nodes: list of dicts
+        from `callback_nodes` for the baseline run
+
+    new_nodes: list of dicts
+        from `callback_nodes` for the run being checked
+
+    min_ratio: float
+        a node type must be at least this many times slower (or faster) to
+        count as a regression (or speedup)
+
+    min_seconds: float
+        ... and its median must change by at least this many seconds
+
+    Returns
+    -------
+    dict
+        'regressions' (slowest first) and 'speedups' (fastest first), lists
+        of {'node', 'old', 'new', 'ratio', 'delta_seconds'} where 'old'
+        and 'new' come from `node_type_stats`; and 'only_old' and
+        'only_new', lists of node types found in one run only
+
+    Example
+    -------
+    >>> old = [{'id': 'sub-1.a', 'seconds': 10, 'memory_gb': 1},
+    ...        {'id': 'sub-2.a', 'seconds': 12, 'memory_gb': 1},
+    ...        {'id': 'sub-1.b', 'seconds': 30, 'memory_gb': 1}]
+    >>> new = [{'id': 'sub-3.a', 'seconds': 30, 'memory_gb': 1},
+    ...        {'id': 'sub-3.b', 'seconds': 29, 'memory_gb': 1},
+    ...        {'id': 'sub-3.c', 'seconds': 1, 'memory_gb': 1}]
+    >>> comparison = compare_node_times(old, new)
+    >>> [(row['node'], row['ratio']) for row in comparison['regressions']]
+    [('sub-*.a', 2.727272727272727)]
+    >>> comparison['speedups'], comparison['only_new']
+    ([], ['sub-*.c'])
+    '''
+    old_stats = node_type_stats(old_nodes)
+    new_stats = node_type_stats(new_nodes)
+    rows = []
+    for node_type in old_stats:
+        if node_type not in new_stats:
+            continue
+        old_median = old_stats[node_type]['median_seconds']
+        new_median = new_stats[node_type]['median_seconds']
+        rows.append({
+            'node': node_type,
+            'old': old_stats[node_type],
+            'new': new_stats[node_type],
+            'ratio': new_median / old_median if old_median else float('inf'),
+            'delta_seconds': new_median - old_median
+        })
+    return {
+        'regressions': sorted([
+            row for row in rows if row['ratio'] >= min_ratio and
+            row['delta_seconds'] >= min_seconds
+        ], key=lambda row: row['delta_seconds'], reverse=True),
+        'speedups': sorted([
+            row for row in rows if row['ratio'] * min_ratio <= 1 and
+            -row['delta_seconds'] >= min_seconds
+        ], key=lambda row: row['delta_seconds']),
+        'only_old': sorted(set(old_stats) - set(new_stats)),
+        'only_new': sorted(set(new_stats) - set(old_stats))
+    }
+
+
+def print_regression_report(comparison, top=20):
+    '''Function to print a summary of `compare_node_times`.
+
+    Parameters
+    ----------
+    comparison: dict
+
+    top: int
+        number of regressions and of speedups to list
+    '''
+    for key, label in [('regressions', 'Regressions'),
+                       ('speedups', 'Speedups')]:
+        print('{0}: {1}'.format(label, len(comparison[key])))
+        for row in comparison[key][:top]:
+            print('    {0:+9.1f} s  x{1:<6.2f} median {2:.1f} -> {3:.1f} s, '
+                  'p95 {4:.1f} -> {5:.1f} s, median memory {6:.2f} -> '
+                  '{7:.2f} GB  {8}'.format(
+                      row['delta_seconds'], row['ratio'],
+                      row['old']['median_seconds'],
+                      row['new']['median_seconds'],
+                      row['old']['p95_seconds'], row['new']['p95_seconds'],
+                      row['old']['median_memory_gb'],
+                      row['new']['median_memory_gb'], row['node']))
+        if len(comparison[key]) > top:
+            print('    ...')
+    for key, label in [('only_old', 'Only in the baseline'),
+                       ('only_new', 'Only in the new run')]:
+        if comparison[key]:
+            print('{0}: {1} node types'.format(label, len(comparison[key])))
+
+
+def _percentile(values, percent):
+    '''Function to linearly interpolate a percentile.
+
+    Example
+    -------
+    >>> _percentile([1, 2, 3, 4], 50), _percentile([1, 2, 3, 4], 95)
+    (2.5, 3.85)
+    '''
+    values = sorted(values)
+    position = (len(values) - 1) * percent / 100.
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (
+        position - lower)
+
+
+def _longest_chain(nodes):
+    '''Function to find the chain of nodes, each starting at or after the
+    previous one's finish, with the greatest total duration.'''
+    ordered = sorted(nodes, key=lambda node: node['finish'])
+    finishes = [node['finish'] for node in ordered]
+    # best[i]: (length, index) of the longest chain ending at or before i
+    best = []
+    ends = []
+    for i, node in enumerate(ordered):
+        k = bisect.bisect_right(finishes, node['start'], 0, i)
+        previous = best[k - 1] if k else (0.0, None)
+        ends.append((previous[0] + node['seconds'], previous[1]))
+        best.append(max(best[-1], (ends[-1][0], i)) if best else (
+            ends[-1][0], i))
+    length, i = best[-1]
+    path = []
+    while i is not None:
+        path.append(ordered[i]['id'])
+        i = ends[i][1]
+    return path[::-1], length
+
+
+def _positive_number(value, default):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    if value <= 0:
+        return default
+    return int(value) if value.is_integer() else value
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sort the nodes in Nipype callback logs by duration.")
+
+    parser.add_argument("callback_logs", type=str, nargs="+",
+                        help="path(s) to callback log(s); the node times of "
+                             "several logs are written out together")
+
+    parser.add_argument("--num_cores", type=int, default=1,
+                        help="number of logs to parse at once "
+                             "(default: %(default)s)")
+
+    parser.add_argument("--out_file", type=str,
+                        help="(default: sorted_node_times.txt in the current "
+                             "directory)")
+
+    parser.add_argument("--timeline", action="store_true",
+                        help="report concurrency, CPU and memory occupancy, "
+                             "idle gaps and the critical path instead")
+
+    parser.add_argument("--n_cpus", type=int,
+                        help="CPUs the run was given (e.g., C-PAC's "
+                             "--n_cpus), for --timeline utilization")
+
+    parser.add_argument("--mem_gb", type=float,
+                        help="memory the run was given (e.g., C-PAC's "
+                             "--mem_gb), for --timeline utilization")
+
+    parser.add_argument("--compare", type=str, nargs="+",
+                        metavar="BASELINE_LOG",
+                        help="report node types that got slower or faster in "
+                             "CALLBACK_LOGS than in these baseline logs")
+
+    parser.add_argument("--min_ratio", type=float, default=1.2,
+                        help="with --compare, smallest ratio of median "
+                             "durations to report (default: %(default)s)")
+
+    parser.add_argument("--min_seconds", type=float, default=5.0,
+                        help="with --compare, smallest change in median "
+                             "duration to report (default: %(default)s)")
+
+    args = parser.parse_args()
+
+    if args.compare:
+        print_regression_report(compare_node_times(*[[
+            node for callback_log in callback_logs for
+            node in callback_nodes(iter_callback_records(
+                iter_callback_lines(callback_log)))
+        ] for callback_logs in [args.compare, args.callback_logs]],
+            args.min_ratio, args.min_seconds))
+        return
+
+    if args.timeline:
+        print_timeline_report(callback_timeline([
+            node for callback_log in args.callback_logs for
+            node in callback_nodes(iter_callback_records(
+                iter_callback_lines(callback_log)))
+        ]), args.n_cpus, args.mem_gb)
+        return
+
+    parsed = parse_callback_logs(args.callback_logs, args.num_cores)
+    sorted_time_dct = sorted(
+        [entry for times in parsed.values() for entry in times],
+        key=operator.itemgetter(1), reverse=True)
+    write_out_times(sorted_time_dct, args.out_file)
 
-import sys
 
-callback_lines = read_callback_lines(sys.argv[1])
-sorted_time_dct = parse_callback_times(callback_lines)
-write_out_times(sorted_time_dct)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+# coding=utf-8
+import json
+import os
+
+from contextlib import contextmanager
+
+MANIFEST = "manifest.json"
+JOURNAL = "cells.jsonl"
+
+
+class Cell_Journal:
+    """
+    A class for the metrics of each (subject × session, feature) cell of a
+    correlation matrix run, with fingerprints (path, size and mtime) of
+    the cell's inputs, kept in the run's output directory so a later run
+    can reuse the cells whose inputs haven't changed. Completed cells are
+    appended to ``cells.jsonl`` as they're calculated, so an interrupted
+    run resumes where it stopped; `commit` folds them into
+    ``manifest.json`` once the run's outputs are written.
+    """
+    def __init__(self, output_dir, runs, metric_names):
+        """
+        Parameters
+        ----------
+        output_dir: str
+            directory of the run's outputs
+
+        runs: list of dicts
+            [{"software": str, "run_path": str}]; cells recorded for
+            other runs aren't reused
+
+        metric_names: list of str
+            metrics recorded for each cell; cells recorded with other
+            metrics aren't reused
+        """
+        self.manifest_path = os.path.join(output_dir, MANIFEST)
+        self.journal_path = os.path.join(output_dir, JOURNAL)
+        self.header = {"runs": runs, "metric_names": list(metric_names)}
+        self.cells = {}
+        self._journal = None
+        try:
+            with open(self.manifest_path, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest["header"] == self.header:
+                self.cells.update({
+                    (cell["subject"], cell["feature"]): cell for
+                    cell in manifest["cells"]
+                })
+        except (OSError, ValueError, KeyError):
+            pass
+        try:
+            with open(self.journal_path, "r") as journal_file:
+                text = journal_file.read()
+        except OSError:
+            text = ""
+        lines = text.splitlines()
+        if lines and _parse(lines[0]) == self.header:
+            for line in lines[1:]:
+                # the last line is incomplete if a run stopped mid-write
+                cell = _parse(line)
+                if cell is not None:
+                    self.cells[(cell["subject"], cell["feature"])] = cell
+            self._journal = open(self.journal_path, "a")
+            if not text.endswith("\n"):
+                self._journal.write("\n")
+
+    def __getstate__(self):
+        # worker processes only look cells up
+        return({**self.__dict__, "_journal": None})
+
+    @staticmethod
+    def fingerprints(paths, feature, runs):
+        """
+        Method to fingerprint a cell's inputs in each run
+
+        Parameters
+        ----------
+        paths: 2-tuple of lists of str
+            the cell's files in each run
+
+        feature: str
+
+        runs: list of dicts
+            [{"software": str, "run_path": str}]
+
+        Returns
+        -------
+        list of str or None
+            `Feature_Cache.key` for each run, None for a run whose inputs
+            weren't found
+        """
+        try:
+            from feature_cache import Feature_Cache
+        except ModuleNotFoundError:
+            from .feature_cache import Feature_Cache
+
+        return([Feature_Cache.key(run_paths, feature, run["software"]) for
+                run_paths, run in zip(paths, runs)])
+
+    def previous(self, subject, feature, fingerprints):
+        """
+        Method to return a cell's recorded metrics if its inputs are
+        unchanged. Cells with inputs that weren't found are never reused.
+
+        Parameters
+        ----------
+        subject: str
+            (subject × session)
+
+        feature: str
+
+        fingerprints: list of str or None
+            see `fingerprints`
+
+        Returns
+        -------
+        list of float or None
+        """
+        cell = self.cells.get((subject, feature))
+        if cell is None or None in fingerprints or (
+            cell["fingerprints"] != fingerprints
+        ):
+            return(None)
+        return(cell["metrics"])
+
+    def record(self, cells):
+        """
+        Method to append completed cells to the journal
+
+        Parameters
+        ----------
+        cells: iterable of 4-tuples
+            (subject, feature, fingerprints, metrics)
+        """
+        if self._journal is None:
+            self._journal = open(self.journal_path, "w")
+            self._journal.write(f"{json.dumps(self.header)}\n")
+        for subject, feature, fingerprints, metrics in cells:
+            cell = {"subject": subject, "feature": feature,
+                    "fingerprints": fingerprints,
+                    "metrics": [float(metric) for metric in metrics]}
+            self.cells[(subject, feature)] = cell
+            self._journal.write(f"{json.dumps(cell)}\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def commit(self):
+        """
+        Method to write every recorded cell to the manifest and start a
+        new journal
+        """
+        with atomic_path(self.manifest_path) as tmp_path:
+            with open(tmp_path, "w") as manifest_file:
+                json.dump({
+                    "header": self.header,
+                    "cells": list(self.cells.values())
+                }, manifest_file)
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        try:
+            os.remove(self.journal_path)
+        except OSError:
+            pass
+
+
+@contextmanager
+def atomic_path(path):
+    """
+    Context manager for writing a file atomically: yields a temporary path
+    with the same extension, then replaces `path` with it if the block
+    succeeds
+
+    Parameters
+    ----------
+    path: str
+
+    Yields
+    ------
+    str
+
+    Example
+    -------
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     path = os.path.join(tmp_dir, "a.csv")
+    ...     with atomic_path(path) as tmp_path:
+    ...         with open(tmp_path, "w") as f:
+    ...             _ = f.write("a")
+    ...     os.listdir(tmp_dir)
+    ['a.csv']
+    """
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.tmp{os.getpid()}{ext}"
+    try:
+        yield(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _parse(line):
+    try:
+        return(json.loads(line))
+    except ValueError:
+        return(None)
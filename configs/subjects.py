@@ -46,7 +46,8 @@ def fmriprep_sub(sub):
     return(f"{sub.split('_')[0]}{ascii_lowercase[int(sub[-1])-1]}")
 
 
-def generate_subject_list_for_directory(path, old_outputs_software="C-PAC"):
+def generate_subject_list_for_directory(path, old_outputs_software="C-PAC",
+                                        index=None):
     """
     Function to take a path and return a subject list.
 
@@ -56,19 +57,30 @@ def generate_subject_list_for_directory(path, old_outputs_software="C-PAC"):
 
     old_outputs_software: str, optional, default="C-PAC"
 
+    index: Path_Index or None, optional
+        index of `path` to list instead of the filesystem, e.g., for an
+        ``s3://`` path
+
     Returns
     -------
     sub_list: list
     """
     output = os.path.join(path, "output")
-    sub_ses_list = list(chain.from_iterable([[
-        d for d in os.listdir(
-            os.path.join(output, o)
-        ) if all([
-            os.path.isdir(os.path.join(output, o, d)),
-            d not in ["log", "logs"]
-        ])
-    ] for o in os.listdir(output)]))
+    if index is not None:
+        sub_ses_list = [
+            d.rstrip("/").rsplit("/", 1)[-1] for d in index.glob(
+                os.path.join(output, "*", "*", "")
+            ) if d.rstrip("/").rsplit("/", 1)[-1] not in ["log", "logs"]
+        ]
+    else:
+        sub_ses_list = list(chain.from_iterable([[
+            d for d in os.listdir(
+                os.path.join(output, o)
+            ) if all([
+                os.path.isdir(os.path.join(output, o, d)),
+                d not in ["log", "logs"]
+            ])
+        ] for o in os.listdir(output)]))
     return(sessions_together([
         cpac_sub(s) if s[
             -1
@@ -1,9 +1,11 @@
 #!/usr/bin/python
 
 import numpy as np
-import scipy
-from scipy import stats
-import pandas as pd
+
+try:
+    from file_hashes import files_identical
+except ModuleNotFoundError:
+    from .file_hashes import files_identical
 
 
 def read_txt_file(txt_file):
@@ -13,6 +15,8 @@ def read_txt_file(txt_file):
 
 
 def read_csv_into_df(csv_file, header_row=None):
+    import pandas as pd
+
     if header_row:
         csvdf = pd.read_csv(csv_file, header=header_row, delimiter="\t", comment="#")
     else:
@@ -33,8 +37,8 @@ def concordance(x, y, rho):
     import math
     import numpy as np
 
-    map(float, x)
-    map(float, y)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
     xvar = np.var(x)
     yvar = np.var(y)
     #rho = scipy.stats.pearsonr(x, y)[0]
@@ -45,29 +49,87 @@ def concordance(x, y, rho):
 
 
 def correlate(data_1, data_2):
+    import scipy.stats
+
     pearson = scipy.stats.pearsonr(data_1, data_2)[0]
     concor = concordance(data_1, data_2, pearson)
     return concor
 
 
-def quick_corr_csv(csv_1, csv_2):
-    csv_1_data = read_csv_into_df(csv_1)
-    csv_2_data = read_csv_into_df(csv_2)
+def compare_columns(data_1, data_2):
+    """
+    Calculates Pearson's r and Lin's concordance correlation coefficient
+    for every column the two DataFrames share by name, all at once.
+
+    Rows are aligned to the tail if the lengths differ, and rows where
+    either value is NaN are left out of that column's statistics.
+
+    Usage: compare_columns(data_1, data_2) where data_1, data_2 are
+    DataFrames
+    Returns: (DataFrame of "pearson" and "concordance" indexed by column,
+              (columns only in data_1, columns only in data_2))
+
+    Example
+    -------
+    >>> import pandas as pd
+    >>> data_1 = pd.DataFrame({"a": [1., 2, 3, 4], "b": [1., 2, 3, np.nan],
+    ...                        "c": [0., 0, 0, 0]})
+    >>> data_2 = pd.DataFrame({"b": [1., 2, 4, 8], "a": [2., 3, 4, 5],
+    ...                        "d": [1., 2, 3, 4]})
+    >>> compare_columns(data_1, data_2)[0].round(3)
+       pearson  concordance
+    a    1.000        0.714
+    b    0.982        0.857
+    >>> compare_columns(data_1, data_2)[1]
+    (['c'], ['d'])
+    """
+    import pandas as pd
+
+    shared = [col for col in data_1.columns if col in data_2.columns]
+    unmatched = ([col for col in data_1.columns if col not in data_2.columns],
+                 [col for col in data_2.columns if col not in data_1.columns])
+    length = min(len(data_1), len(data_2))
+    x = data_1[shared].iloc[len(data_1) - length:].apply(
+        pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+    y = data_2[shared].iloc[len(data_2) - length:].apply(
+        pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+    mask = ~(np.isnan(x) | np.isnan(y))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        n = mask.sum(axis=0)
+        x_mean = np.where(mask, x, 0).sum(axis=0) / n
+        y_mean = np.where(mask, y, 0).sum(axis=0) / n
+        dx = np.where(mask, x - x_mean, 0)
+        dy = np.where(mask, y - y_mean, 0)
+        x_var = (dx * dx).sum(axis=0) / n
+        y_var = (dy * dy).sum(axis=0) / n
+        cov = (dx * dy).sum(axis=0) / n
+        pearson = np.clip(cov / np.sqrt(x_var * y_var), -1.0, 1.0)
+        concor = 2. * cov / (x_var + y_var + (x_mean - y_mean)**2)
+    return(pd.DataFrame({"pearson": pearson, "concordance": concor},
+                        index=shared), unmatched)
 
-    concors = []
 
-    for col, col2 in zip(csv_1_data, csv_2_data):
-        try:
-            concor = correlate(csv_1_data[col], csv_2_data[col2])
-            concors.append(concor)
-            print("{0}: {1}".format(col2, concor))
-        except KeyError:
-            print("different name now - {0}".format(col))
+def quick_corr_csv(csv_1, csv_2):
+    csv_1_data = read_csv_into_df(csv_1)
+    if files_identical(csv_1, csv_2):
+        # read once; each column still correlates as NaN if it's constant
+        print("Files are identical")
+        csv_2_data = csv_1_data
     else:
+        csv_2_data = read_csv_into_df(csv_2)
+
+    if csv_1_data.shape != csv_2_data.shape:
         print("Data not same shape")
 
+    stats, unmatched = compare_columns(csv_1_data, csv_2_data)
+
+    for col, concor in stats["concordance"].items():
+        print("{0}: {1}".format(col, concor))
+    for col in unmatched[0] + unmatched[1]:
+        print("different name now - {0}".format(col))
+
     print("\nAverage concordance correlation of all columns:")
-    print(np.asarray(concors).mean())
+    print(stats["concordance"].mean())
 
 
 def main():
@@ -1,28 +1,395 @@
-import sys
-import scipy
-from scipy import stats
-import nibabel as nb
+import argparse
+import gzip
 import numpy as np
+import os
+import shutil
+import tempfile
 
-cpac_func_img = nb.load(str(sys.argv[1]))
+from concurrent.futures import ProcessPoolExecutor
 
-fmriprep_func_img = nb.load(str(sys.argv[2]))
+try:
+    from file_hashes import files_identical
+except ModuleNotFoundError:
+    from .file_hashes import files_identical
 
-cpac_func_data = cpac_func_img.get_data()
-fmriprep_func_data = fmriprep_func_img.get_data()
 
-if len(cpac_func_img.shape) < 4 or len(fmriprep_func_img.shape) < 4:
-    raise Exception("\n\n[!] At least one of the input files is not a " \
-                    "4D/time series dataset.\n")
+def voxelwise_corr(data1, data2):
+    """
+    Function to calculate Pearson's r between the time series of each
+    voxel of two 4D arrays. Time series of different lengths are aligned
+    to the tail.
 
-ts_corrs = []
+    Parameters
+    ----------
+    data1: np.ndarray
+        4D array, time last
 
-for i in range(0, cpac_func_img.shape[0]):
-    for j in range(0, cpac_func_img.shape[1]):
-        for k in range(0, cpac_func_img.shape[2]):
-            ts_corrs.append(scipy.stats.pearsonr(cpac_func_data[i][j][k], fmriprep_func_data[i][j][k])[0])
+    data2: np.ndarray
+        4D array, time last
 
-ts_corrs = np.asarray(ts_corrs)
-ts_corrs = ts_corrs[~np.isnan(ts_corrs)]
+    Returns
+    -------
+    r_map: np.ndarray
+        3D array of Pearson's r, NaN where either time series is constant
 
-print(ts_corrs.mean())
+    Example
+    -------
+    >>> data1 = np.arange(24, dtype=float).reshape(1, 2, 3, 4)
+    >>> data2 = data1 ** 2
+    >>> data2[0, 0, 0] = 7
+    >>> voxelwise_corr(data1, data2).round(3)
+    array([[[  nan, 0.997, 0.999],
+            [0.999, 1.   , 1.   ]]])
+    """
+    if data1.shape[:3] != data2.shape[:3]:
+        raise Exception("\n\n[!] The input files do not have the same "
+                        "dimensions.\n")
+    length = min(data1.shape[-1], data2.shape[-1])
+    data1 = data1[..., data1.shape[-1] - length:]
+    data2 = data2[..., data2.shape[-1] - length:]
+    valid = (np.ptp(data1, axis=-1) > 0) & (np.ptp(data2, axis=-1) > 0)
+    x = np.asarray(data1[valid], dtype=np.float64)
+    y = np.asarray(data2[valid], dtype=np.float64)
+    x -= x.mean(axis=-1, keepdims=True)
+    y -= y.mean(axis=-1, keepdims=True)
+    x /= np.sqrt(np.einsum("ij,ij->i", x, x))[:, None]
+    y /= np.sqrt(np.einsum("ij,ij->i", y, y))[:, None]
+    r_map = np.full(valid.shape, np.nan)
+    r_map[valid] = np.clip(np.einsum("ij,ij->i", x, y), -1.0, 1.0)
+    return(r_map)
+
+
+def streaming_voxelwise_corr(img1, img2, max_memory_mb=1024):
+    """
+    Function to calculate the same r-map as `voxelwise_corr` while reading
+    both images a slab of volumes at a time through their array proxies,
+    so that memory use is bounded by `max_memory_mb` rather than by the
+    size of the images
+
+    Parameters
+    ----------
+    img1: nibabel image
+        4D image
+
+    img2: nibabel image
+        4D image
+
+    max_memory_mb: int or float
+        approximate memory budget in MB
+
+    Returns
+    -------
+    r_map: np.ndarray
+        3D array of Pearson's r, NaN where either time series is constant
+    """
+    shape = img1.shape[:3]
+    if shape != img2.shape[:3]:
+        raise Exception("\n\n[!] The input files do not have the same "
+                        "dimensions.\n")
+    length = min(img1.shape[3], img2.shape[3])
+    offsets = (img1.shape[3] - length, img2.shape[3] - length)
+    n_voxels = int(np.prod(shape))
+    # 6 sums + 4 running extrema, float64
+    accumulator_bytes = 10 * 8 * n_voxels
+    # each volume pair is held as read and as shifted float64 copies
+    volume_pair_bytes = 2 * 3 * 8 * n_voxels
+    slab = max(1, int(
+        (max_memory_mb * 2**20 - accumulator_bytes) // volume_pair_bytes
+    ))
+    stats = _Slab_Statistics(shape)
+    for start in range(0, length, slab):
+        stop = min(start + slab, length)
+        stats.update(
+            img1.dataobj[..., offsets[0] + start:offsets[0] + stop],
+            img2.dataobj[..., offsets[1] + start:offsets[1] + stop]
+        )
+    return(stats.r_map())
+
+
+def any_voxel_varies(img, max_memory_mb=1024):
+    """
+    Function to check whether any voxel's time series in a 4D image
+    varies, i.e., whether correlating the image with itself gives an r
+    for any voxel rather than an all-NaN r-map. The image is read a slab
+    of volumes at a time, so memory use is bounded by `max_memory_mb`.
+
+    Parameters
+    ----------
+    img: nibabel image
+        4D image
+
+    max_memory_mb: int or float
+        approximate memory budget in MB
+
+    Returns
+    -------
+    bool
+
+    Example
+    -------
+    >>> import nibabel as nb
+    >>> data = np.ones((2, 2, 2, 5))
+    >>> any_voxel_varies(nb.Nifti1Image(data, np.eye(4)))
+    False
+    >>> data[1, 0, 1, 4] = 2
+    >>> any_voxel_varies(nb.Nifti1Image(data, np.eye(4)), 1e-4)
+    True
+    """
+    n_voxels = int(np.prod(img.shape[:3]))
+    # running minimum and maximum, float64
+    extrema_bytes = 2 * 8 * n_voxels
+    # each volume is held as read and as a float64 copy
+    slab = max(1, int(
+        (max_memory_mb * 2**20 - extrema_bytes) // (2 * 8 * n_voxels)
+    ))
+    minimum = maximum = None
+    for start in range(0, img.shape[3], slab):
+        data = np.asarray(img.dataobj[..., start:start + slab],
+                          dtype=np.float64)
+        if minimum is None:
+            minimum, maximum = data.min(axis=-1), data.max(axis=-1)
+        else:
+            np.minimum(minimum, data.min(axis=-1), out=minimum)
+            np.maximum(maximum, data.max(axis=-1), out=maximum)
+    return(minimum is not None and bool((maximum > minimum).any()))
+
+
+class _Slab_Statistics:
+    """
+    A class for per-voxel sufficient statistics of two time series,
+    accumulated a slab of volumes at a time. Values are shifted by each
+    voxel's first value to keep the sums well-conditioned.
+    """
+    def __init__(self, shape):
+        self.n = 0
+        self.shift = None
+        self.sums = np.zeros((5,) + tuple(shape))
+        self.minmax = None
+
+    def update(self, slab1, slab2):
+        slab1 = np.array(slab1, dtype=np.float64)
+        slab2 = np.array(slab2, dtype=np.float64)
+        if self.shift is None:
+            self.shift = (slab1[..., 0].copy(), slab2[..., 0].copy())
+            self.minmax = [slab1.min(axis=-1), slab1.max(axis=-1),
+                           slab2.min(axis=-1), slab2.max(axis=-1)]
+        else:
+            np.minimum(self.minmax[0], slab1.min(axis=-1),
+                       out=self.minmax[0])
+            np.maximum(self.minmax[1], slab1.max(axis=-1),
+                       out=self.minmax[1])
+            np.minimum(self.minmax[2], slab2.min(axis=-1),
+                       out=self.minmax[2])
+            np.maximum(self.minmax[3], slab2.max(axis=-1),
+                       out=self.minmax[3])
+        slab1 -= self.shift[0][..., None]
+        slab2 -= self.shift[1][..., None]
+        self.n += slab1.shape[-1]
+        self.sums[0] += slab1.sum(axis=-1)
+        self.sums[1] += slab2.sum(axis=-1)
+        self.sums[2] += np.einsum("...t,...t->...", slab1, slab1)
+        self.sums[3] += np.einsum("...t,...t->...", slab2, slab2)
+        self.sums[4] += np.einsum("...t,...t->...", slab1, slab2)
+
+    def r_map(self):
+        r_map = np.full(self.sums.shape[1:], np.nan)
+        if not self.n:
+            return(r_map)
+        valid = (self.minmax[1] > self.minmax[0]) & (
+            self.minmax[3] > self.minmax[2]
+        )
+        sx, sy, sxx, syy, sxy = self.sums[:, valid]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r_map[valid] = np.clip((sxy - sx * sy / self.n) / np.sqrt(
+                (sxx - sx * sx / self.n) * (syy - sy * sy / self.n)
+            ), -1.0, 1.0)
+        return(r_map)
+
+
+def parallel_voxelwise_corr(func1, func2, num_cores, chunks_per_core=4):
+    """
+    Function to calculate the same r-map as `voxelwise_corr` across a pool
+    of worker processes, each correlating a slab of slices. Workers
+    memory-map the uncompressed data rather than receiving pickled arrays;
+    gzipped inputs are decompressed once to a temporary file first.
+
+    Parameters
+    ----------
+    func1: str
+        path to a 4D NIfTI image
+
+    func2: str
+        path to a 4D NIfTI image
+
+    num_cores: int
+        number of worker processes
+
+    chunks_per_core: int
+        number of slabs per worker, for load balancing
+
+    Returns
+    -------
+    r_map: np.ndarray
+        3D array of Pearson's r, NaN where either time series is constant
+
+    mean_r: float
+        mean of the non-NaN values of `r_map`
+    """
+    import nibabel as nb
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        func1, func2 = [
+            _uncompressed(func, os.path.join(tmp_dir, f"func{i}.nii"))
+            for i, func in enumerate([func1, func2])
+        ]
+        shape = nb.load(func1).shape[:3]
+        if shape != nb.load(func2).shape[:3]:
+            raise Exception("\n\n[!] The input files do not have the same "
+                            "dimensions.\n")
+        r_map_file = os.path.join(tmp_dir, "r_map.npy")
+        np.lib.format.open_memmap(
+            r_map_file, mode="w+", dtype=np.float64, shape=shape
+        ).flush()
+        bounds = np.linspace(
+            0, shape[2], min(shape[2], num_cores * chunks_per_core) + 1
+        ).astype(int)
+        with ProcessPoolExecutor(max_workers=num_cores) as executor:
+            partials = list(executor.map(_correlate_slab, *zip(*[
+                (func1, func2, r_map_file, start, stop) for start, stop in
+                zip(bounds[:-1], bounds[1:])
+            ])))
+        r_map = np.array(np.load(r_map_file, mmap_mode="r"))
+    total = sum([partial[0] for partial in partials])
+    count = sum([partial[1] for partial in partials])
+    return(r_map, total / count if count else np.nan)
+
+
+def _correlate_slab(func1, func2, r_map_file, start, stop):
+    """
+    Function to correlate slices [start, stop) of two uncompressed 4D
+    images and write them into a memory-mapped r-map
+
+    Returns
+    -------
+    sum of r: float
+
+    count of non-NaN r: int
+    """
+    r_slab = voxelwise_corr(
+        _memmap_slab(func1, start, stop), _memmap_slab(func2, start, stop)
+    )
+    r_map = np.load(r_map_file, mmap_mode="r+")
+    r_map[:, :, start:stop] = r_slab
+    r_map.flush()
+    valid = ~np.isnan(r_slab)
+    return(float(r_slab[valid].sum()), int(valid.sum()))
+
+
+def _memmap_slab(func, start, stop):
+    import nibabel as nb
+
+    proxy = nb.load(func).dataobj
+    data = np.memmap(
+        func,
+        dtype=proxy.dtype,
+        mode="r",
+        offset=proxy.offset,
+        shape=proxy.shape,
+        order=proxy.order
+    )[:, :, start:stop]
+    if proxy.slope == 1 and proxy.inter == 0:
+        return(data)
+    return(data * proxy.slope + proxy.inter)
+
+
+def _uncompressed(func, tmp_path):
+    if not func.endswith(".gz"):
+        return(func)
+    with gzip.open(func, "rb") as compressed, open(tmp_path, "wb") as out:
+        shutil.copyfileobj(compressed, out, 2**24)
+    return(tmp_path)
+
+
+def save_r_map(r_map, reference_img, out_file):
+    """
+    Function to save an r-map as a NIfTI image
+
+    Parameters
+    ----------
+    r_map: np.ndarray
+        3D array
+
+    reference_img: nibabel image
+        image to take the affine and header from
+
+    out_file: str
+    """
+    import nibabel as nb
+
+    header = reference_img.header.copy()
+    header.set_data_dtype(np.float32)
+    nb.Nifti1Image(
+        r_map.astype(np.float32), reference_img.affine, header
+    ).to_filename(out_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Calculate the mean voxelwise correlation between two "
+                    "4D images."
+    )
+
+    parser.add_argument("func1", type=str)
+    parser.add_argument("func2", type=str)
+
+    parser.add_argument("--r_map", type=str,
+                        help="path to save the voxelwise r-map to as NIfTI")
+
+    parser.add_argument("--max_memory", type=float,
+                        help="stream both images a slab of volumes at a time, "
+                             "using about this many MB")
+
+    parser.add_argument("--num_cores", type=int, default=1,
+                        help="number of processes to correlate slabs of "
+                             "slices in (default: %(default)s)")
+
+    args = parser.parse_args()
+
+    import nibabel as nb
+
+    cpac_func_img = nb.load(args.func1)
+    fmriprep_func_img = nb.load(args.func2)
+
+    if len(cpac_func_img.shape) < 4 or len(fmriprep_func_img.shape) < 4:
+        raise Exception("\n\n[!] At least one of the input files is not a " \
+                        "4D/time series dataset.\n")
+
+    # byte-identical images correlate perfectly wherever a voxel's time
+    # series varies, so only one of them needs reading
+    if not args.r_map and files_identical(args.func1, args.func2):
+        print(1.0 if any_voxel_varies(
+            cpac_func_img, args.max_memory or 1024
+        ) else np.nan)
+        return
+
+    if args.num_cores > 1:
+        r_map, mean_r = parallel_voxelwise_corr(
+            args.func1, args.func2, args.num_cores
+        )
+    else:
+        r_map = streaming_voxelwise_corr(
+            cpac_func_img, fmriprep_func_img, args.max_memory
+        ) if args.max_memory else voxelwise_corr(
+            np.asanyarray(cpac_func_img.dataobj),
+            np.asanyarray(fmriprep_func_img.dataobj)
+        )
+        mean_r = np.nanmean(r_map)
+
+    if args.r_map:
+        save_r_map(r_map, cpac_func_img, args.r_map)
+
+    print(mean_r)
+
+
+if __name__ == "__main__":
+    main()
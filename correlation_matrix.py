@@ -1,47 +1,87 @@
 # coding=utf-8
 import sys
 
-if (sys.version_info < (3, 6)):
-    raise EnvironmentError("This module requires Python 3.6 or newer.")
+if (sys.version_info < (3, 7)):
+    raise EnvironmentError("This module requires Python 3.7 or newer.")
 
 import argparse
-import glob
+import multiprocessing
 import numpy as np
 import os
-import pandas as pd
-import scipy.io as sio
+import tempfile
 
-from afnipy.lib_afni1D import Afni1D
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from itertools import chain
-from scipy.stats import pearsonr
-from tabulate import tabulate
 
 try:
     from configs.defaults import feature_headers, motion_list, regressor_list, \
                                  software
+    from cell_journal import Cell_Journal, atomic_path
     from configs.subjects import fmriprep_sub, \
                                  generate_subject_list_for_directory
-    from heatmaps import generate_heatmap, reshape_corrs
+    from feature_cache import Feature_Cache
+    from file_hashes import Digest_Cache
+    from labeled_matrix import Labeled_Matrix
+    from parse_cache import parsed_files, read_1D, read_lines, read_table
+    from path_index import glob_run, index_run, register_indices, \
+                           registered_indices
+    from profiling import profiler
+    from s3_inputs import S3_Store, index_s3_run, is_s3_path, prefetch, \
+                          register_store, register_worker_store, \
+                          registered_store
 except ModuleNotFoundError:
     from .configs.defaults import feature_headers, motion_list, regressor_list,\
                                   software
+    from .cell_journal import Cell_Journal, atomic_path
     from .configs.subjects import fmriprep_sub, \
                                   generate_subject_list_for_directory
-    from .heatmaps import generate_heatmap, reshape_corrs
+    from .feature_cache import Feature_Cache
+    from .file_hashes import Digest_Cache
+    from .labeled_matrix import Labeled_Matrix
+    from .parse_cache import parsed_files, read_1D, read_lines, read_table
+    from .path_index import glob_run, index_run, register_indices, \
+                            registered_indices
+    from .profiling import profiler
+    from .s3_inputs import S3_Store, index_s3_run, is_s3_path, prefetch, \
+                           register_store, register_worker_store, \
+                           registered_store
+
+metric_names = ["pearson", "concordance", "spearman", "max_abs_diff", "rmse"]
+# metrics recorded for byte-identical inputs without correlating them, if
+# the feature was found and varies
+identical_metrics = [1.0, 1.0, 1.0, 0.0, 0.0]
+
+def feature_definition_table():
+    """
+    Function to tabulate the features that have definitions for both
+    C-PAC and fmriprep
+
+    Returns
+    -------
+    str
+    """
+    from tabulate import tabulate
 
-sorted_keys = list(feature_headers.keys())
-sorted_keys.sort(key=str.lower)
-feat_def_table = tabulate(
-    [
+    return(tabulate(
         [
-            key,
-            feature_headers[key].get("name"),
-            feature_headers[key].get("link")
-        ] for key in sorted_keys
-    ],
-    headers=["key", "feature name", "documentation link"]
-)
-del(sorted_keys)
+            [
+                key,
+                feature_headers[key].get("name"),
+                feature_headers[key].get("link")
+            ] for key in sorted(feature_headers, key=str.lower)
+        ],
+        headers=["key", "feature name", "documentation link"]
+    ))
+
+
+def __getattr__(name):
+    # `feat_def_table` is built on first access rather than on import
+    # (module-level __getattr__ needs Python 3.7)
+    if name == "feat_def_table":
+        return(feature_definition_table())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 def calc_corr(data1, data2):
     """
@@ -52,31 +92,189 @@ def calc_corr(data1, data2):
     data1: np.ndarray or list
 
     data2: np.ndarray or list
+
+    Returns
+    -------
+    float
+
+    Example
+    -------
+    >>> round(calc_corr([0, 1, 2, 3], [1, 2, 4]), 3)
+    0.982
+    >>> calc_corr(None, [1, 2, 4])
+    nan
     """
-    if not any([
-        data1 is None,
-        data2 is None
-    ]):
-        if isinstance(data1, np.ndarray) and data1.shape == data2.shape:
-            return(pearsonr(data1.flatten(), data2.flatten())[0])
-        lens = (len(data1), len(data2))
-        if lens[0]==lens[1]:
-            return(pearsonr(data1, data2)[0])
-        if lens[0]>lens[1]:
-            return(pearsonr(data1[lens[0]-lens[1]:], data2)[0])
-        if lens[0]<lens[1]:
-            return(pearsonr(data1, data2[lens[1]-lens[0]:])[0])
-    return(float(np.nan))
+    return(float(calc_corrs([(data1, data2)])[0]))
+
+
+def calc_corrs(pairs):
+    """
+    Function to calculate Pearson's r for many pairs of np.ndarrays or
+    lists at once. Pairs of different lengths are aligned to the tail
+    (the longer one is truncated from the start) and pairs with a missing
+    member get NaN, as in `calc_corr`.
+
+    Parameters
+    ----------
+    pairs: iterable of 2-tuples of np.ndarray, list or None
+
+    Returns
+    -------
+    corrs: np.ndarray
+        1D array of Pearson's r, one per pair
+
+    Example
+    -------
+    >>> calc_corrs([
+    ...     ([1, 2, 3], [1, 2, 4]),
+    ...     (None, [1, 2, 4]),
+    ...     ([0, 1, 2, 3], [1, 2, 4]),
+    ...     ([1, 1, 1], [1, 2, 4])
+    ... ]).round(3)
+    array([0.982,   nan, 0.982,   nan])
+    """
+    x, y, mask = _pack_pairs(pairs)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        n = mask.sum(axis=1)
+        dx = (x - (x.sum(axis=1) / n)[:, None]) * mask
+        dy = (y - (y.sum(axis=1) / n)[:, None]) * mask
+        corrs = (dx * dy).sum(axis=1) / np.sqrt(
+            (dx * dx).sum(axis=1) * (dy * dy).sum(axis=1)
+        )
+    corrs[n < 2] = np.nan
+    return(np.clip(corrs, -1.0, 1.0))
+
+
+def calc_metrics(pairs):
+    """
+    Function to calculate several agreement metrics for many pairs of
+    np.ndarrays or lists in one pass: Pearson's r, Lin's concordance
+    correlation coefficient, Spearman's rho, maximum absolute difference
+    and root-mean-square error, in the order of `metric_names`. Pairs are
+    aligned as in `calc_corrs`.
+
+    Parameters
+    ----------
+    pairs: iterable of 2-tuples of np.ndarray, list or None
+
+    Returns
+    -------
+    metrics: np.ndarray
+        (number of pairs, number of metrics) array
+
+    Example
+    -------
+    >>> calc_metrics([
+    ...     ([0, 1, 2, 3], [1, 2, 4]),
+    ...     ([1, 2, 3], [2, 3, 4]),
+    ...     (None, [1, 2, 4])
+    ... ]).round(3)
+    array([[0.982, 0.857, 1.   , 1.   , 0.577],
+           [1.   , 0.571, 1.   , 1.   , 1.   ],
+           [  nan,   nan,   nan,   nan,   nan]])
+    """
+    from scipy.stats import rankdata
+
+    x, y, mask = _pack_pairs(pairs)
+    metrics = np.full((len(x), len(metric_names)), np.nan)
+    if not x.size:
+        return(metrics)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        n = mask.sum(axis=1)
+        x_mean = x.sum(axis=1) / n
+        y_mean = y.sum(axis=1) / n
+        dx = (x - x_mean[:, None]) * mask
+        dy = (y - y_mean[:, None]) * mask
+        x_var = (dx * dx).sum(axis=1) / n
+        y_var = (dy * dy).sum(axis=1) / n
+        cov = (dx * dy).sum(axis=1) / n
+        metrics[:, 0] = cov / np.sqrt(x_var * y_var)
+        metrics[:, 1] = 2 * cov / (x_var + y_var + (x_mean - y_mean)**2)
+        # padding ranks after every real value, so it can't shift their ranks
+        x_ranks = rankdata(np.where(mask, x, np.inf), axis=1)
+        y_ranks = rankdata(np.where(mask, y, np.inf), axis=1)
+        rx = (x_ranks - ((x_ranks * mask).sum(axis=1) / n)[:, None]) * mask
+        ry = (y_ranks - ((y_ranks * mask).sum(axis=1) / n)[:, None]) * mask
+        metrics[:, 2] = (rx * ry).sum(axis=1) / np.sqrt(
+            (rx * rx).sum(axis=1) * (ry * ry).sum(axis=1)
+        )
+        diff = np.abs(x - y) * mask
+        metrics[:, 3] = diff.max(axis=1)
+        metrics[:, 4] = np.sqrt((diff * diff).sum(axis=1) / n)
+    metrics[:, [0, 2]] = np.clip(metrics[:, [0, 2]], -1.0, 1.0)
+    metrics[n < 2, :3] = np.nan
+    metrics[n < 1] = np.nan
+    return(metrics)
+
+
+def _pack_pairs(pairs):
+    """
+    Function to pack pairs of vectors into zero-padded 2D arrays
+
+    Parameters
+    ----------
+    pairs: iterable of 2-tuples of np.ndarray, list or None
+
+    Returns
+    -------
+    x, y: np.ndarray
+        (number of pairs, longest aligned length) arrays, padded with 0
+
+    mask: np.ndarray
+        float array, 1 where x and y hold data and 0 where padded
+    """
+    aligned = [_align_tails(data1, data2) for data1, data2 in pairs]
+    width = max([len(pair[0]) for pair in aligned if pair] + [0])
+    x = np.zeros((len(aligned), width))
+    y = np.zeros((len(aligned), width))
+    mask = np.zeros((len(aligned), width))
+    for i, pair in enumerate(aligned):
+        if pair:
+            length = len(pair[0])
+            x[i, :length], y[i, :length] = pair
+            mask[i, :length] = 1
+    return(x, y, mask)
+
+
+def _align_tails(data1, data2):
+    """
+    Function to flatten two datasets to float vectors of equal length,
+    truncating the start of the longer one
+
+    Parameters
+    ----------
+    data1: np.ndarray or list or None
+
+    data2: np.ndarray or list or None
+
+    Returns
+    -------
+    2-tuple of np.ndarray or None
+        None if either dataset is missing
+
+    Example
+    -------
+    >>> _align_tails([1, 2, 3], [5, 6])
+    (array([2., 3.]), array([5., 6.]))
+    """
+    if data1 is None or data2 is None:
+        return(None)
+    data1 = np.asarray(data1, dtype=float).ravel()
+    data2 = np.asarray(data2, dtype=float).ravel()
+    length = min(len(data1), len(data2))
+    return(data1[len(data1) - length:], data2[len(data2) - length:])
 
 
 def main():
     parser = argparse.ArgumentParser(
         description="Create a correlation matrix between two C-PAC output "
                     "directories.",
-        epilog="The following features currently have available definitions to "
-               "calculate Pearson's \x1B[3mr\x1B[23m between C-PAC and "
-               f"fmriprep:\n\n{feat_def_table}",
-        formatter_class=argparse.RawDescriptionHelpFormatter
+        # the epilog is only tabulated if help is printed
+        epilog=lambda: "The following features currently have available "
+                       "definitions to calculate Pearson's \x1B[3mr\x1B[23m "
+                       "between C-PAC and fmriprep:\n\n"
+                       f"{feature_definition_table()}",
+        formatter_class=_Lazy_Epilog_Formatter
     )
 
     path_help = ("path to an outputs directory - the "
@@ -116,6 +314,57 @@ def main():
                         default=regressor_list + motion_list,
                         help="TODO: handle path to file (default: %(default)s)")
 
+    parser.add_argument("--path_index_cache", type=str,
+                        help="directory to keep file indices of C-PAC runs "
+                             "in, so later runs only re-list directories "
+                             "that have changed")
+
+    parser.add_argument("--feature_cache", type=str,
+                        help="directory to cache extracted features in, so "
+                             "unchanged inputs (e.g., a fixed baseline) "
+                             "aren't read again on later runs")
+
+    parser.add_argument("--digest_cache", type=str,
+                        help="directory to cache file digests in, so "
+                             "unchanged inputs aren't hashed again on later "
+                             "runs")
+
+    parser.add_argument("--no_hash_check", dest="hash_check",
+                        action="store_false",
+                        help="read and correlate byte-identical inputs "
+                             "instead of reading them once and recording "
+                             "them as exact matches")
+
+    parser.add_argument("--s3_creds", type=str,
+                        help="path to your AWS S3 credentials file, for "
+                             "s3:// outputs paths (default: anonymous "
+                             "access if no AWS credentials are configured)")
+
+    parser.add_argument("--s3_cache", type=str,
+                        default=os.path.join(
+                            tempfile.gettempdir(), "cpac_regtest_s3_cache"
+                        ),
+                        help="directory to download s3:// inputs to "
+                             "(default: %(default)s)")
+
+    parser.add_argument("--s3_cache_size", type=float, default=10,
+                        help="size in GB to limit --s3_cache to, deleting "
+                             "least recently used files (default: "
+                             "%(default)s)")
+
+    parser.add_argument("--incremental", action="store_true",
+                        help="reuse the metrics of cells whose inputs are "
+                             "unchanged since the last run with this "
+                             "RUN_NAME, recording cells as they're "
+                             "calculated so an interrupted run can resume")
+
+    parser.add_argument("--heatmap_page_size", type=int,
+                        help="split the heatmap into pages of at most this "
+                             "many participants, rendered in parallel")
+
+    parser.add_argument("--heatmap_pages_by_session", action="store_true",
+                        help="start a new heatmap page for each session")
+
     parser.add_argument("num_cores", type=int, \
                             help="number of cores to use - will calculate " \
                                  "correlations in parallel if greater than 1")
@@ -125,32 +374,44 @@ def main():
 
     args = parser.parse_args()
 
-    subject_list = args.subject_list if (
-        "subject_list" in args and args.subject_list is not None
-    ) else generate_subject_list_for_directory(args.old_outputs_path)
+    if args.incremental and not args.save:
+        parser.error("--incremental needs the saved outputs of earlier runs")
+
+    if any(is_s3_path(path) for path in [
+        args.old_outputs_path, args.new_outputs_path
+    ]):
+        register_store(S3_Store(
+            args.s3_cache,
+            s3_creds=args.s3_creds,
+            max_cache_bytes=int(args.s3_cache_size * 2**30)
+        ))
+
+    with profiler.stage("subject_list"):
+        subject_list = args.subject_list if (
+            "subject_list" in args and args.subject_list is not None
+        ) else generate_subject_list_for_directory(
+            args.old_outputs_path,
+            index=index_s3_run(args.old_outputs_path) if is_s3_path(
+                args.old_outputs_path
+            ) else None
+        )
 
     if "session" in args and args.session is not None:
         subject_list = [
             sub for sub in subject_list if sub.endswith(str(args.session))
         ]
 
-    corrs = Correlation_Matrix(
-        subject_list,
-        args.feature_list,
-        [{
-            "software": args.new_outputs_software,
-            "run_path": args.new_outputs_path if args.new_outputs_path.endswith(
-                "/"
-            ) else f"{args.new_outputs_path}/"
-        }, {
-            "software": args.old_outputs_software,
-            "run_path": args.old_outputs_path if args.old_outputs_path.endswith(
-                "/"
-            ) else f"{args.old_outputs_path}/"
-        }]
-    )
-
-    path_table = corrs.print_filepaths(plaintext=True)
+    runs = [{
+        "software": args.new_outputs_software,
+        "run_path": args.new_outputs_path if args.new_outputs_path.endswith(
+            "/"
+        ) else f"{args.new_outputs_path}/"
+    }, {
+        "software": args.old_outputs_software,
+        "run_path": args.old_outputs_path if args.old_outputs_path.endswith(
+            "/"
+        ) else f"{args.old_outputs_path}/"
+    }]
 
     if args.save:
         output_dir = os.path.join(
@@ -166,15 +427,65 @@ def main():
                        f"Attempted output directory: {output_dir}\n\n")
                 raise Exception(err)
 
-        path_table.to_csv(os.path.join(output_dir, "filepaths.csv"))
-        sio.savemat(
-            os.path.join(output_dir, "corrs.mat"), {'corrs':corrs.corrs}
+    journal = Cell_Journal(
+        output_dir, runs, metric_names
+    ) if args.incremental else None
+
+    with profiler.stage("correlation_matrix"):
+        corrs = Correlation_Matrix(
+            subject_list,
+            args.feature_list,
+            runs,
+            num_cores=args.num_cores,
+            path_index_cache=args.path_index_cache,
+            feature_cache=args.feature_cache,
+            hash_check=args.hash_check,
+            digest_cache=args.digest_cache,
+            journal=journal
         )
 
-    generate_heatmap(
-        reshape_corrs(corrs.corrs),
-        args.feature_list,
-        subject_list,
+    with profiler.stage("print_filepaths"):
+        path_table = corrs.print_filepaths(plaintext=True)
+
+    if args.save:
+        # each output replaces the last run's whole, so an interrupted run
+        # never leaves a partly written file
+        with profiler.stage("save"):
+            import scipy.io as sio
+
+            with atomic_path(
+                os.path.join(output_dir, "filepaths.csv")
+            ) as tmp_path:
+                path_table.to_csv(tmp_path)
+            with atomic_path(os.path.join(output_dir, "corrs.mat")) as tmp_path:
+                sio.savemat(tmp_path, {'corrs':corrs.corrs})
+            with atomic_path(
+                os.path.join(output_dir, "metrics.mat")
+            ) as tmp_path:
+                sio.savemat(tmp_path, {
+                    'metrics': corrs.metrics,
+                    'metric_names': metric_names
+                })
+            Labeled_Matrix(
+                corrs.metrics, corrs.subjects, corrs.features, metric_names
+            ).save(os.path.join(output_dir, "correlations.npy"))
+            if journal is not None:
+                journal.commit()
+                print(f"{profiler.counters.get('unchanged_cells', 0)} of "
+                      f"{corrs.metrics.shape[0] * corrs.metrics.shape[1]} "
+                      "cells unchanged since the last run")
+
+    try:
+        from heatmaps import generate_heatmap, generate_heatmap_pages, \
+                             reshape_corrs
+    except ModuleNotFoundError:
+        from .heatmaps import generate_heatmap, generate_heatmap_pages, \
+                              reshape_corrs
+
+    heatmap_args = dict(
+        corrs=reshape_corrs(corrs.corrs),
+        var_list=args.feature_list,
+        sub_list=subject_list,
         save_path=os.path.join(
             output_dir, "heatmap.png"
         ) if args.save else args.save,
@@ -182,13 +493,32 @@ def main():
         f"{args.new_outputs_path.split('/')[-1]} vs "
         f"{args.old_outputs_software} {args.old_outputs_path.split('/')[-1]}"
     )
+    with profiler.stage("heatmap"):
+        if args.save and (
+            args.heatmap_page_size or args.heatmap_pages_by_session
+        ):
+            generate_heatmap_pages(
+                page_size=args.heatmap_page_size,
+                by_session=args.heatmap_pages_by_session,
+                num_cores=args.num_cores,
+                **heatmap_args
+            )
+        elif args.save:
+            with atomic_path(heatmap_args["save_path"]) as tmp_path:
+                generate_heatmap(**{**heatmap_args, "save_path": tmp_path})
+        else:
+            generate_heatmap(**heatmap_args)
+
+    if args.save:
+        print("Profile saved to " + ", ".join(profiler.save(output_dir)))
 
 
 class Subject_Session_Feature:
     """
     A class for (subject × session) × feature data
     """
-    def __init__(self, subject, feature, runs):
+    def __init__(self, subject, feature, runs, feature_cache=None,
+                 digest_cache=None, journal=None):
         """
         Parameters
         ----------
@@ -199,48 +529,90 @@ class Subject_Session_Feature:
 
         runs: list of dicts
             [{"software": str, "run_path": str}]
+
+        feature_cache: Feature_Cache or None
+            on-disk cache to read previously extracted vectors from
+
+        digest_cache: Digest_Cache or None
+            if given, files that are byte-identical between two runs of
+            the same software are read once and, if the feature was found
+            and varies, recorded as an exact match without being
+            correlated
+
+        journal: Cell_Journal or None
+            if given, a cell whose inputs are unchanged since the journal
+            recorded it keeps its recorded metrics without being read
         """
-        if "_" in subject:
-            self.subject, self.session = subject.split("_", 1)
-        else:
-            self.subject = subject
-            self.session = None
-        self.feature = feature
-        self.paths = (
-            self.get_paths(
-                self.subject,
-                self.feature,
-                runs[0]["run_path"],
-                runs[0]["software"],
-                self.session
-            ),
-            self.get_paths(
-                self.subject,
-                self.feature,
-                runs[1]["run_path"],
-                runs[1]["software"],
-                self.session
-            )
-        )
-        self.data = (
-            self.read_feature(
-                self.paths[0],
-                self.feature,
-                runs[0]["software"]
-            ),
-            self.read_feature(
-                self.paths[1],
-                self.feature,
-                runs[1]["software"]
+        with profiler.cell(subject, feature):
+            if "_" in subject:
+                self.subject, self.session = subject.split("_", 1)
+            else:
+                self.subject = subject
+                self.session = None
+            self.feature = feature
+            with profiler.stage("get_paths"):
+                self.paths = (
+                    self.get_paths(
+                        self.subject,
+                        self.feature,
+                        runs[0]["run_path"],
+                        runs[0]["software"],
+                        self.session
+                    ),
+                    self.get_paths(
+                        self.subject,
+                        self.feature,
+                        runs[1]["run_path"],
+                        runs[1]["software"],
+                        self.session
+                    )
+                )
+            self.fingerprints = None
+            self.previous = None
+            self.identical = False
+            if journal is not None:
+                self.fingerprints = journal.fingerprints(
+                    self.paths, self.feature, runs
+                )
+                self.previous = journal.previous(
+                    subject, self.feature, self.fingerprints
+                )
+            if self.previous is not None:
+                print(f"{self.feature}: unchanged")
+                profiler.count("unchanged_cells")
+                self.data = (None, None)
+                return
+            with profiler.stage("hash_check"):
+                identical_files = digest_cache is not None and (
+                    runs[0]["software"] == runs[1]["software"]
+                ) and digest_cache.identical(*self.paths)
+            read_feature = self.read_feature if feature_cache is None else partial(
+                feature_cache.read, reader=self.read_feature
             )
-        )
-        if self.data[0] is not None:
-            print(f"{runs[0]['software']} {self.feature}: {len(self.data[0])}")
-        if self.data[1] is not None:
-            print(f"{runs[1]['software']} {self.feature}: {len(self.data[1])}")
-
-    def get_paths(self, subject, feature, run_path, software="C-PAC",
-        session=None):
+            with profiler.stage("read_feature"):
+                data = read_feature(
+                    self.paths[0],
+                    self.feature,
+                    runs[0]["software"]
+                )
+                # byte-identical files hold the same feature; read it once
+                self.data = (data, data if identical_files else read_feature(
+                    self.paths[1],
+                    self.feature,
+                    runs[1]["software"]
+                ))
+            # a missing, empty or constant feature keeps the NaNs it would
+            # get if it were correlated
+            self.identical = identical_files and _varies(data)
+            if self.identical:
+                print(f"{self.feature}: identical files")
+            if self.data[0] is not None:
+                print(f"{runs[0]['software']} {self.feature}: {len(self.data[0])}")
+            if self.data[1] is not None:
+                print(f"{runs[1]['software']} {self.feature}: {len(self.data[1])}")
+
+    @staticmethod
+    def get_paths(subject, feature, run_path, software="C-PAC", session=None):
         """
         Method to find a path to specific outputs
 
@@ -265,32 +637,36 @@ class Subject_Session_Feature:
             subject = str(subject)
             session = f"*{str(session)}*" if session else ""
             if feature in regressor_list:
-                paths = glob.glob(
+                paths = glob_run(
                     f"{run_path}working/"
                     f"resting_preproc_*{subject}{session}/"
                     "nuisance_*_0/_*/_*/"
                     f"{get_feature_label(feature, 'C-PAC')[1][:-1]}*/"
-                    "*1D"
+                    "*1D",
+                    run_path
                 ) if "compcor" in feature.lower(
                 ) else list(chain.from_iterable([
-                    glob.glob(
+                    glob_run(
                         f"{run_path}working/"
                         f"resting_preproc_*{subject}{session}/"
-                        "nuisance_*_0/_*/*/build*/*1D"
+                        "nuisance_*_0/_*/*/build*/*1D",
+                        run_path
                     ),
-                    glob.glob(
+                    glob_run(
                         f"{run_path}working/"
                         f"resting_preproc_*{subject}{session}/"
                         "nuisance_*_0/_*/_*/"
                         f"{get_feature_label(feature, 'C-PAC')[1]}/"
-                        "roi_stats.csv"
+                        "roi_stats.csv",
+                        run_path
                     )
                 ]))
             elif feature in motion_list:
                 # frame wise displacement power
-                paths = glob.glob(
+                paths = glob_run(
                     f"{run_path}output/*/*{subject}{session}"
-                    "/frame_wise_displacement_power/*/*"
+                    "/frame_wise_displacement_power/*/*",
+                    run_path
                 )
         elif software.lower()=="fmriprep":
             fmriprep_subject = fmriprep_sub("_".join([subject, session]))
@@ -338,42 +714,40 @@ class Subject_Session_Feature:
         if software=="C-PAC":
             for file in files:
                 if file.endswith(".1D"):
-                    data = Afni1D(file)
+                    mat, header_lines = parsed_files.get(file, read_1D)
                     if "compcor" in file.lower():
-                        return(data.mat[int(feature_label[1][-1])][1:])
-                    header = data.header[-1] if len(data.header) else ""
+                        return(mat[int(feature_label[1][-1])][1:].copy())
+                    header = header_lines[-1] if len(header_lines) else ""
                     header_list = header.split('\t')
                     if isinstance(feature_label, list):
                         for fl in feature_label:
                             if(fl in header_list):
-                                return(data.mat[header_list.index(fl)])
+                                return(mat[header_list.index(fl)].copy())
                     else:
                         return(
-                            data.mat[header_list.index(feature_label)] if (
+                            mat[header_list.index(feature_label)].copy() if (
                                 feature_label in header_list
-                            ) else data.mat[0][1:] if (
-                                len(data.mat[:])==1
-                            ) else ([None] * len(data.mat[0][1:]))
+                            ) else mat[0][1:].copy() if (
+                                len(mat)==1
+                            ) else ([None] * len(mat[0][1:]))
                         )
                 elif file.endswith('.csv'):
-                    return(list(pd.read_csv(
-                        file,
-                        sep="\t"
-                    )["Sub-brick"][1:].dropna().astype(float).values))
+                    return(list(parsed_files.get(file, read_table)[
+                        "Sub-brick"
+                    ][1:].dropna().astype(float).values))
 
         elif software=="fmriprep":
             for file in files:
                 if file.endswith(".tsv"):
-                    data = pd.read_csv(file, sep='\t')
+                    data = parsed_files.get(file, read_table)
                     if feature_label in data.columns:
-                        return(data[feature_label])
+                        return(data[feature_label].copy())
                 elif file.endswith(".txt"):
-                    with open(file) as f:
-                        return([
-                            float(x) for x in [
-                                x.strip() for x in f.readlines()
-                            ][1:]
-                        ])
+                    return([
+                        float(x) for x in parsed_files.get(
+                            file, read_lines
+                        )[1:]
+                    ])
 
         return(None)
 
@@ -381,7 +755,9 @@ class Correlation_Matrix:
     """
     A class for (subject × session) × feature correlation matrices
     """
-    def __init__(self, subject_sessions, features, runs):
+    def __init__(self, subject_sessions, features, runs, num_cores=1,
+                 path_index_cache=None, feature_cache=None, hash_check=True,
+                 digest_cache=None, journal=None):
         """
         Parameters
         ----------
@@ -393,24 +769,114 @@ class Correlation_Matrix:
 
         runs: list of dicts
             [{"software": str, "run_path": str}]
+
+        num_cores: int, optional, default=1
+            number of worker processes; if greater than 1, each
+            (subject × session) is found, read and correlated in a
+            separate process
+
+        path_index_cache: str or None, optional
+            directory to persist the file indices of C-PAC runs in
+
+        feature_cache: str or None, optional
+            directory to cache extracted feature vectors in, so unchanged
+            inputs aren't read again on later runs
+
+        hash_check: bool, optional, default=True
+            read byte-identical inputs once and record them as an exact
+            match if the feature was found and varies
+
+        digest_cache: str or None, optional
+            directory to cache file digests in for `hash_check`
+
+        journal: Cell_Journal or None, optional
+            if given, cells whose inputs are unchanged since a previous
+            run keep their recorded metrics, and each (subject × session)'s
+            cells are recorded as soon as they're calculated
         """
         self.subjects = subject_sessions
         self.features = features
         self.runs = runs
-        self.data = {
-            subject: {
-                feature: Subject_Session_Feature(
-                    subject, feature, runs
-                ) for feature in features
-            } for subject in subject_sessions
-        }
         self.corrs = np.zeros((len(subject_sessions), len(features)))
-        self.run_pearsonsr()
+        self.metrics = np.zeros(
+            (len(subject_sessions), len(features), len(metric_names))
+        )
+        if feature_cache is not None:
+            feature_cache = Feature_Cache(feature_cache)
+        digest_cache = Digest_Cache(digest_cache) if hash_check else None
+        with profiler.stage("index"):
+            for run in runs:
+                if run["software"].lower() in ["cpac", "c-pac"]:
+                    if is_s3_path(run["run_path"]):
+                        if run["run_path"] not in registered_indices():
+                            index_s3_run(run["run_path"])
+                    else:
+                        index_run(run["run_path"], path_index_cache)
+        s3_inputs = any(is_s3_path(run["run_path"]) for run in runs)
+        if num_cores > 1:
+            self.data = {}
+            with ProcessPoolExecutor(
+                max_workers=num_cores,
+                initializer=_initialize_worker,
+                initargs=(registered_indices(), registered_store(),
+                          multiprocessing.Value("i", 0), num_cores)
+            ) as executor:
+                rows = executor.map(
+                    partial(
+                        _correlate_subject_session,
+                        features=features,
+                        runs=runs,
+                        feature_cache=feature_cache,
+                        digest_cache=digest_cache,
+                        s3_inputs=s3_inputs,
+                        journal=journal
+                    ),
+                    subject_sessions,
+                    chunksize=max(
+                        1, len(subject_sessions) // (num_cores * 4)
+                    )
+                )
+                # executor.map yields in submission order, so the merged
+                # matrix doesn't depend on which worker finishes first
+                for i, (subject, (data, metrics, profile)) in enumerate(
+                    zip(subject_sessions, rows)
+                ):
+                    self.data[subject] = data
+                    profiler.merge(profile)
+                    self._record_subject(i, subject, metrics, journal)
+        else:
+            self.data = {}
+            for i, subject in enumerate(subject_sessions):
+                if s3_inputs:
+                    # download this and the next (subject × session)'s
+                    # files while this one is read
+                    prefetch(chain.from_iterable([
+                        _subject_paths(sub, features, runs) for
+                        sub in subject_sessions[i:i + 2]
+                    ]))
+                _hash_subject_session(subject, features, runs, digest_cache,
+                                      journal)
+                self.data[subject] = {
+                    feature: Subject_Session_Feature(
+                        subject, feature, runs, feature_cache, digest_cache,
+                        journal
+                    ) for feature in features
+                }
+                if journal is not None:
+                    # record each (subject × session)'s cells as soon as
+                    # they're read, so an interrupted run resumes here
+                    self._record_subject(i, subject, _cell_metrics([
+                        self.data[subject][feature] for feature in features
+                    ]), journal)
+            if journal is None:
+                self.run_pearsonsr()
 
     def print_filepaths(self, plaintext=False):
         """
         Function to print a table
         """
+        import pandas as pd
+
         columns = ["\n".join([
             self.runs[i]["software"], self.runs[i]["run_path"]
         ]) for i in range(2)]
@@ -444,6 +910,8 @@ class Correlation_Matrix:
                     feat in self.features
                 ]
             )
+            from tabulate import tabulate
+
             print(tabulate(
                 plaintext_path_table,
                 headers=plaintext_columns
@@ -470,6 +938,7 @@ class Correlation_Matrix:
     def run_correlation(self, subject, feature, data1, data2):
         """
         A method to fill a cell in a correlation matrix with Pearson's r
+        and the other metrics in `metric_names`
 
         Parameters
         ----------
@@ -483,18 +952,50 @@ class Correlation_Matrix:
 
         data2: np.ndarray or list
         """
-        corr = calc_corr(data1, data2)
+        self._record_metrics(
+            subject, feature, calc_metrics([(data1, data2)])[0]
+        )
+
+    def run_pearsonsr(self, journal=None):
+        """
+        A method to fill the whole correlation matrix with Pearson's r,
+        and the metrics tensor with every metric in `metric_names`,
+        calculating every cell in one batch
+
+        Parameters
+        ----------
+        journal: Cell_Journal or None
+            journal to record the calculated cells in
+        """
+        metrics = _cell_metrics([
+            self.data[subject][feature] for subject in self.data for
+            feature in self.features
+        ]).reshape((len(self.data), len(self.features), len(metric_names)))
+        for i, subject in enumerate(self.data):
+            self._record_subject(i, subject, metrics[i], journal)
+
+    def _record_subject(self, i, subject, metrics, journal=None):
+        for j, cell_metrics in enumerate(metrics):
+            self._record_metrics(i, j, cell_metrics)
+        if journal is not None:
+            journal.record([
+                (subject, feature, cell.fingerprints, cell_metrics) for
+                (feature, cell), cell_metrics in zip(
+                    self.data[subject].items(), metrics
+                ) if cell.previous is None
+            ])
+
+    def _record_metrics(self, subject, feature, metrics):
+        self.metrics[subject][feature] = metrics
+        self._record_correlation(subject, feature, metrics[0])
+
+    def _record_correlation(self, subject, feature, corr):
         print(
             f"Running subject: {subject} {feature} "
             f"correlation score: {str(corr)}"
         )
         self.corrs[subject][feature] = round(corr, 3)
 
-    def run_pearsonsr(self):
-        for i, subject in enumerate(self.data):
-            for j, feature in enumerate(self.data[subject]):
-                self.run_correlation(i, j, *self.data[subject][feature].data)
-
     def _join_paths(self, data_paths, index):
         return(
             "\n".join([
@@ -507,6 +1008,187 @@ class Correlation_Matrix:
         )
 
 
+def _cell_metrics(cells):
+    """
+    Function to calculate every metric in `metric_names` for several
+    Subject_Session_Features, using `identical_metrics` for any with
+    byte-identical inputs and the recorded metrics for any with unchanged
+    inputs
+
+    Parameters
+    ----------
+    cells: list of Subject_Session_Feature
+
+    Returns
+    -------
+    metrics: np.ndarray
+        (number of cells, number of metrics) array
+    """
+    with profiler.stage("correlate"):
+        metrics = calc_metrics([
+            (None, None) if cell.identical else cell.data for cell in cells
+        ])
+    metrics[[cell.identical for cell in cells]] = identical_metrics
+    for i, cell in enumerate(cells):
+        if cell.previous is not None:
+            metrics[i] = cell.previous
+    return(metrics)
+
+
+def _varies(data):
+    """
+    Function to check whether a feature has at least two values, all
+    finite and not all equal
+
+    Parameters
+    ----------
+    data: np.ndarray or list or None
+
+    Returns
+    -------
+    bool
+
+    Example
+    -------
+    >>> [_varies(data) for data in [[1, 2], [1, 1], [None, None], [], None]]
+    [True, False, False, False, False]
+    """
+    if data is None:
+        return(False)
+    values = np.asarray(data, dtype=float)
+    return(bool(values.size >= 2 and np.isfinite(values).all() and
+                np.ptp(values) > 0))
+
+
+def _initialize_worker(indices, store, worker_count, num_workers):
+    register_indices(indices)
+    register_worker_store(store, worker_count, num_workers)
+
+
+def _subject_paths(subject, features, runs):
+    """
+    Function to find every input file for one (subject × session)
+
+    Parameters
+    ----------
+    subject: str
+        (subject × session)
+
+    features: list of str
+
+    runs: list of dicts
+        [{"software": str, "run_path": str}]
+
+    Returns
+    -------
+    paths: list of str
+    """
+    subject, session = subject.split("_", 1) if "_" in subject else (
+        subject, None
+    )
+    return([
+        path for feature in features for run in runs for path in
+        Subject_Session_Feature.get_paths(
+            subject, feature, run["run_path"], run["software"], session
+        )
+    ])
+
+
+def _hash_subject_session(subject, features, runs, digest_cache,
+                         journal=None):
+    """
+    Function to hash every same-sized pair of one (subject × session)'s
+    files in one parallel pass, so each Subject_Session_Feature's hash
+    check finds its digests already cached
+
+    Parameters
+    ----------
+    subject: str
+        (subject × session)
+
+    features: list of str
+
+    runs: list of dicts
+        [{"software": str, "run_path": str}]
+
+    digest_cache: Digest_Cache or None
+
+    journal: Cell_Journal or None
+        cells with recorded metrics to reuse aren't hashed
+    """
+    if digest_cache is None or runs[0]["software"] != runs[1]["software"]:
+        return
+    sub, session = subject.split("_", 1) if "_" in subject else (
+        subject, None
+    )
+    pairs = []
+    for feature in features:
+        paths = [Subject_Session_Feature.get_paths(
+            sub, feature, run["run_path"], run["software"], session
+        ) for run in runs]
+        if len(paths[0]) != len(paths[1]) or journal is not None and (
+            journal.previous(subject, feature, journal.fingerprints(
+                paths, feature, runs
+            )) is not None
+        ):
+            continue
+        pairs += list(zip(*paths))
+    with profiler.stage("hash_check"):
+        digest_cache.identical_pairs(pairs)
+
+
+def _correlate_subject_session(subject, features, runs, feature_cache=None,
+                               digest_cache=None, s3_inputs=False,
+                               journal=None):
+    """
+    Function to find, read and correlate every feature for one
+    (subject × session). Module-level so it can run in a worker process.
+
+    Parameters
+    ----------
+    subject: str
+        (subject × session)
+
+    features: list of str
+
+    runs: list of dicts
+        [{"software": str, "run_path": str}]
+
+    feature_cache: Feature_Cache or None
+
+    digest_cache: Digest_Cache or None
+
+    s3_inputs: bool
+        whether to download the (subject × session)'s ``s3://`` inputs
+        concurrently before reading them
+
+    journal: Cell_Journal or None
+
+    Returns
+    -------
+    data: dict
+        {feature: Subject_Session_Feature}
+
+    metrics: np.ndarray
+        (number of features, number of metrics) array of each metric in
+        `metric_names` for each feature, in order
+
+    profile: dict
+        this call's `Profile.to_dict`, to merge into the parent process's
+    """
+    profiler.reset()
+    if s3_inputs:
+        prefetch(_subject_paths(subject, features, runs))
+    _hash_subject_session(subject, features, runs, digest_cache, journal)
+    data = {
+        feature: Subject_Session_Feature(
+            subject, feature, runs, feature_cache, digest_cache, journal
+        ) for feature in features
+    }
+    metrics = _cell_metrics([data[feature] for feature in features])
+    return(data, metrics, profiler.to_dict())
+
+
 def get_feature_label(feature, software):
     return(feature_headers.get(feature, {}).get(software, "") if (
         "CompCor" not in feature
@@ -520,6 +1202,15 @@ def get_feature_label(feature, software):
     ) else "")
 
 
+class _Lazy_Epilog_Formatter(argparse.RawDescriptionHelpFormatter):
+    """
+    A help formatter that accepts a function returning the epilog, so
+    building the epilog costs nothing unless help is printed
+    """
+    def add_text(self, text):
+        super().add_text(text() if callable(text) else text)
+
+
 def wrap(string, at=25):
     return('\n'.join([
         string[i:i+at] for i in range(0, len(string), at)
@@ -0,0 +1,632 @@
+import argparse
+import multiprocessing
+import numpy as np
+import os
+import tempfile
+import yaml
+
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from file_hashes import Digest_Cache
+    from s3_inputs import S3_Store, is_s3_path, local_copy, prefetch, \
+                          register_store, register_worker_store, \
+                          registered_store
+except ModuleNotFoundError:
+    from .file_hashes import Digest_Cache
+    from .s3_inputs import S3_Store, is_s3_path, local_copy, prefetch, \
+                           register_store, register_worker_store, \
+                           registered_store
+
+# derivative file extensions to correlate
+DERIVATIVE_EXTENSIONS = (".nii", ".nii.gz", ".1D")
+
+# approximate number of values read from each file at a time
+CHUNK_VALUES = 2**22
+
+
+def read_txt_file(txt_file):
+    with open(txt_file, "r") as f:
+        strings = [line.strip() for line in f.readlines()]
+    return([string for string in strings if string])
+
+
+def gather_local_filepaths(output_folder):
+    """
+    Function to lazily crawl an outputs directory for derivative files.
+    ``s3://`` directories are listed with the registered S3_Store without
+    downloading anything.
+
+    Parameters
+    ----------
+    output_folder: str
+
+    Yields
+    ------
+    filepath: str
+    """
+    if is_s3_path(output_folder):
+        prefix = output_folder.rstrip("/")
+        for key in sorted(registered_store().list_keys(f"{prefix}/")):
+            if key.endswith(DERIVATIVE_EXTENSIONS):
+                yield(f"{prefix}/{key}")
+        return
+    for root, dirs, files in os.walk(output_folder):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.endswith(DERIVATIVE_EXTENSIONS):
+                yield(os.path.join(root, filename))
+
+
+def replace_substrings(filepath, replacements):
+    """
+    Function to apply "old,new" replacements to a filepath
+
+    Parameters
+    ----------
+    filepath: str
+
+    replacements: list of str or None
+        "old,new" strings
+
+    Returns
+    -------
+    filepath: str
+
+    Example
+    -------
+    >>> replace_substrings("/path/sub001_site1/file.1D", ["_site1,", "1D,txt"])
+    '/path/sub001/file.txt'
+    """
+    for word_couple in replacements or []:
+        if "," not in word_couple:
+            raise Exception("\n\n[!] In the replacements text file, the old "
+                            "substring and its replacement must be separated "
+                            "by a comma.\n\n")
+        word, new = word_couple.split(",", 1)
+        filepath = filepath.replace(word, new)
+    return(filepath)
+
+
+def create_unique_file_dict(filepaths, output_folder, replacements=None):
+    """
+    Function to key derivative filepaths so the same file can be matched
+    across runs whose full paths differ
+
+    Parameters
+    ----------
+    filepaths: iterable of str
+        output filepaths from a C-PAC output directory
+
+    output_folder: str
+        the C-PAC output directory the filepaths are from
+
+    replacements: list of str or None
+        "old,new" strings to apply to the filepaths
+
+    Returns
+    -------
+    files_dict: dict
+        {category: {(category, midpath, file_nums): [filepath]}}
+    """
+    files_dict = {}
+    for filepath in filepaths:
+        if any(skip in filepath for skip in [
+            "_stack", "itk", "xfm", "montage"
+        ]):
+            continue
+        filepath = replace_substrings(filepath, replacements)
+        filename = os.path.basename(filepath)
+        # name of the directory the file is in
+        folder = os.path.basename(os.path.dirname(filepath))
+        midpath = filepath.replace(output_folder, "", 1)
+        midpath = midpath[:len(midpath) - len(filename)]
+        try:
+            # name of the output type/derivative
+            category = midpath.split("/")[2]
+        except IndexError:
+            continue
+        for measure in ["degree", "eigenvector", "lfcd"]:
+            if measure in filename:
+                category = f"{category}: {measure}"
+        # the digits in the folder and file names identify the file
+        # without relying on the file name, which can change between
+        # versions
+        file_nums = "".join([
+            character for character in folder + filename if character.isdigit()
+        ])
+        files_dict.setdefault(category, {})[
+            (category, midpath, file_nums)
+        ] = [filepath]
+    return(files_dict)
+
+
+def match_filepaths(old_files_dict, new_files_dict):
+    """
+    Function to merge two dicts from `create_unique_file_dict`, keeping
+    only the files found in both
+
+    Parameters
+    ----------
+    old_files_dict: dict
+
+    new_files_dict: dict
+
+    Returns
+    -------
+    matched_path_dict: dict
+        {category: {file key: [old filepath, new filepath]}}
+    """
+    matched_path_dict = {}
+    for category, new_files in new_files_dict.items():
+        old_files = old_files_dict.get(category, {})
+        for file_id, new_paths in new_files.items():
+            if file_id in old_files:
+                matched_path_dict.setdefault(category, {})[file_id] = (
+                    old_files[file_id] + new_paths
+                )
+    if not matched_path_dict:
+        raise Exception("\n\n[!] No output paths were successfully matched "
+                        "between the two CPAC output directories!\n\n")
+    return(matched_path_dict)
+
+
+def gather_all_files(outputs_path, replacements=None, working_dir=None):
+    """
+    Function to crawl an outputs directory and key its derivatives
+
+    Parameters
+    ----------
+    outputs_path: str
+
+    replacements: list of str or None
+
+    working_dir: str or None
+        participant working directory under `outputs_path` to limit the
+        crawl to
+
+    Returns
+    -------
+    files_dict: dict
+        see `create_unique_file_dict`
+
+    real_paths: dict
+        {keyed filepath: filepath on disk}
+    """
+    outputs_path = outputs_path.rstrip("/")
+    real_paths = {}
+
+    def _record(filepaths):
+        for filepath in filepaths:
+            real_paths[replace_substrings(filepath, replacements)] = filepath
+            yield(filepath)
+
+    files_dict = create_unique_file_dict(_record(gather_local_filepaths(
+        os.path.join(outputs_path, working_dir) if working_dir else
+        outputs_path
+    )), outputs_path, replacements)
+    return(files_dict, real_paths)
+
+
+def read_derivative_chunks(filepath, chunk_values=CHUNK_VALUES):
+    """
+    Function to read a derivative's values a chunk at a time, in the same
+    order for any file of the same shape
+
+    Parameters
+    ----------
+    filepath: str
+
+    chunk_values: int
+        approximate number of values per chunk
+
+    Yields
+    ------
+    chunk: np.ndarray
+        1D float64 array
+    """
+    if filepath.endswith(".1D"):
+        yield(np.loadtxt(filepath, dtype=np.float64, ndmin=1).ravel())
+        return
+    import nibabel as nb
+
+    dataobj = nb.load(filepath).dataobj
+    shape = dataobj.shape
+    if len(shape) < 2:
+        yield(np.asarray(dataobj, dtype=np.float64).ravel())
+        return
+    step = max(1, chunk_values // max(1, int(np.prod(shape[:-1]))))
+    for start in range(0, shape[-1], step):
+        yield(np.asarray(
+            dataobj[..., start:start + step], dtype=np.float64
+        ).ravel())
+
+
+def derivative_shape(filepath):
+    if filepath.endswith(".1D"):
+        return(None)
+    import nibabel as nb
+
+    return(nb.load(filepath).shape)
+
+
+class _Running_Moments:
+    """
+    A class for the co-moments of two variables, merged a chunk at a time
+    (Chan et al.'s pairwise update) so the whole files never need to be
+    in memory
+    """
+    def __init__(self):
+        self.n = 0
+        self.mean = np.zeros(2)
+        self.m2 = np.zeros(2)
+        self.cxy = 0.0
+
+    def update(self, x, y):
+        n = x.size
+        if not n:
+            return
+        mean = np.array([x.mean(), y.mean()])
+        dx = x - mean[0]
+        dy = y - mean[1]
+        m2 = np.array([dx @ dx, dy @ dy])
+        cxy = dx @ dy
+        delta = mean - self.mean
+        total = self.n + n
+        weight = self.n * n / total
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * weight
+        self.cxy += cxy + delta[0] * delta[1] * weight
+        self.n = total
+
+    def pearson(self):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return(float(self.cxy / np.sqrt(self.m2[0] * self.m2[1])))
+
+    def concordance(self):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return(float(2 * self.cxy / (
+                self.m2[0] + self.m2[1] +
+                self.n * (self.mean[0] - self.mean[1]) ** 2
+            )))
+
+
+def calculate_correlation(category, old_path, new_path, identical=False):
+    """
+    Function to calculate Pearson's r and Lin's concordance correlation
+    coefficient between two derivative files, streaming both
+
+    Parameters
+    ----------
+    category: str
+
+    old_path: str
+
+    new_path: str
+
+    identical: bool
+        whether the files are byte-identical, in which case only
+        `old_path` is read (see `calculate_self_correlation`)
+
+    Returns
+    -------
+    category: str
+
+    pearson: float
+        NaN if the files can't be compared
+
+    concordance: float
+        NaN if the files can't be compared
+    """
+    if identical:
+        return(calculate_self_correlation(category, old_path))
+    try:
+        with local_copy(old_path) as old_local, local_copy(
+            new_path
+        ) as new_local:
+            if derivative_shape(old_local) != derivative_shape(new_local):
+                raise ValueError("different shapes")
+            moments = _Running_Moments()
+            old_chunks = read_derivative_chunks(old_local)
+            new_chunks = read_derivative_chunks(new_local)
+            for old_chunk, new_chunk in zip(old_chunks, new_chunks):
+                if old_chunk.size != new_chunk.size:
+                    raise ValueError("different sizes")
+                moments.update(old_chunk, new_chunk)
+            if next(old_chunks, None) is not None or next(
+                new_chunks, None
+            ) is not None:
+                raise ValueError("different sizes")
+    except Exception as exception:
+        print(f"Could not correlate {old_path} and {new_path}: {exception}")
+        return((category, np.nan, np.nan))
+    return((category, moments.pearson(), moments.concordance()))
+
+
+def calculate_self_correlation(category, path):
+    """
+    Function to return what `calculate_correlation` gives for a file and
+    a byte-identical copy, reading the file once: 1.0 if its values are
+    finite and not all equal, NaN otherwise
+
+    Parameters
+    ----------
+    category: str
+
+    path: str
+
+    Returns
+    -------
+    category: str
+
+    pearson: float
+
+    concordance: float
+    """
+    varies = False
+    try:
+        with local_copy(path) as local_path:
+            first = None
+            for chunk in read_derivative_chunks(local_path):
+                if not np.isfinite(chunk).all():
+                    return((category, np.nan, np.nan))
+                if chunk.size:
+                    first = chunk[0] if first is None else first
+                    varies = varies or bool((chunk != first).any())
+    except Exception as exception:
+        print(f"Could not read {path}: {exception}")
+        return((category, np.nan, np.nan))
+    return((category, 1.0, 1.0) if varies else (category, np.nan, np.nan))
+
+
+def aggregate_correlations(correlation_info_list):
+    """
+    Function to group correlation results by category, as they arrive
+
+    Parameters
+    ----------
+    correlation_info_list: iterable of tuples
+        (category, pearson, concordance)
+
+    Returns
+    -------
+    pearson_dict: dict
+        {category: [pearson, ...]}
+
+    concor_dict: dict
+        {category: [concordance, ...]}
+    """
+    pearson_dict = {}
+    concor_dict = {}
+    for category, pearson, concordance in correlation_info_list:
+        pearson_dict.setdefault(category, []).append(pearson)
+        concor_dict.setdefault(category, []).append(concordance)
+    return(pearson_dict, concor_dict)
+
+
+def run_correlations(matched_dct, real_paths=None, num_cores=1,
+                     digest_cache=None):
+    """
+    Function to correlate each pair of matched files, in parallel if
+    `num_cores` > 1. Pairs are hashed first, and only one file of each
+    byte-identical pair is read (see `calculate_self_correlation`).
+
+    Parameters
+    ----------
+    matched_dct: dict
+        from `match_filepaths`
+
+    real_paths: dict or None
+        {keyed filepath: filepath on disk}
+
+    num_cores: int
+
+    digest_cache: Digest_Cache or None
+        None to correlate every pair
+
+    Returns
+    -------
+    pearson_dict: dict
+
+    concor_dict: dict
+    """
+    real_paths = real_paths or {}
+    tasks = [(category, *[real_paths.get(path, path) for path in paths]) for
+             category, files in matched_dct.items() for paths in
+             files.values()]
+    identical = digest_cache.identical_pairs(
+        [task[1:] for task in tasks]
+    ) if digest_cache is not None else [False] * len(tasks)
+    tasks = [(*task, same) for task, same in zip(tasks, identical)]
+    print(f"{sum(identical)} pairs of files are identical")
+    print(f"Correlating {len(tasks) - sum(identical)} pairs of files")
+    if num_cores > 1 and tasks:
+        with ProcessPoolExecutor(
+            max_workers=num_cores,
+            initializer=register_worker_store,
+            initargs=(registered_store(), multiprocessing.Value("i", 0),
+                      num_cores)
+        ) as executor:
+            return(aggregate_correlations(executor.map(
+                calculate_correlation, *zip(*tasks),
+                chunksize=max(1, len(tasks) // (num_cores * 16))
+            )))
+    return(aggregate_correlations(
+        calculate_correlation(*task) for task in _prefetched(tasks)
+    ))
+
+
+def _prefetched(tasks, window=8):
+    """
+    Function to yield correlation tasks while downloading the files of the
+    next `window` tasks, if any are ``s3://`` URLs
+    """
+    for i, task in enumerate(tasks):
+        # only the first file of a byte-identical pair is read
+        prefetch([path for ahead in tasks[i:i + window] for
+                  path in ahead[1:2 if ahead[3] else 3]])
+        yield(task)
+
+
+def write_corr_map(pearson_dict, concor_dict, corr_map):
+    with open(corr_map, "w") as f:
+        yaml.safe_dump({
+            "pearson": {category: [float(value) for value in values] for
+                        category, values in pearson_dict.items()},
+            "concordance": {category: [float(value) for value in values] for
+                            category, values in concor_dict.items()}
+        }, f)
+
+
+def read_corr_map(corr_map):
+    with open(corr_map, "r") as f:
+        corr_map_dct = yaml.safe_load(f)
+    return(corr_map_dct["pearson"], corr_map_dct["concordance"])
+
+
+def create_boxplot(corr_dict, corr_name, out_dir, run_name):
+    """
+    Function to save a box plot of the correlations of each category
+
+    Parameters
+    ----------
+    corr_dict: dict
+        {category: [correlation, ...]}
+
+    corr_name: str
+
+    out_dir: str
+
+    run_name: str
+
+    Returns
+    -------
+    out_file: str
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib import pyplot as plt
+
+    categories = sorted(corr_dict)
+    values = [[value for value in corr_dict[category] if not np.isnan(value)]
+              for category in categories]
+    fig, ax = plt.subplots(figsize=(max(6, 0.3 * len(categories)), 6))
+    ax.boxplot(values)
+    ax.set_xticks(range(1, len(categories) + 1))
+    ax.set_xticklabels(categories, rotation=90)
+    ax.set_ylabel(corr_name)
+    ax.set_title(f"{run_name}: {corr_name}")
+    fig.tight_layout()
+    out_file = os.path.join(out_dir, f"{run_name}_{corr_name}.png")
+    fig.savefig(out_file)
+    plt.close(fig)
+    return(out_file)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("num_cores", type=int,
+                        help="number of cores to use - will calculate "
+                             "correlations in parallel if greater than 1")
+
+    parser.add_argument("run_name", type=str,
+                        help="name for the correlations run")
+
+    parser.add_argument("--old_outputs_path", type=str,
+                        help="path to a CPAC outputs directory - the folder "
+                             "containing the participant-ID labeled "
+                             "directories")
+
+    parser.add_argument("--new_outputs_path", type=str,
+                        help="path to a CPAC outputs directory - the folder "
+                             "containing the participant-ID labeled "
+                             "directories")
+
+    parser.add_argument("--s3_creds", type=str,
+                        help="path to your AWS S3 credentials file")
+
+    parser.add_argument("--s3_cache", type=str,
+                        default=os.path.join(
+                            tempfile.gettempdir(), "cpac_regtest_s3_cache"
+                        ),
+                        help="directory to download s3:// inputs to "
+                             "(default: %(default)s)")
+
+    parser.add_argument("--s3_cache_size", type=float, default=10,
+                        help="size in GB to limit --s3_cache to, deleting "
+                             "least recently used files (default: "
+                             "%(default)s)")
+
+    parser.add_argument("--replacements", type=str,
+                        help="text file containing strings you wish to have "
+                             "removed from the filepaths if they occur - "
+                             "place one on each line")
+
+    parser.add_argument("--corr_map", type=str,
+                        help="YAML file with already-calculated "
+                             "correlations, which can be provided if you "
+                             "only want to generate the box plots again")
+
+    parser.add_argument("--working_dir", type=str,
+                        help="if you are correlating two working directories "
+                             "of a single participant to check intermediates")
+
+    parser.add_argument("--digest_cache", type=str,
+                        help="directory to cache file digests in, so "
+                             "unchanged outputs aren't hashed again on later "
+                             "runs")
+
+    parser.add_argument("--no_hash_check", dest="hash_check",
+                        action="store_false",
+                        help="correlate byte-identical files instead of "
+                             "reading only one of them")
+
+    args = parser.parse_args()
+
+    out_dir = os.path.join(os.getcwd(), f"correlations_{args.run_name}")
+    os.makedirs(out_dir, exist_ok=True)
+
+    if args.corr_map:
+        pearson_dict, concor_dict = read_corr_map(args.corr_map)
+    else:
+        if any(is_s3_path(path) for path in [
+            args.old_outputs_path, args.new_outputs_path
+        ]):
+            register_store(S3_Store(
+                args.s3_cache,
+                s3_creds=args.s3_creds,
+                max_cache_bytes=int(args.s3_cache_size * 2**30)
+            ))
+        if not args.old_outputs_path or not args.new_outputs_path:
+            parser.error("--old_outputs_path and --new_outputs_path are "
+                         "required unless --corr_map is given")
+        replacements = read_txt_file(
+            args.replacements
+        ) if args.replacements else None
+        old_files_dict, old_real_paths = gather_all_files(
+            args.old_outputs_path, replacements, args.working_dir
+        )
+        new_files_dict, new_real_paths = gather_all_files(
+            args.new_outputs_path, replacements, args.working_dir
+        )
+        pearson_dict, concor_dict = run_correlations(
+            match_filepaths(old_files_dict, new_files_dict),
+            {**old_real_paths, **new_real_paths},
+            args.num_cores,
+            Digest_Cache(
+                args.digest_cache, num_threads=max(4, args.num_cores)
+            ) if args.hash_check else None
+        )
+        corr_map = os.path.join(out_dir, f"{args.run_name}_corr_map.yml")
+        write_corr_map(pearson_dict, concor_dict, corr_map)
+        print(f"Correlations saved to {corr_map}")
+
+    for corr_dict, corr_name in [
+        (pearson_dict, "pearson"), (concor_dict, "concordance")
+    ]:
+        print(create_boxplot(corr_dict, corr_name, out_dir, args.run_name))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 import yaml
 import math
 
+# libyaml's loader when PyYAML was built with it
+_Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
 
 def read_yaml_file(yaml_file):
     '''Function to read a dict YAML file at a given path.
@@ -21,7 +24,8 @@ def read_yaml_file(yaml_file):
     ...     'pipeline_setup']['pipeline_name']
     'cpac-default-pipeline'
     '''
-    return yaml.safe_load(open(yaml_file, 'r'))
+    with open(yaml_file, 'r') as yaml_stream:
+        return yaml.load(yaml_stream, Loader=_Loader)
 
 
 def isclose(a, b, rel_tol=1e-09, abs_tol=0.0):
@@ -78,27 +82,140 @@ def dct_diff(dct1, dct2):
     return {k: diff[k] for k in diff if diff[k]}
 
 
+def flatten_dct(dct, prefix=()):
+    '''Function to flatten a nested dict into a key-path index.
+
+    Parameters
+    ----------
+    dct: dict
+
+    prefix: tuple
+        key path of `dct` itself
+
+    Returns
+    -------
+    dict
+        {key path tuple: value}; lists are values, not nested further
+
+    Example
+    -------
+    >>> flatten_dct({'a': {'b': 1, 'c': [1, 2]}, 'd': None})
+    {('a', 'b'): 1, ('a', 'c'): [1, 2], ('d',): None}
+    '''
+    flat = {}
+    for key, value in dct.items():
+        if isinstance(value, dict) and value:
+            flat.update(flatten_dct(value, prefix + (key,)))
+        else:
+            flat[prefix + (key,)] = value
+    return flat
+
+
+def values_equal(a, b, rel_tol=1e-09):
+    '''Function to compare two config values, recursing into lists and
+    dicts and comparing floats with a relative tolerance.
+
+    Example
+    -------
+    >>> values_equal([1.0, [0.1 + 0.2]], [1, [0.3]])
+    True
+    >>> values_equal([1, 2], [2, 1])
+    False
+    '''
+    if isinstance(a, bool) or isinstance(b, bool):
+        return a is b
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return isclose(a, b, rel_tol)
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(
+            values_equal(x, y, rel_tol) for x, y in zip(a, b))
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(
+            values_equal(a[key], b[key], rel_tol) for key in a)
+    return a == b
+
+
+def multi_diff(dcts, rel_tol=1e-09):
+    '''Function to compare any number of nested dicts in one pass over
+    their flattened key paths, ignoring unspecified (missing or None)
+    values as `dct_diff` does.
+
+    Parameters
+    ----------
+    dcts: list of dicts
+
+    rel_tol: float
+        relative tolerance for comparing floats
+
+    Returns
+    -------
+    diff: dict
+        {key path tuple: [value in each dict, or None if unspecified]}
+        for each key path whose specified values differ
+
+    Example
+    -------
+    >>> multi_diff([
+    ...     {'a': {'b': 1, 'c': [1.0]}, 'd': 'x'},
+    ...     {'a': {'b': 1, 'c': [1.0000000001]}, 'd': 'y'},
+    ...     {'a': {'b': 2}}
+    ... ])
+    {('a', 'b'): [1, 1, 2], ('d',): ['x', 'y', None]}
+    '''
+    flats = [flatten_dct(dct) for dct in dcts]
+    keys = {}
+    for flat in flats:
+        keys.update(dict.fromkeys(flat))
+    diff = {}
+    for key in keys:
+        values = [flat.get(key) for flat in flats]
+        specified = [value for value in values if value is not None]
+        if any(not values_equal(specified[0], value, rel_tol)
+               for value in specified[1:]):
+            diff[key] = values
+    return diff
+
+
 def main():
 
     import os
     import argparse
 
+    from tabulate import tabulate
+
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("pipe1", type=str, \
-                            help="path to a C-PAC pipeline configuration " \
-                                 "YAML file")
+    parser.add_argument("pipes", type=str, nargs="+", metavar="pipe",
+                        help="path to a C-PAC pipeline configuration "
+                             "YAML file")
 
-    parser.add_argument("pipe2", type=str, \
-                            help="path to a C-PAC pipeline configuration " \
-                                 "YAML file")
+    parser.add_argument("--table", action="store_true",
+                        help="print one table of differing keys across all "
+                             "configs (default with more than 2 configs)")
+
+    parser.add_argument("--rel_tol", type=float, default=1e-09,
+                        help="relative tolerance for comparing floats "
+                             "(default: %(default)s)")
 
     args = parser.parse_args()
 
-    pipe_dct1 = read_yaml_file(args.pipe1)
-    pipe_dct2 = read_yaml_file(args.pipe2)
+    pipe_dcts = [read_yaml_file(pipe) for pipe in args.pipes]
+
+    if len(pipe_dcts) == 2 and not args.table:
+        diff_dct = dct_diff(*pipe_dcts)
+
+        for key in diff_dct:
+            print("{0}: {1}".format(key, diff_dct[key]))
+        return
+
+    diff = multi_diff(pipe_dcts, args.rel_tol)
+    print(tabulate(
+        [[".".join(str(k) for k in key)] + [
+            "" if value is None else value for value in values
+        ] for key, values in diff.items()],
+        headers=["key"] + [os.path.basename(pipe) for pipe in args.pipes]
+    ))
 
-    diff_dct = dct_diff(pipe_dct1, pipe_dct2)
 
-    for key in diff_dct:
-        print("{0}: {1}".format(key, diff_dct[key]))
+if __name__ == "__main__":
+    main()
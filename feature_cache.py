@@ -0,0 +1,101 @@
+# coding=utf-8
+import json
+import numpy as np
+import os
+import pickle
+
+from hashlib import sha1
+
+try:
+    from cell_journal import atomic_path
+except ModuleNotFoundError:
+    from .cell_journal import atomic_path
+
+
+class Feature_Cache:
+    """
+    A class for an on-disk cache of extracted feature vectors, keyed by
+    feature, software and the path, size and mtime of each source file
+    """
+    def __init__(self, cache_dir):
+        """
+        Parameters
+        ----------
+        cache_dir: str
+            directory to store cached vectors in
+        """
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def read(self, files, feature, software, reader):
+        """
+        Method to return a cached feature vector, reading and caching it
+        if the source files are new or have changed
+
+        Parameters
+        ----------
+        files: list of str
+            paths to files
+
+        feature: str
+
+        software: str
+
+        reader: function
+            function with the signature of
+            `Subject_Session_Feature.read_feature`
+
+        Returns
+        -------
+        feature: np.ndarray or None
+        """
+        key = self.key(files, feature, software)
+        if key is None:
+            return(reader(files, feature, software))
+        path = os.path.join(self.cache_dir, key[:2], f"{key}.npy")
+        try:
+            cached = np.load(path, allow_pickle=False)
+            return(None if cached.ndim == 0 else cached)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            # missing, or left empty or truncated by an interrupted run
+            pass
+        data = reader(files, feature, software)
+        # a 0-d array records a missing feature
+        vector = np.array(np.nan) if data is None else np.asarray(
+            data, dtype=float
+        )
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_path(path) as tmp_path:
+            np.save(tmp_path, vector, allow_pickle=False)
+        return(None if data is None else vector)
+
+    @staticmethod
+    def key(files, feature, software):
+        """
+        Method to fingerprint a feature's source files
+
+        Parameters
+        ----------
+        files: list of str
+
+        feature: str
+
+        software: str
+
+        Returns
+        -------
+        str or None
+            hex digest, or None if any file can't be stat'ed
+        """
+        if not files:
+            return(None)
+        fingerprints = []
+        for path in files:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return(None)
+            fingerprints.append([path, stat.st_size, stat.st_mtime_ns])
+        return(sha1(json.dumps(
+            [software, feature, fingerprints]
+        ).encode()).hexdigest())
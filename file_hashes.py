@@ -0,0 +1,198 @@
+# coding=utf-8
+import json
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b, sha1
+
+# bytes read per hash update
+BLOCK_SIZE = 2**20
+
+
+class Digest_Cache:
+    """
+    A class for content digests of files, cached in memory and optionally
+    on disk, keyed by the path, size and mtime of each file
+    """
+    def __init__(self, cache_dir=None, num_threads=4):
+        """
+        Parameters
+        ----------
+        cache_dir: str or None
+            directory to store digests in, so unchanged files aren't
+            hashed again on later runs
+
+        num_threads: int
+            number of threads to hash files in. hashlib releases the GIL
+            while hashing, so threads are enough.
+        """
+        self.cache_dir = cache_dir
+        self.num_threads = num_threads
+        self.digests_by_key = {}
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def digest(self, path):
+        """
+        Method to return the digest of a file's contents, hashing it a
+        block at a time if it's new or has changed
+
+        Parameters
+        ----------
+        path: str
+
+        Returns
+        -------
+        str or None
+            hex digest, or None if the file can't be read
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return(None)
+        key = sha1(json.dumps(
+            [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+        ).encode()).hexdigest()
+        if key in self.digests_by_key:
+            return(self.digests_by_key[key])
+        cache_path = os.path.join(
+            self.cache_dir, key[:2], key
+        ) if self.cache_dir is not None else None
+        if cache_path is not None:
+            try:
+                with open(cache_path, "r") as cache_file:
+                    self.digests_by_key[key] = cache_file.read().strip()
+                return(self.digests_by_key[key])
+            except OSError:
+                pass
+        try:
+            digest = hash_file(path)
+        except OSError:
+            return(None)
+        self.digests_by_key[key] = digest
+        if cache_path is not None:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = f"{cache_path}.tmp{os.getpid()}"
+            with open(tmp_path, "w") as cache_file:
+                cache_file.write(digest)
+            os.replace(tmp_path, cache_path)
+        return(digest)
+
+    def digests(self, paths):
+        """
+        Method to return the digests of several files, hashed in parallel
+
+        Parameters
+        ----------
+        paths: list of str
+
+        Returns
+        -------
+        list of str or None
+        """
+        if self.num_threads > 1 and len(paths) > 1:
+            with ThreadPoolExecutor(
+                max_workers=min(self.num_threads, len(paths))
+            ) as executor:
+                return(list(executor.map(self.digest, paths)))
+        return([self.digest(path) for path in paths])
+
+    def identical(self, files1, files2):
+        """
+        Method to check whether two lists of files have byte-identical
+        contents, pair by pair. Sizes are compared before any file is
+        hashed.
+
+        Parameters
+        ----------
+        files1: list of str
+
+        files2: list of str
+
+        Returns
+        -------
+        bool
+            False if either list is empty or any file can't be read
+        """
+        files1 = list(files1 or [])
+        files2 = list(files2 or [])
+        if not files1 or len(files1) != len(files2):
+            return(False)
+        try:
+            if any(os.path.getsize(file1) != os.path.getsize(file2) for
+                   file1, file2 in zip(files1, files2)):
+                return(False)
+        except OSError:
+            return(False)
+        digests = self.digests(files1 + files2)
+        return(None not in digests and
+               digests[:len(files1)] == digests[len(files1):])
+
+    def identical_pairs(self, pairs):
+        """
+        Method to check many pairs of files at once, hashing every
+        same-sized pair in one parallel pass
+
+        Parameters
+        ----------
+        pairs: list of 2-tuples of str
+
+        Returns
+        -------
+        list of bool
+        """
+        def _same_size(pair):
+            try:
+                return(os.path.getsize(pair[0]) == os.path.getsize(pair[1]))
+            except OSError:
+                return(False)
+
+        candidates = [i for i, pair in enumerate(pairs) if _same_size(pair)]
+        digests = self.digests([
+            path for i in candidates for path in pairs[i]
+        ])
+        identical = [False] * len(pairs)
+        for n, i in enumerate(candidates):
+            identical[i] = digests[2 * n] is not None and (
+                digests[2 * n] == digests[2 * n + 1]
+            )
+        return(identical)
+
+
+def hash_file(path, block_size=BLOCK_SIZE):
+    """
+    Function to hash a file's raw bytes a block at a time
+
+    Parameters
+    ----------
+    path: str
+
+    block_size: int
+
+    Returns
+    -------
+    str
+        hex digest
+    """
+    file_hash = blake2b()
+    with open(path, "rb") as stream:
+        for block in iter(lambda: stream.read(block_size), b""):
+            file_hash.update(block)
+    return(file_hash.hexdigest())
+
+
+def files_identical(path1, path2):
+    """
+    Function to check whether two files have byte-identical contents
+
+    Parameters
+    ----------
+    path1: str
+
+    path2: str
+
+    Returns
+    -------
+    bool
+    """
+    return(Digest_Cache(num_threads=2).identical([path1], [path2]))
@@ -1,28 +1,33 @@
 import argparse
-import matplotlib as mpl
+import json
 import numpy as np
 import os
-import pandas as pd
 import sys
 import yaml
 
-from matplotlib import gridspec as GS
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
+from functools import partial
 from matplotlib import pyplot as plt
-from scipy import io as sio
 from warnings import filterwarnings
 
 try:
     from configs import defaults
     from configs.subjects import generate_subject_list_for_range
+    from labeled_matrix import is_labeled_matrix, Labeled_Matrix
 except ModuleNotFoundError:
     from .configs import defaults
     from .configs.subjects import generate_subject_list_for_range
+    from .labeled_matrix import is_labeled_matrix, Labeled_Matrix
 
 filterwarnings(
     "ignore",
     "Warning: converting a masked element to nan"
 )
 
+# matrices with more cells than this are drawn with `fast_heatmap`
+FAST_HEATMAP_CELLS = 1000
+
 def annotate_heatmap(im, data=None, valfmt="{x:.2f}",
                      textcolors=["black", "white"],
                      threshold=None, **textkw):
@@ -83,7 +88,8 @@ def annotate_heatmap(im, data=None, valfmt="{x:.2f}",
     return texts
 
 
-def generate_heatmap(corrs, var_list, sub_list, save_path=None, title=None):
+def generate_heatmap(corrs, var_list, sub_list, save_path=None, title=None,
+                     fast=None, pass_threshold=0.9):
     """
     Function to generate a heatmap.
 
@@ -99,29 +105,44 @@ def generate_heatmap(corrs, var_list, sub_list, save_path=None, title=None):
         The path to save the file to, or a falsy value to display in IPython
     title: str
         String to use as plot title. Optional.
+    fast: bool or None
+        Draw with `fast_heatmap`. If None (the default), do so when
+        `corrs` has more than FAST_HEATMAP_CELLS cells. Optional.
+    pass_threshold: float
+        With `fast`, only cells below this value are annotated. Optional.
 
     Returns
     -------
     None
     """
-    fig, ax = plt.subplots(figsize = (50, 15))
-    im, cbar = heatmap(
-        corrs, var_list, sub_list, ax=ax, vmin=0, vmax=1,
-        cbarlabel="correlation score"
-    )
-    texts = annotate_heatmap(im)
-    if title:
-        plt.title(
-            label=title,
-            fontdict={
-                'fontsize': max(24, len(sub_list)*0.75),
-                'fontweight' : 'bold',
-            }
+    if fast is None:
+        fast = np.size(corrs) > FAST_HEATMAP_CELLS
+    if fast:
+        fig = fast_heatmap(
+            corrs, var_list, sub_list, title=title,
+            pass_threshold=pass_threshold
         )
-    fig.tight_layout()
+    else:
+        fig, ax = plt.subplots(figsize = (50, 15))
+        im, cbar = heatmap(
+            corrs, var_list, sub_list, ax=ax, vmin=0, vmax=1,
+            cbarlabel="correlation score"
+        )
+        texts = annotate_heatmap(im)
+        if title:
+            plt.title(
+                label=title,
+                fontdict={
+                    'fontsize': max(24, len(sub_list)*0.75),
+                    'fontweight' : 'bold',
+                }
+            )
+        fig.tight_layout()
 
     if save_path:
-        plt.savefig(save_path, bbox_inches="tight")
+        plt.savefig(save_path, bbox_inches=None if fast else "tight")
+        if fast:
+            plt.close(fig)
     else:
         try:
             from IPython.display import display
@@ -130,6 +151,188 @@ def generate_heatmap(corrs, var_list, sub_list, save_path=None, title=None):
             print("No save path or display configured")
 
 
+def fast_heatmap(corrs, var_list, sub_list, title=None, pass_threshold=0.9,
+                 max_labels=200, max_annotations=1000):
+    """
+    Function to draw a large heatmap with a cost that grows with its
+    pixels rather than with its cells: a single mesh, a figure sized to
+    the matrix, a bounded number of tick labels and text only on cells
+    below `pass_threshold`.
+
+    Parameters
+    ----------
+    corrs: numpy ndarray with shape (number of features, number of subject_sessions)
+        This matrix contains the values to plot
+    var_list: list of strings
+        The labels, in order, of the features (rows)
+    sub_list: list of strings
+        The labels, in order, of the subject_sessions (columns)
+    title: str
+        String to use as plot title. Optional.
+    pass_threshold: float
+        Only cells below this value are annotated. Optional.
+    max_labels: int
+        Maximum number of tick labels per axis. Optional.
+    max_annotations: int
+        If more cells than this are below `pass_threshold`, none are
+        annotated. Optional.
+
+    Returns
+    -------
+    fig: matplotlib.figure.Figure
+    """
+    data = np.ma.masked_invalid(np.asarray(corrs, dtype=float))
+    n_rows, n_cols = data.shape
+    # room above the mesh for rotated column labels and the title
+    top = 0.075 * max([len(str(label)) for label in sub_list] + [0]) + 0.9
+    width = min(max(8, 0.25 * n_cols + 4), 300)
+    height = min(max(4, 0.35 * n_rows + 1), 300) + top
+    fig, ax = plt.subplots(figsize=(width, height))
+    fig.subplots_adjust(left=1.5 / width, right=1 - 1.2 / width,
+                        bottom=0.3 / height, top=1 - top / height)
+    cmap = copy(plt.get_cmap())
+    cmap.set_bad("lightgrey")
+    mesh = ax.pcolormesh(data, cmap=cmap, vmin=0, vmax=1, rasterized=True)
+    ax.invert_yaxis()
+    cbar = fig.colorbar(mesh, ax=ax, fraction=0.03, pad=0.03)
+    cbar.ax.set_ylabel("correlation score", rotation=-90, va="bottom")
+    for set_ticks, set_labels, labels in [
+        (ax.set_xticks, ax.set_xticklabels, sub_list),
+        (ax.set_yticks, ax.set_yticklabels, var_list)
+    ]:
+        step = int(np.ceil(len(labels) / max_labels)) or 1
+        set_ticks(np.arange(0, len(labels), step) + 0.5)
+        set_labels(list(labels)[::step])
+    ax.tick_params(top=True, bottom=False, labeltop=True, labelbottom=False)
+    plt.setp(ax.get_xticklabels(), rotation=-90, fontsize=8)
+    plt.setp(ax.get_yticklabels(), fontsize=8)
+    failing = np.argwhere(data.filled(np.inf) < pass_threshold)
+    if len(failing) <= max_annotations:
+        for i, j in failing:
+            ax.text(j + 0.5, i + 0.5, f"{data[i, j]:.2f}", ha="center",
+                    va="center", fontsize=6, color="black")
+    if title:
+        fig.suptitle(title, fontsize=24, fontweight="bold")
+    return(fig)
+
+
+def generate_heatmap_pages(corrs, var_list, sub_list, save_path, title=None,
+                           page_size=50, by_session=False, num_cores=1,
+                           **kwargs):
+    """
+    Function to split a heatmap into pages of columns, render each page in
+    a separate process with a non-interactive backend, and write a JSON
+    manifest of the pages.
+
+    Pages are saved next to `save_path` as "{root}_page-{number}{ext}" and
+    the manifest as "{root}_pages.json".
+
+    Parameters
+    ----------
+    corrs: numpy ndarray with shape (number of features, number of subject_sessions)
+        This matrix contains the values to plot
+    var_list: list of strings
+        The labels, in order, of the features (rows)
+    sub_list: list of strings
+        The labels, in order, of the subject_sessions (columns)
+    save_path: string
+        The path the pages and manifest are named after
+    title: str
+        String to use as plot title, suffixed with each page's range.
+        Optional.
+    page_size: int or None
+        Maximum number of columns per page, or None for no limit. Optional.
+    by_session: bool
+        Start a new page for each session. Optional.
+    num_cores: int
+        Number of pages to render at once. Optional.
+    **kwargs
+        All other arguments are forwarded to `generate_heatmap`.
+
+    Returns
+    -------
+    manifest_path: str
+    """
+    root, ext = os.path.splitext(save_path)
+    ext = ext or ".png"
+    pages = paginate(sub_list, page_size, by_session)
+    manifest = {"title": title, "features": list(var_list), "pages": []}
+    jobs = []
+    for number, columns in enumerate(pages, 1):
+        page_subs = [sub_list[column] for column in columns]
+        page_path = f"{root}_page-{number:03d}{ext}"
+        label = page_subs[0] if len(page_subs) == 1 else (
+            f"{page_subs[0]} – {page_subs[-1]}"
+        )
+        manifest["pages"].append({
+            "file": os.path.basename(page_path),
+            "subjects": page_subs,
+            "columns": [int(column) for column in columns]
+        })
+        jobs.append(dict(
+            corrs=np.asarray(corrs)[:, columns],
+            var_list=var_list,
+            sub_list=page_subs,
+            save_path=page_path,
+            title=f"{title} ({label})" if title else label,
+            **kwargs
+        ))
+    with ProcessPoolExecutor(
+        max_workers=max(1, min(num_cores, len(jobs))),
+        initializer=plt.switch_backend,
+        initargs=("Agg",)
+    ) as executor:
+        list(executor.map(_render_page, jobs))
+    manifest_path = f"{root}_pages.json"
+    with open(manifest_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    return(manifest_path)
+
+
+def paginate(sub_list, page_size=50, by_session=False):
+    """
+    Function to split column indices into pages.
+
+    Parameters
+    ----------
+    sub_list: list of strings
+        The labels, in order, of the subject_sessions (columns)
+    page_size: int or None
+        Maximum number of columns per page, or None for no limit.
+    by_session: bool
+        Start a new page for each session.
+
+    Returns
+    -------
+    list of lists of int
+
+    Example
+    -------
+    >>> sub_list = ['sub-1_ses-1', 'sub-2_ses-1', 'sub-3_ses-1',
+    ...             'sub-1_ses-2', 'sub-2_ses-2']
+    >>> paginate(sub_list, 2)
+    [[0, 1], [2, 3], [4]]
+    >>> paginate(sub_list, 2, by_session=True)
+    [[0, 1], [2], [3, 4]]
+    """
+    groups = [[]]
+    for column, sub in enumerate(sub_list):
+        if by_session and groups[-1] and (
+            sub.split("ses-")[-1] != sub_list[groups[-1][-1]].split("ses-")[-1]
+        ):
+            groups.append([])
+        groups[-1].append(column)
+    return([
+        group[start:start + (page_size or len(group))] for group in groups
+        for start in range(0, len(group), page_size or len(group) or 1)
+    ])
+
+
+def _render_page(kwargs):
+    generate_heatmap(**kwargs)
+    plt.close("all")
+
+
 def heatmap(data, row_labels, col_labels, ax=None,
             cbar_kw={}, cbarlabel="", **kwargs):
 
@@ -197,14 +400,17 @@ def heatmap(data, row_labels, col_labels, ax=None,
     return im, cbar
 
 
-def reshape_corrs(correlation_matrix):
+def reshape_corrs(correlation_matrix, metric="pearson"):
     """
     Function to reshape a given correlation matrix file to the shape expected by matplotlib.
 
     Parameter
     ---------
-    correlation_matrix: str or np.ndarray
-        path to matrix file or matrix
+    correlation_matrix: str, Labeled_Matrix or np.ndarray
+        path to matrix file (.mat or saved Labeled_Matrix) or matrix
+
+    metric: str
+        layer to plot from a Labeled_Matrix with metric layers
 
     Returns
     -------
@@ -212,10 +418,16 @@ def reshape_corrs(correlation_matrix):
         numpy n-dimensional array in the shape of the heatmap
         [features, subject_sessions]
     """
+    if is_labeled_matrix(correlation_matrix):
+        correlation_matrix = Labeled_Matrix.load(correlation_matrix)
+    if isinstance(correlation_matrix, Labeled_Matrix):
+        correlation_matrix = correlation_matrix.layer(metric)
+    if isinstance(correlation_matrix, str):
+        from scipy import io as sio
     return(
         abs(np.transpose(
             sio.loadmat(
-                correlation_matrix_path
+                correlation_matrix
             )['corrs'] if isinstance(
                 correlation_matrix, str
             ) else correlation_matrix
@@ -241,35 +453,67 @@ def parse_args(args):
         required=False
     )
 
+    parser.add_argument(
+        '--page_size',
+        type=int,
+        help='split the heatmap into pages of at most this many '
+             'participants (requires --output)'
+    )
+
+    parser.add_argument(
+        '--by_session',
+        action='store_true',
+        help='start a new page for each session (requires --output)'
+    )
+
+    parser.add_argument(
+        '--num_cores',
+        type=int,
+        default=1,
+        help='number of pages to render at once (default: %(default)s)'
+    )
+
     parsed = vars(parser.parse_args(args[1:] if len(args)>1 else args))
     return(parsed.pop('config'), parsed)
 
 
-def main(config_path, save_path=None):
+def main(config_path, save_path=None, page_size=None, by_session=False,
+         num_cores=1):
     with open(config_path, 'r') as config_file:
         config_settings = yaml.safe_load(config_file)
-    generate_heatmap(
-        reshape_corrs(
-            config_settings['correlation_matrix']
-        ) if 'correlation_matrix' in config_settings else
-        defaults.correlation_matrix,
-        var_list=config_settings[
-            'var_list'
-        ] if 'var_list' in config_settings else (
-            config_settings.get(
-                'regressor_list', []
-            ) + config_settings.get(
-                'motion_list',
-                []
-            )
-        ) if any([
+    plot = partial(
+        generate_heatmap_pages,
+        page_size=page_size,
+        by_session=by_session,
+        num_cores=num_cores
+    ) if save_path and (page_size or by_session) else generate_heatmap
+    if is_labeled_matrix(config_settings.get('correlation_matrix')):
+        # a labeled matrix carries its own axes, so only subset it if asked
+        labeled = Labeled_Matrix.load(config_settings['correlation_matrix'])
+        var_list = _config_var_list(config_settings) if any([
             l in config_settings for l in [
+                'var_list',
                 'regressor_list',
                 'motion_list'
             ]
-        ]) else (
-            defaults.regressor_list + defaults.motion_list
-        ),
+        ]) else None
+        sub_list = config_settings['subjects'] if isinstance(
+            config_settings.get('subjects'), list
+        ) else None
+        labeled = labeled.sel(subjects=sub_list, features=var_list)
+        plot(
+            reshape_corrs(labeled, config_settings.get('metric', 'pearson')),
+            var_list=labeled.features,
+            sub_list=labeled.subjects,
+            save_path=save_path
+        )
+        return
+    plot(
+        reshape_corrs(
+            config_settings['correlation_matrix']
+        ) if 'correlation_matrix' in config_settings else
+        defaults.correlation_matrix,
+        var_list=_config_var_list(config_settings),
         sub_list=generate_subject_list_for_range(
             (
                 config_settings['subjects']['start'],
@@ -301,6 +545,28 @@ def main(config_path, save_path=None):
     )
 
 
+def _config_var_list(config_settings):
+    return(
+        config_settings[
+            'var_list'
+        ] if 'var_list' in config_settings else (
+            config_settings.get(
+                'regressor_list', []
+            ) + config_settings.get(
+                'motion_list',
+                []
+            )
+        ) if any([
+            l in config_settings for l in [
+                'regressor_list',
+                'motion_list'
+            ]
+        ]) else (
+            defaults.regressor_list + defaults.motion_list
+        )
+    )
+
+
 if __name__ == "__main__":
     parsed = parse_args(sys.argv)
     main(parsed[0], **parsed[1])
@@ -0,0 +1,176 @@
+# coding=utf-8
+import json
+import numpy as np
+import os
+
+
+class Labeled_Matrix:
+    """
+    A class for a (subject × session) × feature matrix, optionally with a
+    third axis of metric layers, stored with its axis labels as a ``.npy``
+    file plus a JSON sidecar so it can be memory-mapped and sliced by label
+    without loading it all
+    """
+    def __init__(self, data, subjects, features, metrics=None):
+        """
+        Parameters
+        ----------
+        data: np.ndarray
+            (subjects, features) or (subjects, features, metrics) array
+
+        subjects: list of str
+
+        features: list of str
+
+        metrics: list of str or None
+            labels of the third axis, if any
+        """
+        self.data = data
+        self.subjects = list(subjects)
+        self.features = list(features)
+        self.metrics = list(metrics) if metrics is not None else None
+        expected = (len(self.subjects), len(self.features)) + (
+            (len(self.metrics),) if self.metrics is not None else ()
+        )
+        if tuple(data.shape) != expected:
+            raise ValueError(f"Data of shape {data.shape} does not match "
+                             f"axis labels of shape {expected}")
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """
+        Method to load a saved matrix, memory-mapped by default
+
+        Parameters
+        ----------
+        path: str
+            path to the ``.npy`` or ``.json`` file, or their shared root
+
+        mmap_mode: str or None
+            passed to `np.load`
+
+        Returns
+        -------
+        Labeled_Matrix
+        """
+        root = _root(path)
+        with open(f"{root}.json", "r") as sidecar_file:
+            sidecar = json.load(sidecar_file)
+        return(cls(
+            np.load(f"{root}.npy", mmap_mode=mmap_mode),
+            sidecar["subjects"],
+            sidecar["features"],
+            sidecar.get("metrics")
+        ))
+
+    def save(self, path):
+        """
+        Method to save the matrix as "{root}.npy" and "{root}.json"
+
+        Parameters
+        ----------
+        path: str
+            path to the ``.npy`` or ``.json`` file, or their shared root
+        """
+        root = _root(path)
+        # written beside and then moved into place, so a reader never
+        # sees a partly written file
+        tmp_root = f"{root}.tmp{os.getpid()}"
+        np.save(f"{tmp_root}.npy", np.asarray(self.data))
+        with open(f"{tmp_root}.json", "w") as sidecar_file:
+            json.dump({
+                "axes": ["subjects", "features"] + (
+                    ["metrics"] if self.metrics is not None else []
+                ),
+                "subjects": self.subjects,
+                "features": self.features,
+                "metrics": self.metrics,
+                "shape": list(self.data.shape),
+                "dtype": str(self.data.dtype)
+            }, sidecar_file, indent=2)
+        os.replace(f"{tmp_root}.npy", f"{root}.npy")
+        os.replace(f"{tmp_root}.json", f"{root}.json")
+
+    def layer(self, metric):
+        """
+        Method to return one metric layer as a (subjects, features) array
+
+        Parameters
+        ----------
+        metric: str
+
+        Returns
+        -------
+        np.ndarray
+        """
+        if self.metrics is None:
+            return(self.data)
+        return(self.data[..., self.metrics.index(metric)])
+
+    def sel(self, subjects=None, features=None, metrics=None):
+        """
+        Method to select a subset by label. Only the selected values are
+        read from a memory-mapped matrix.
+
+        Parameters
+        ----------
+        subjects: list of str or None
+            None for all
+
+        features: list of str or None
+            None for all
+
+        metrics: list of str or None
+            None for all
+
+        Returns
+        -------
+        Labeled_Matrix
+
+        Example
+        -------
+        >>> matrix = Labeled_Matrix(np.arange(6).reshape(2, 3),
+        ...                         ['sub-1', 'sub-2'], ['GS', 'CSF', 'WM'])
+        >>> matrix.sel(features=['WM', 'GS']).data
+        array([[2, 0],
+               [5, 3]])
+        """
+        index = [
+            [labels.index(label) for label in selected] if (
+                selected is not None
+            ) else slice(None) for labels, selected in [
+                (self.subjects, subjects),
+                (self.features, features)
+            ] + ([(self.metrics, metrics)] if self.metrics is not None else [])
+        ]
+        data = self.data
+        for axis, axis_index in enumerate(index):
+            if not isinstance(axis_index, slice):
+                data = np.take(data, axis_index, axis=axis)
+        return(Labeled_Matrix(
+            data,
+            subjects if subjects is not None else self.subjects,
+            features if features is not None else self.features,
+            metrics if metrics is not None else self.metrics
+        ))
+
+
+def is_labeled_matrix(path):
+    """
+    Function to check whether a path points to a saved Labeled_Matrix
+
+    Parameters
+    ----------
+    path: str
+
+    Returns
+    -------
+    bool
+    """
+    return(isinstance(path, str) and os.path.exists(f"{_root(path)}.json")
+           and os.path.exists(f"{_root(path)}.npy"))
+
+
+def _root(path):
+    root, ext = os.path.splitext(path)
+    return(root if ext in [".npy", ".json"] else path)
@@ -0,0 +1,167 @@
+# coding=utf-8
+import numpy as np
+import sys
+
+from collections import OrderedDict
+
+try:
+    from profiling import profiler
+    from s3_inputs import local_copy
+except ModuleNotFoundError:
+    from .profiling import profiler
+    from .s3_inputs import local_copy
+
+
+class Parsed_File_Cache:
+    """
+    A class for a least-recently-used cache of parsed files, bounded by
+    the approximate size in memory of the parsed data
+    """
+    def __init__(self, max_bytes=256 * 2**20):
+        """
+        Parameters
+        ----------
+        max_bytes: int
+            approximate upper bound on the memory held by cached data
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, path, parser):
+        """
+        Method to return a parsed file, parsing it only if it's not
+        already cached
+
+        Parameters
+        ----------
+        path: str
+            local path, or ``s3://`` URL to read through the registered
+            S3_Store
+
+        parser: function
+            function that takes `path` and returns the parsed data
+
+        Returns
+        -------
+        parsed data
+        """
+        key = (parser.__name__, path)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            profiler.count("parsed_file_cache_hits")
+            return(self._entries[key][0])
+        self.misses += 1
+        with local_copy(path) as local_path:
+            with profiler.stage(parser.__name__, paths=[local_path]):
+                parsed = parser(local_path)
+        size = _nbytes(parsed)
+        if size <= self.max_bytes:
+            self._entries[key] = (parsed, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self._entries.popitem(last=False)[1][1]
+        return(parsed)
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+
+def read_1D(path):
+    """
+    Function to parse a .1D file, e.g., C-PAC nuisance regressors or
+    CompCor components, with NumPy's C parser. Returns the same values as
+    ``afnipy.lib_afni1D.Afni1D(path)``'s ``mat`` and ``header`` without
+    needing AFNI installed.
+
+    Parameters
+    ----------
+    path: str
+
+    Returns
+    -------
+    mat: np.ndarray
+        one row per column of the file, each row contiguous in memory
+
+    header: list of str
+        comment lines, stripped, in order; C-PAC puts the column names in
+        the last one
+
+    Example
+    -------
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile("w", suffix=".1D") as f:
+    ...     _ = f.write("# C-PAC\\n# Intercept\\tGS\\n1\\t0.5\\n1\\t-0.5\\n")
+    ...     f.flush()
+    ...     mat, header = read_1D(f.name)
+    >>> mat
+    array([[ 1. ,  1. ],
+           [ 0.5, -0.5]])
+    >>> header[-1].split("\\t")
+    ['# Intercept', 'GS']
+    """
+    with open(path, "r") as f:
+        lines = f.read().splitlines()
+    header = []
+    body = []
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("#"):
+            header.append(stripped)
+        elif stripped:
+            body.append(stripped)
+    if not body:
+        return(np.empty((0, 0)), header)
+    mat = np.loadtxt(body, dtype=float, comments="#", ndmin=2)
+    return(np.ascontiguousarray(mat.T), header)
+
+
+def read_lines(path):
+    """
+    Function to read a text file's lines, stripped
+
+    Parameters
+    ----------
+    path: str
+
+    Returns
+    -------
+    list of str
+    """
+    with open(path, "r") as f:
+        return([line.strip() for line in f.read().splitlines()])
+
+
+def read_table(path):
+    """
+    Function to parse a tab-separated file
+
+    Parameters
+    ----------
+    path: str
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    import pandas as pd
+
+    return(pd.read_csv(path, sep="\t"))
+
+
+def _nbytes(parsed):
+    if isinstance(parsed, np.ndarray):
+        return(parsed.nbytes)
+    if hasattr(parsed, "memory_usage"):
+        # pandas data, without importing pandas to check
+        return(int(np.sum(parsed.memory_usage(index=True))))
+    if isinstance(parsed, (list, tuple)):
+        return(sum([_nbytes(item) for item in parsed]))
+    return(sys.getsizeof(parsed))
+
+
+parsed_files = Parsed_File_Cache()
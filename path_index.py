@@ -0,0 +1,277 @@
+# coding=utf-8
+import glob
+import json
+import os
+
+from fnmatch import fnmatchcase
+from hashlib import md5
+
+try:
+    from profiling import profiler
+except ModuleNotFoundError:
+    from .profiling import profiler
+
+_indices = {}
+
+
+class Path_Index:
+    """
+    A class for an in-memory index of the files under a run's ``working/``
+    and ``output/`` directories, built with one ``os.scandir`` pass and
+    queried with glob patterns instead of the filesystem
+    """
+    def __init__(self, run_path, subdirs=("working", "output"),
+                 cache_path=None):
+        """
+        Parameters
+        ----------
+        run_path: str
+            path to a run directory, ending with "/"
+
+        subdirs: iterable of str
+            directories under `run_path` to index
+
+        cache_path: str or None
+            path to a JSON file to persist the index to. If the file
+            exists, only directories whose mtime has changed since it was
+            written are listed again.
+        """
+        self.run_path = run_path if run_path.endswith("/") else f"{run_path}/"
+        cached = self._load(cache_path) if cache_path else {}
+        seen = set()
+        self.tree = {"mtime": None, "dirs": {}, "files": []}
+        for subdir in subdirs:
+            node = self._scan(
+                os.path.join(self.run_path, subdir),
+                cached.get("dirs", {}).get(subdir),
+                seen
+            )
+            if node is not None:
+                self.tree["dirs"][subdir] = node
+        if cache_path:
+            self.save(cache_path)
+
+    @classmethod
+    def from_paths(cls, run_path, paths):
+        """
+        Method to build an index from a listing instead of the filesystem,
+        e.g., from the keys under an object-store prefix
+
+        Parameters
+        ----------
+        run_path: str
+            run path, ending with "/"
+
+        paths: iterable of str
+            file paths relative to `run_path`
+
+        Returns
+        -------
+        Path_Index
+
+        Example
+        -------
+        >>> index = Path_Index.from_paths(
+        ...     "s3://bucket/run/", ["output/pipe/sub-1/a.1D", "output/b.1D"])
+        >>> index.glob("s3://bucket/run/output/*/*/*.1D")
+        ['s3://bucket/run/output/pipe/sub-1/a.1D']
+        """
+        index = cls.__new__(cls)
+        index.run_path = run_path if run_path.endswith(
+            "/"
+        ) else f"{run_path}/"
+        # files are collected in sets, then sorted as `_scan` stores them
+        index.tree = {"mtime": None, "dirs": {}, "files": set()}
+        for path in paths:
+            *dirs, filename = path.strip("/").split("/")
+            node = index.tree
+            for name in dirs:
+                node = node["dirs"].setdefault(
+                    name, {"mtime": None, "dirs": {}, "files": set()}
+                )
+            node["files"].add(filename)
+        nodes = [index.tree]
+        while nodes:
+            node = nodes.pop()
+            node["files"] = sorted(node["files"])
+            nodes.extend(node["dirs"].values())
+        return(index)
+
+    def glob(self, pattern):
+        """
+        Method to find indexed paths matching a glob pattern
+
+        Parameters
+        ----------
+        pattern: str
+            glob pattern beginning with this index's run path. Patterns
+            outside the run path are passed to `glob.glob`.
+
+        Returns
+        -------
+        paths: list of str
+            sorted matching paths
+        """
+        if not pattern.startswith(self.run_path):
+            return(sorted(glob.glob(pattern)))
+        paths = []
+        self._match(
+            self.tree,
+            pattern[len(self.run_path):].split("/"),
+            self.run_path[:-1],
+            paths
+        )
+        return(sorted(paths))
+
+    def save(self, cache_path):
+        """
+        Method to write the index to a JSON file
+
+        Parameters
+        ----------
+        cache_path: str
+        """
+        tmp_path = f"{cache_path}.tmp{os.getpid()}"
+        with open(tmp_path, "w") as cache_file:
+            json.dump({"run_path": self.run_path, "tree": self.tree},
+                      cache_file)
+        os.replace(tmp_path, cache_path)
+
+    def _load(self, cache_path):
+        try:
+            with open(cache_path, "r") as cache_file:
+                cached = json.load(cache_file)
+        except (OSError, ValueError):
+            return({})
+        return(cached["tree"] if cached.get(
+            "run_path"
+        ) == self.run_path else {})
+
+    def _match(self, node, parts, prefix, paths):
+        part, last = parts[0], len(parts) == 1
+        if last and part == "":
+            paths.append(f"{prefix}/")
+            return
+        names = list(node["dirs"]) + (node["files"] if last else [])
+        if glob.has_magic(part):
+            names = [name for name in names if fnmatchcase(name, part) and (
+                part.startswith(".") or not name.startswith(".")
+            )]
+        elif part not in names:
+            return
+        else:
+            names = [part]
+        for name in names:
+            if last:
+                paths.append(f"{prefix}/{name}")
+            elif name in node["dirs"]:
+                self._match(
+                    node["dirs"][name], parts[1:], f"{prefix}/{name}", paths
+                )
+
+    def _scan(self, path, previous, seen):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return(None)
+        if (stat.st_dev, stat.st_ino) in seen:
+            # symlink loop
+            return({"mtime": stat.st_mtime, "dirs": {}, "files": []})
+        seen.add((stat.st_dev, stat.st_ino))
+        if previous and previous["mtime"] == stat.st_mtime:
+            subdirs = list(previous["dirs"])
+            files = previous["files"]
+        else:
+            previous = None
+            subdirs, files = [], []
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        try:
+                            is_dir = entry.is_dir()
+                        except OSError:
+                            is_dir = False
+                        (subdirs if is_dir else files).append(entry.name)
+            except OSError:
+                pass
+        dirs = {}
+        for name in subdirs:
+            node = self._scan(
+                os.path.join(path, name),
+                previous["dirs"].get(name) if previous else None,
+                seen
+            )
+            if node is not None:
+                dirs[name] = node
+        return({"mtime": stat.st_mtime, "dirs": dirs, "files": sorted(files)})
+
+
+def index_run(run_path, cache_dir=None):
+    """
+    Function to index a run directory and register the index for
+    `glob_run`
+
+    Parameters
+    ----------
+    run_path: str
+
+    cache_dir: str or None
+        directory to persist the index in, if any
+
+    Returns
+    -------
+    Path_Index
+    """
+    cache_path = os.path.join(
+        cache_dir,
+        f"path_index_{md5(run_path.encode()).hexdigest()}.json"
+    ) if cache_dir else None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    _indices[run_path] = Path_Index(run_path, cache_path=cache_path)
+    return(_indices[run_path])
+
+
+def glob_run(pattern, run_path):
+    """
+    Function to glob within a run directory, using its index if one is
+    registered
+
+    Parameters
+    ----------
+    pattern: str
+
+    run_path: str
+
+    Returns
+    -------
+    paths: list of str
+    """
+    with profiler.stage("glob"):
+        if run_path in _indices:
+            return(_indices[run_path].glob(pattern))
+        return(glob.glob(pattern))
+
+
+def register_indices(indices):
+    """
+    Function to register already-built indices, e.g., in a worker process
+
+    Parameters
+    ----------
+    indices: dict
+        {run_path: Path_Index}
+    """
+    _indices.update(indices)
+
+
+def registered_indices():
+    """
+    Function to return the registered indices
+
+    Returns
+    -------
+    dict
+        {run_path: Path_Index}
+    """
+    return(dict(_indices))
@@ -0,0 +1,246 @@
+# coding=utf-8
+import csv
+import json
+import os
+import sys
+
+from contextlib import contextmanager
+from time import perf_counter, process_time
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+class Profile:
+    """
+    A class for cheap, always-on instrumentation: wall and CPU time, files,
+    bytes and growth in peak memory per named stage, wall and CPU time per
+    (subject × session, feature) cell, and counters. Stages can nest, so
+    their times needn't sum to the total.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.stages = {}
+        self.counters = {}
+        self.cells = {}
+        self.worker_peak_rss_mb = None
+        self._cell = None
+        self._start = (perf_counter(), process_time())
+
+    @contextmanager
+    def stage(self, name, paths=()):
+        """
+        Method to time a block as a stage
+
+        Parameters
+        ----------
+        name: str
+
+        paths: iterable of str
+            local files the stage reads, counted with their sizes
+
+        Example
+        -------
+        >>> profile = Profile()
+        >>> with profile.stage("parse", paths=[__file__]):
+        ...     pass
+        >>> profile.stages["parse"]["calls"], profile.stages["parse"]["files"]
+        (1, 1)
+
+        A stage that stays under the process's earlier peak memory isn't
+        charged for it
+
+        >>> peak = b"x" * 2**25
+        >>> del peak
+        >>> with profile.stage("small"):
+        ...     small = b"x" * 2**20
+        >>> profile.stages["small"]["peak_rss_growth_mb"] in [0.0, None]
+        True
+        """
+        wall, cpu = perf_counter(), process_time()
+        peak = peak_rss_mb()
+        try:
+            yield
+        finally:
+            wall, cpu = perf_counter() - wall, process_time() - cpu
+            entry = self.stages.setdefault(name, _empty_stage())
+            entry["calls"] += 1
+            entry["wall_seconds"] += wall
+            entry["cpu_seconds"] += cpu
+            for path in paths:
+                entry["files"] += 1
+                try:
+                    entry["bytes"] += os.path.getsize(path)
+                except OSError:
+                    pass
+            if peak is not None:
+                # the process's peak only ever rises, so a stage is
+                # charged only for what it raised it by
+                entry["peak_rss_growth_mb"] = (
+                    entry["peak_rss_growth_mb"] or 0.0
+                ) + peak_rss_mb() - peak
+            if self._cell is not None:
+                cell_stages = self.cells[self._cell]["stages"]
+                cell_stages[name] = cell_stages.get(name, 0.0) + wall
+
+    @contextmanager
+    def cell(self, subject, feature):
+        """
+        Method to time a block as work on one (subject × session, feature)
+        cell, attributing stages within it to the cell
+
+        Parameters
+        ----------
+        subject: str
+
+        feature: str
+        """
+        key = (subject, feature)
+        entry = self.cells.setdefault(key, {
+            "wall_seconds": 0.0, "cpu_seconds": 0.0, "stages": {}
+        })
+        outer, self._cell = self._cell, key
+        wall, cpu = perf_counter(), process_time()
+        try:
+            yield
+        finally:
+            entry["wall_seconds"] += perf_counter() - wall
+            entry["cpu_seconds"] += process_time() - cpu
+            self._cell = outer
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_dict(self):
+        """
+        Method to return the profile as a JSON-serializable dict
+
+        Returns
+        -------
+        dict
+        """
+        return({
+            "total": {
+                "wall_seconds": perf_counter() - self._start[0],
+                "cpu_seconds": process_time() - self._start[1],
+                "peak_rss_mb": peak_rss_mb(),
+                "worker_peak_rss_mb": self.worker_peak_rss_mb
+            },
+            "stages": self.stages,
+            "counters": self.counters,
+            "cells": [{
+                "subject": subject, "feature": feature, **entry
+            } for (subject, feature), entry in self.cells.items()]
+        })
+
+    def merge(self, other):
+        """
+        Method to add a profile from another process, e.g., a worker
+
+        Parameters
+        ----------
+        other: dict
+            output of `to_dict`
+        """
+        for name, other_entry in other["stages"].items():
+            entry = self.stages.setdefault(name, _empty_stage())
+            for key in ["calls", "wall_seconds", "cpu_seconds", "files",
+                        "bytes"]:
+                entry[key] += other_entry[key]
+            if other_entry["peak_rss_growth_mb"] is not None:
+                entry["peak_rss_growth_mb"] = (
+                    entry["peak_rss_growth_mb"] or 0.0
+                ) + other_entry["peak_rss_growth_mb"]
+        for name, n in other["counters"].items():
+            self.count(name, n)
+        for other_cell in other["cells"]:
+            entry = self.cells.setdefault(
+                (other_cell["subject"], other_cell["feature"]),
+                {"wall_seconds": 0.0, "cpu_seconds": 0.0, "stages": {}}
+            )
+            entry["wall_seconds"] += other_cell["wall_seconds"]
+            entry["cpu_seconds"] += other_cell["cpu_seconds"]
+            for name, wall in other_cell["stages"].items():
+                entry["stages"][name] = entry["stages"].get(name, 0.0) + wall
+        self.count("worker_tasks")
+        self.count("worker_cpu_seconds", other["total"]["cpu_seconds"])
+        self.worker_peak_rss_mb = _max(
+            self.worker_peak_rss_mb, other["total"]["peak_rss_mb"]
+        )
+
+    def save(self, output_dir):
+        """
+        Method to write "profile.json" and "profile.csv" to a directory
+
+        Parameters
+        ----------
+        output_dir: str
+
+        Returns
+        -------
+        list of str
+            paths written
+        """
+        profile = self.to_dict()
+        json_path = os.path.join(output_dir, "profile.json")
+        tmp_path = f"{json_path}.tmp{os.getpid()}"
+        with open(tmp_path, "w") as json_file:
+            json.dump(profile, json_file, indent=2)
+        os.replace(tmp_path, json_path)
+        csv_path = os.path.join(output_dir, "profile.csv")
+        tmp_path = f"{csv_path}.tmp{os.getpid()}"
+        with open(tmp_path, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["subject", "feature", "stage", "calls",
+                             "wall_seconds", "cpu_seconds", "files", "bytes",
+                             "peak_rss_mb", "peak_rss_growth_mb"])
+            writer.writerow(["", "", "total", "", *[
+                profile["total"][key] for key in
+                ["wall_seconds", "cpu_seconds"]
+            ], "", "", profile["total"]["peak_rss_mb"], ""])
+            for name, entry in profile["stages"].items():
+                writer.writerow(["", "", name, *[entry[key] for key in [
+                    "calls", "wall_seconds", "cpu_seconds", "files", "bytes"
+                ]], "", entry["peak_rss_growth_mb"]])
+            for cell in profile["cells"]:
+                writer.writerow([cell["subject"], cell["feature"], "cell", "",
+                                 cell["wall_seconds"], cell["cpu_seconds"],
+                                 "", "", "", ""])
+                for name, wall in cell["stages"].items():
+                    writer.writerow([cell["subject"], cell["feature"], name,
+                                     "", wall, "", "", "", "", ""])
+        os.replace(tmp_path, csv_path)
+        return([json_path, csv_path])
+
+
+def peak_rss_mb():
+    """
+    Function to return this process's peak resident memory so far
+
+    Returns
+    -------
+    float or None
+        MB, or None where the platform doesn't report it
+    """
+    if resource is None:
+        return(None)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KB elsewhere
+    return(peak / 2**20 if sys.platform == "darwin" else peak / 2**10)
+
+
+def _empty_stage():
+    return({"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "files": 0,
+            "bytes": 0, "peak_rss_growth_mb": None})
+
+
+def _max(a, b):
+    return(b if a is None else a if b is None else max(a, b))
+
+
+profiler = Profile()
@@ -0,0 +1,561 @@
+# coding=utf-8
+import csv
+import os
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+try:
+    from path_index import Path_Index, register_indices
+    from profiling import profiler
+except ModuleNotFoundError:
+    from .path_index import Path_Index, register_indices
+    from .profiling import profiler
+
+S3_PREFIX = "s3://"
+# worker processes' caches, under an S3_Store's cache_dir
+WORKERS_DIR = "_workers"
+
+_store = None
+
+
+def is_s3_path(path):
+    """
+    Function to check whether a path is an ``s3://`` URL
+
+    Parameters
+    ----------
+    path: str
+
+    Returns
+    -------
+    bool
+
+    Example
+    -------
+    >>> is_s3_path("s3://fcp-indi/data"), is_s3_path("/data")
+    (True, False)
+    """
+    return(isinstance(path, str) and path.startswith(S3_PREFIX))
+
+
+def split_s3_path(url):
+    """
+    Function to split an ``s3://`` URL into bucket and key
+
+    Parameters
+    ----------
+    url: str
+
+    Returns
+    -------
+    bucket: str
+
+    key: str
+
+    Example
+    -------
+    >>> split_s3_path("s3://fcp-indi/data/Projects/")
+    ('fcp-indi', 'data/Projects/')
+    """
+    bucket, _, key = url[len(S3_PREFIX):].partition("/")
+    return(bucket, key)
+
+
+def read_s3_creds(creds_path):
+    """
+    Function to read AWS credentials from either the CSV downloaded from
+    the AWS console or a file of ``AWSAccessKeyId=...`` and
+    ``AWSSecretKey=...`` lines
+
+    Parameters
+    ----------
+    creds_path: str
+
+    Returns
+    -------
+    dict
+        keyword arguments for a boto3 client
+    """
+    with open(creds_path, "r") as creds_file:
+        lines = [line.strip() for line in creds_file if line.strip()]
+    if lines and "=" not in lines[0]:
+        row = next(csv.DictReader(lines))
+        row = {key.strip().lower(): value.strip() for key, value in
+               row.items()}
+        return({
+            "aws_access_key_id": row["access key id"],
+            "aws_secret_access_key": row["secret access key"]
+        })
+    pairs = dict(line.split("=", 1) for line in lines if "=" in line)
+    pairs = {key.strip().lower(): value.strip() for key, value in
+             pairs.items()}
+    return({
+        "aws_access_key_id": pairs.get(
+            "awsaccesskeyid", pairs.get("aws_access_key_id")
+        ),
+        "aws_secret_access_key": pairs.get(
+            "awssecretkey", pairs.get("aws_secret_access_key")
+        )
+    })
+
+
+class S3_Store:
+    """
+    A class for reading ``s3://`` inputs through a bounded local disk
+    cache. Objects are downloaded by a pool of threads, so files can be
+    fetched ahead of when they are read. Cached copies are kept under
+    each object's ETag, so an object that's rewritten in S3 is downloaded
+    again instead of being read from a stale copy.
+    """
+    def __init__(self, cache_dir, s3_creds=None, max_cache_bytes=10 * 2**30,
+                 num_threads=8, endpoint_url=None):
+        """
+        Parameters
+        ----------
+        cache_dir: str
+            directory to download objects to
+
+        s3_creds: str or None
+            path to an AWS credentials file (see `read_s3_creds`). None
+            uses boto3's default credentials if there are any, otherwise
+            anonymous access (e.g., for the public fcp-indi bucket).
+
+        max_cache_bytes: int
+            approximate upper bound on the size of `cache_dir`. Least
+            recently used files are deleted to stay under it, so it should
+            hold at least the files prefetched at any one time. Files
+            in use (see `pinned`) aren't deleted, even if that leaves the
+            cache over the bound.
+
+        num_threads: int
+            number of concurrent downloads
+
+        endpoint_url: str or None
+            alternative S3 endpoint, e.g., a local S3-compatible server
+        """
+        self.cache_dir = cache_dir
+        self.s3_creds = s3_creds
+        self.max_cache_bytes = max_cache_bytes
+        self.num_threads = num_threads
+        self.endpoint_url = endpoint_url
+        os.makedirs(cache_dir, exist_ok=True)
+        self._setup()
+
+    def _setup(self):
+        self._client = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = {}
+        # url: ETag, from listings or HEAD requests
+        self._etags = {}
+        self._cached = OrderedDict()
+        # local path: number of callers using the file
+        self._pins = {}
+        self.nbytes = 0
+        # files already in the cache, least recently used first
+        cached = []
+        for root, dirs, files in os.walk(self.cache_dir):
+            for filename in files:
+                path = os.path.join(root, filename)
+                if ".tmp" in filename:
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                cached.append((stat.st_atime, path, stat.st_size))
+        for _, path, size in sorted(cached):
+            self._cached[path] = size
+            self.nbytes += size
+
+    def __getstate__(self):
+        # clients, threads and locks stay in the process that made them
+        return({key: getattr(self, key) for key in [
+            "cache_dir", "s3_creds", "max_cache_bytes", "num_threads",
+            "endpoint_url"
+        ]})
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._setup()
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+
+            kwargs = {"endpoint_url": self.endpoint_url} if (
+                self.endpoint_url
+            ) else {}
+            if self.s3_creds:
+                kwargs.update(read_s3_creds(self.s3_creds))
+            session = boto3.session.Session()
+            if not self.s3_creds and session.get_credentials() is None:
+                from botocore import UNSIGNED
+                from botocore.config import Config
+                kwargs["config"] = Config(signature_version=UNSIGNED)
+            self._client = session.client("s3", **kwargs)
+        return(self._client)
+
+    def for_worker(self, index, num_workers):
+        """
+        Method to return a store for one of several worker processes, with
+        its own cache subdirectory and an equal share of
+        `max_cache_bytes`. Pins and cache accounting only cover one
+        process, so workers sharing a cache could evict files each other
+        are reading and together overrun the bound.
+
+        Parameters
+        ----------
+        index: int
+            worker number, from 0
+
+        num_workers: int
+
+        Returns
+        -------
+        S3_Store
+        """
+        return(S3_Store(
+            os.path.join(self.cache_dir, WORKERS_DIR, str(index)),
+            s3_creds=self.s3_creds,
+            max_cache_bytes=self.max_cache_bytes // num_workers,
+            num_threads=self.num_threads,
+            endpoint_url=self.endpoint_url
+        ))
+
+    def list_keys(self, url):
+        """
+        Method to list the objects under a prefix
+
+        Parameters
+        ----------
+        url: str
+            ``s3://bucket/prefix/``
+
+        Returns
+        -------
+        list of str
+            keys relative to the prefix
+        """
+        bucket, prefix = split_s3_path(url)
+        keys = []
+        etags = {}
+        for page in self.client.get_paginator("list_objects_v2").paginate(
+            Bucket=bucket, Prefix=prefix
+        ):
+            for obj in page.get("Contents", []):
+                if not obj["Key"].endswith("/"):
+                    keys.append(obj["Key"][len(prefix):])
+                    etags[f"{S3_PREFIX}{bucket}/{obj['Key']}"] = obj[
+                        "ETag"
+                    ].strip('"')
+        with self._lock:
+            self._etags.update(etags)
+        return(keys)
+
+    def etag(self, url):
+        """
+        Method to return an object's ETag, from the last listing that
+        included it or else a HEAD request
+
+        Parameters
+        ----------
+        url: str
+
+        Returns
+        -------
+        str
+        """
+        with self._lock:
+            etag = self._etags.get(url)
+        if etag is None:
+            bucket, key = split_s3_path(url)
+            etag = self.client.head_object(Bucket=bucket, Key=key)[
+                "ETag"
+            ].strip('"')
+            with self._lock:
+                self._etags[url] = etag
+        return(etag)
+
+    def index(self, run_path, subdirs=("working", "output")):
+        """
+        Method to index a run under an ``s3://`` prefix from a listing of
+        its keys, without downloading anything, and register the index
+        for `path_index.glob_run`
+
+        Parameters
+        ----------
+        run_path: str
+            ``s3://bucket/prefix/``
+
+        subdirs: iterable of str
+            directories under `run_path` to index
+
+        Returns
+        -------
+        Path_Index
+        """
+        run_path = run_path if run_path.endswith("/") else f"{run_path}/"
+        index = Path_Index.from_paths(run_path, [
+            f"{subdir}/{key}" for subdir in subdirs for key in
+            self.list_keys(f"{run_path}{subdir}/")
+        ])
+        register_indices({run_path: index})
+        return(index)
+
+    def local_path(self, url):
+        """
+        Method to return where the current version of an object is
+        cached
+
+        Parameters
+        ----------
+        url: str
+
+        Returns
+        -------
+        str
+        """
+        bucket, key = split_s3_path(url)
+        return(os.path.join(self.cache_dir, bucket, self.etag(url),
+                            *key.split("/")))
+
+    def fetch(self, url):
+        """
+        Method to return a local copy of an object, waiting for it if it
+        is being prefetched and downloading it otherwise
+
+        Parameters
+        ----------
+        url: str
+
+        Returns
+        -------
+        str
+            local path
+        """
+        with profiler.stage("s3_fetch"):
+            self.prefetch([url])
+            with self._lock:
+                pending = self._pending.get(url)
+            if pending is not None:
+                path = pending.result()
+            else:
+                path = self.local_path(url)
+            if not os.path.exists(path):
+                # evicted since it was prefetched
+                path = self._download(url)
+            with self._lock:
+                if path in self._cached:
+                    self._cached.move_to_end(path)
+        return(path)
+
+    @contextmanager
+    def pinned(self, url):
+        """
+        Context manager for a local copy of an object that isn't evicted
+        from the cache until the block exits
+
+        Parameters
+        ----------
+        url: str
+
+        Yields
+        ------
+        str
+            local path
+        """
+        path = self.local_path(url)
+        with self._lock:
+            self._pins[path] = self._pins.get(path, 0) + 1
+        try:
+            yield(self.fetch(url))
+        finally:
+            with self._lock:
+                self._pins[path] -= 1
+                if not self._pins[path]:
+                    del self._pins[path]
+
+    def prefetch(self, urls):
+        """
+        Method to start downloading objects in the background
+
+        Parameters
+        ----------
+        urls: iterable of str
+            non-``s3://`` paths are ignored
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.num_threads
+                )
+            for url in urls:
+                # whether it's cached is checked in the download thread,
+                # which may need to request the object's ETag
+                if not is_s3_path(url) or url in self._pending:
+                    continue
+                self._pending[url] = self._executor.submit(
+                    self._download, url
+                )
+
+    def _download(self, url):
+        try:
+            path = self.local_path(url)
+            with self._lock:
+                if path in self._cached and os.path.exists(path):
+                    self._pending.pop(url, None)
+                    return(path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+            self.client.download_file(*split_s3_path(url), tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            with self._lock:
+                self._pending.pop(url, None)
+            raise
+        size = os.path.getsize(path)
+        with self._lock:
+            self._pending.pop(url, None)
+            self.nbytes += size - self._cached.pop(path, 0)
+            self._cached[path] = size
+            # never evict the file just downloaded or files in use
+            for evicted in list(self._cached):
+                if self.nbytes <= self.max_cache_bytes:
+                    break
+                if evicted == path or evicted in self._pins:
+                    continue
+                self.nbytes -= self._cached.pop(evicted)
+                try:
+                    os.remove(evicted)
+                except OSError:
+                    pass
+        return(path)
+
+
+def register_store(store):
+    """
+    Function to register the S3_Store that `local_file` and `prefetch`
+    use, e.g., in a worker process
+
+    Parameters
+    ----------
+    store: S3_Store or None
+    """
+    global _store
+    _store = store
+
+
+def register_worker_store(store, worker_count, num_workers):
+    """
+    Function to register a worker process's own share of `store` (see
+    `S3_Store.for_worker`), e.g., as a process pool's initializer
+
+    Parameters
+    ----------
+    store: S3_Store or None
+
+    worker_count: multiprocessing.Value
+        integer shared by the pool's workers to number them
+
+    num_workers: int
+    """
+    if store is not None:
+        with worker_count.get_lock():
+            index = worker_count.value
+            worker_count.value += 1
+        store = store.for_worker(index, num_workers)
+    register_store(store)
+
+
+def registered_store():
+    """
+    Function to return the registered S3_Store
+
+    Returns
+    -------
+    S3_Store or None
+    """
+    return(_store)
+
+
+def index_s3_run(run_path):
+    """
+    Function to index a run under an ``s3://`` prefix with the registered
+    S3_Store
+
+    Parameters
+    ----------
+    run_path: str
+
+    Returns
+    -------
+    Path_Index
+    """
+    if _store is None:
+        raise Exception(f"\n\n[!] No S3 store is registered to index "
+                        f"{run_path} with.\n\n")
+    return(_store.index(run_path))
+
+
+def local_file(path):
+    """
+    Function to return a local path for a path or ``s3://`` URL. A
+    downloaded file can be evicted from the cache by later downloads; use
+    `local_copy` to read it.
+
+    Parameters
+    ----------
+    path: str
+
+    Returns
+    -------
+    str
+    """
+    if not is_s3_path(path):
+        return(path)
+    if _store is None:
+        raise Exception(f"\n\n[!] No S3 store is registered to read {path} "
+                        "from.\n\n")
+    return(_store.fetch(path))
+
+
+@contextmanager
+def local_copy(path):
+    """
+    Context manager for a local path for a path or ``s3://`` URL that
+    stays in the registered S3_Store's cache until the block exits
+
+    Parameters
+    ----------
+    path: str
+
+    Yields
+    ------
+    str
+    """
+    if not is_s3_path(path):
+        yield(path)
+        return
+    if _store is None:
+        raise Exception(f"\n\n[!] No S3 store is registered to read {path} "
+                        "from.\n\n")
+    with _store.pinned(path) as local_path:
+        yield(local_path)
+
+
+def prefetch(paths):
+    """
+    Function to start downloading any ``s3://`` URLs in `paths` in the
+    background, if an S3_Store is registered
+
+    Parameters
+    ----------
+    paths: iterable of str
+    """
+    if _store is not None:
+        _store.prefetch(paths)
@@ -0,0 +1,120 @@
+import numpy as np
+import os
+
+
+def test_incremental_correlation_matrix(tmp_path):
+
+    try:
+        from benchmarks.synthetic_tree import make_cpac_run, subject_list
+        from cell_journal import Cell_Journal
+        from configs.defaults import motion_list, regressor_list
+        from correlation_matrix import Correlation_Matrix, \
+                                       Subject_Session_Feature, metric_names
+        from parse_cache import parsed_files
+    except ModuleNotFoundError:
+        from .benchmarks.synthetic_tree import make_cpac_run, subject_list
+        from .cell_journal import Cell_Journal
+        from .configs.defaults import motion_list, regressor_list
+        from .correlation_matrix import Correlation_Matrix, \
+                                        Subject_Session_Feature, metric_names
+        from .parse_cache import parsed_files
+
+    subjects = subject_list(3)
+    features = regressor_list + motion_list
+    runs = [{"software": "C-PAC", "run_path": f"{tmp_path / name}/"} for
+            name in ["new", "old"]]
+    for seed, run in enumerate(runs):
+        make_cpac_run(run["run_path"], subjects, n_timepoints=20, seed=seed)
+    output_dir = str(tmp_path / "correlations")
+    os.makedirs(output_dir)
+
+    def _run():
+        journal = Cell_Journal(output_dir, runs, metric_names)
+        corrs = Correlation_Matrix(subjects, features, runs,
+                                   hash_check=False, journal=journal)
+        recalculated = [(subject, feature) for subject in corrs.data for
+                        feature, cell in corrs.data[subject].items() if
+                        cell.previous is None]
+        return(journal, corrs, recalculated)
+
+    journal, full, recalculated = _run()
+    assert len(recalculated) == len(subjects) * len(features)
+
+    # stopped before committing, with a half-written last line
+    del journal
+    with open(os.path.join(output_dir, "cells.jsonl"), "a") as f:
+        f.write('{"subject": "sub-')
+    journal, resumed, recalculated = _run()
+    assert recalculated == []
+    np.testing.assert_array_equal(resumed.metrics, full.metrics)
+
+    journal.commit()
+    assert not os.path.exists(os.path.join(output_dir, "cells.jsonl"))
+
+    subject, session = subjects[1].split("_")
+    fd_path = Subject_Session_Feature.get_paths(
+        subject, "FD", runs[0]["run_path"], session=session
+    )[0]
+    with open(fd_path, "a") as f:
+        f.write("0.5\n")
+    parsed_files.clear()
+    journal, incremental, recalculated = _run()
+    assert recalculated == [(subjects[1], "FD")]
+    assert not np.array_equal(incremental.metrics[1, -1], full.metrics[1, -1])
+    np.testing.assert_array_equal(np.delete(incremental.metrics, -1, axis=1),
+                                  np.delete(full.metrics, -1, axis=1))
+
+
+def test_interrupted_serial_run_resumes(tmp_path, monkeypatch):
+
+    try:
+        from benchmarks.synthetic_tree import make_cpac_run, subject_list
+        from cell_journal import Cell_Journal
+        from configs.defaults import motion_list, regressor_list
+        import correlation_matrix
+    except ModuleNotFoundError:
+        from .benchmarks.synthetic_tree import make_cpac_run, subject_list
+        from .cell_journal import Cell_Journal
+        from .configs.defaults import motion_list, regressor_list
+        from . import correlation_matrix
+
+    subjects = subject_list(3)
+    features = regressor_list + motion_list
+    runs = [{"software": "C-PAC", "run_path": f"{tmp_path / name}/"} for
+            name in ["new", "old"]]
+    for seed, run in enumerate(runs):
+        make_cpac_run(run["run_path"], subjects, n_timepoints=20, seed=seed)
+    output_dir = str(tmp_path / "correlations")
+    os.makedirs(output_dir)
+    correlation_matrix.parsed_files.clear()
+
+    Subject_Session_Feature = correlation_matrix.Subject_Session_Feature
+    original_init = Subject_Session_Feature.__init__
+
+    def _interrupted_init(self, subject, *args, **kwargs):
+        if subject == subjects[2]:
+            raise KeyboardInterrupt
+        original_init(self, subject, *args, **kwargs)
+
+    monkeypatch.setattr(Subject_Session_Feature, "__init__",
+                        _interrupted_init)
+    journal = Cell_Journal(output_dir, runs, correlation_matrix.metric_names)
+    try:
+        correlation_matrix.Correlation_Matrix(
+            subjects, features, runs, hash_check=False, journal=journal
+        )
+    except KeyboardInterrupt:
+        pass
+    del journal
+    monkeypatch.setattr(Subject_Session_Feature, "__init__", original_init)
+
+    journal = Cell_Journal(output_dir, runs, correlation_matrix.metric_names)
+    resumed = correlation_matrix.Correlation_Matrix(
+        subjects, features, runs, hash_check=False, journal=journal
+    )
+    recalculated = {subject for subject in resumed.data for cell in
+                    resumed.data[subject].values() if cell.previous is None}
+    assert recalculated == {subjects[2]}
+    full = correlation_matrix.Correlation_Matrix(subjects, features, runs,
+                                                 hash_check=False)
+    np.testing.assert_array_equal(resumed.metrics, full.metrics)
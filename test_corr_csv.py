@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("columns,expected", [
+    ({"a": [1., 2, 3], "b": [4., 4, 4]}, 1.0),
+    ({"b": [4., 4, 4]}, np.nan)
+])
+def test_identical_files(columns, expected, tmp_path, capsys):
+    pd = pytest.importorskip("pandas")
+
+    try:
+        from corr_csv import quick_corr_csv
+    except ModuleNotFoundError:
+        from .corr_csv import quick_corr_csv
+
+    csv_files = [str(tmp_path / f"{run}.tsv") for run in ["old", "new"]]
+    for csv_file in csv_files:
+        pd.DataFrame(columns).to_csv(csv_file, sep="\t", index=False)
+
+    quick_corr_csv(*csv_files)
+    output = capsys.readouterr().out
+
+    assert "Files are identical" in output
+    # constant columns correlate as NaN, as they do between different files
+    assert "b: nan" in output
+    np.testing.assert_equal(float(output.strip().splitlines()[-1]), expected)
@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def func_pair(tmp_path):
+    nb = pytest.importorskip("nibabel")
+
+    try:
+        from benchmarks.synthetic_tree import make_func_pair
+    except ModuleNotFoundError:
+        from .benchmarks.synthetic_tree import make_func_pair
+
+    func1, func2 = make_func_pair(str(tmp_path), shape=(6, 5, 7, 30))
+    # constant time series in one image or both, which correlate as NaN
+    for func, voxels in [(func1, [(0, 0, 0), (1, 2, 3)]),
+                         (func2, [(0, 0, 0), (5, 4, 6)])]:
+        img = nb.load(func)
+        data = np.asanyarray(img.dataobj).copy()
+        for voxel in voxels:
+            data[voxel] = 3.0
+        nb.Nifti1Image(data, img.affine).to_filename(func)
+    return(func1, func2)
+
+
+def _load(func):
+    import nibabel as nb
+
+    img = nb.load(func)
+    return(img, np.asanyarray(img.dataobj))
+
+
+def test_streaming_voxelwise_corr(func_pair):
+
+    try:
+        from corr_two_ts import streaming_voxelwise_corr, voxelwise_corr
+    except ModuleNotFoundError:
+        from .corr_two_ts import streaming_voxelwise_corr, voxelwise_corr
+
+    (img1, data1), (img2, data2) = [_load(func) for func in func_pair]
+    expected = voxelwise_corr(data1, data2)
+    assert np.isnan(expected[[0, 1, 5], [0, 2, 4], [0, 3, 6]]).all()
+
+    n_voxels = np.prod(img1.shape[:3])
+    for slab in [1, 7, 30, 100]:
+        # the memory budget `streaming_voxelwise_corr` turns into `slab`
+        # volumes at a time; 7 doesn't divide the 30 volumes
+        max_memory_mb = (10 * 8 + (slab + 0.5) * 2 * 3 * 8) * n_voxels / 2**20
+        r_map = streaming_voxelwise_corr(img1, img2, max_memory_mb)
+        assert np.array_equal(np.isnan(r_map), np.isnan(expected))
+        assert np.allclose(r_map, expected, equal_nan=True)
+
+
+def test_parallel_voxelwise_corr(func_pair):
+
+    try:
+        from corr_two_ts import parallel_voxelwise_corr, voxelwise_corr
+    except ModuleNotFoundError:
+        from .corr_two_ts import parallel_voxelwise_corr, voxelwise_corr
+
+    expected = voxelwise_corr(*[_load(func)[1] for func in func_pair])
+    # 4 slabs of 7 slices are uneven
+    r_map, mean_r = parallel_voxelwise_corr(*func_pair, num_cores=2,
+                                            chunks_per_core=2)
+
+    assert np.allclose(r_map, expected, equal_nan=True)
+    assert np.isclose(mean_r, np.nanmean(expected))
+
+
+@pytest.mark.parametrize("shape,data,expected", [
+    ((4, 4, 4), "random", None),
+    ((4, 4, 4, 5), "constant", "nan"),
+    ((4, 4, 4, 5), "random", "1.0")
+])
+def test_identical_inputs(shape, data, expected, tmp_path):
+    nb = pytest.importorskip("nibabel")
+    import os
+    import subprocess
+    import sys
+
+    func = str(tmp_path / "func.nii.gz")
+    nb.Nifti1Image(
+        np.random.default_rng(0).normal(size=shape).astype(np.float32) if
+        data == "random" else np.ones(shape, dtype=np.float32), np.eye(4)
+    ).to_filename(func)
+    result = subprocess.run(
+        [sys.executable, "corr_two_ts.py", func, func], capture_output=True,
+        text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+
+    if expected is None:
+        # identical inputs are still validated
+        assert result.returncode != 0
+        assert "not a 4D/time series dataset" in result.stderr
+    else:
+        assert result.stdout.strip() == expected
+
+
+def test_any_voxel_varies(func_pair):
+
+    try:
+        from corr_two_ts import any_voxel_varies
+    except ModuleNotFoundError:
+        from .corr_two_ts import any_voxel_varies
+
+    import nibabel as nb
+
+    img, data = _load(func_pair[0])
+    n_voxels = np.prod(img.shape[:3])
+    constant = np.full(img.shape, 3.0)
+    # varies only in the last of several slabs of 7 volumes
+    constant[2, 2, 2, -1] = 4.0
+    for data, expected in [(data, True), (constant, True),
+                           (np.full(img.shape, 3.0), False)]:
+        for slab in [1, 7, 100]:
+            max_memory_mb = (2 * 8 + (slab + 0.5) * 2 * 8) * n_voxels / 2**20
+            assert any_voxel_varies(
+                nb.Nifti1Image(data, img.affine), max_memory_mb
+            ) is expected
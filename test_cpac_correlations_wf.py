@@ -1,3 +1,4 @@
+import numpy as np
 
 
 def test_create_unique_file_dict():
@@ -152,6 +153,11 @@ def test_calculate_correlation_no_s3():
 
 def test_aggregate_correlations():
 
+    try:
+        from cpac_correlations_wf import aggregate_correlations
+    except ModuleNotFoundError:
+        from .cpac_correlations_wf import aggregate_correlations
+
     correlation_info_list = \
         [("anatomical_brain", 1.0, 1.0), ("anatomical_brain", 0.95, 0.89), \
          ("anatomical_brain", 0.67,0.50), ("alff_img", 0.98, 0.96), \
@@ -166,3 +172,32 @@ def test_aggregate_correlations():
 
     assert ref_pearson_dict == pearson_dict
     assert ref_concor_dict == concor_dict
+
+
+def test_identical_files_read_once(tmp_path, capsys):
+
+    try:
+        from cpac_correlations_wf import run_correlations
+        from file_hashes import Digest_Cache
+    except ModuleNotFoundError:
+        from .cpac_correlations_wf import run_correlations
+        from .file_hashes import Digest_Cache
+
+    for name, values in [("varies", "1\n2\n3\n"), ("constant", "2\n2\n2\n")]:
+        for run in ["old", "new"]:
+            (tmp_path / f"{run}_{name}.1D").write_text(values)
+    matched = {name: {"file": (str(tmp_path / f"old_{name}.1D"),
+                               str(tmp_path / f"new_{name}.1D"))} for
+               name in ["varies", "constant"]}
+
+    pearson, concordance = run_correlations(matched,
+                                            digest_cache=Digest_Cache())
+
+    assert "2 pairs of files are identical" in capsys.readouterr().out
+    # the same as correlating them: 1.0 if the values vary, NaN otherwise
+    assert pearson["varies"] == concordance["varies"] == [1.0]
+    assert np.isnan(pearson["constant"] + concordance["constant"]).all()
+    for results, correlated in zip([pearson, concordance],
+                                   run_correlations(matched)):
+        for name in results:
+            np.testing.assert_allclose(results[name], correlated[name])
@@ -0,0 +1,92 @@
+import numpy as np
+import os
+import pytest
+
+
+@pytest.fixture
+def feature_file(tmp_path):
+    path = tmp_path / "FD.1D"
+    path.write_text("0.1\n0.2\n0.3\n")
+    return(str(path))
+
+
+def _counting_reader(calls):
+    def reader(files, feature, software):
+        calls.append(files)
+        return(np.loadtxt(files[0]) if os.path.exists(files[0]) else None)
+    return(reader)
+
+
+def _cache_files(cache_dir):
+    return([os.path.join(root, filename) for root, _, files in
+            os.walk(cache_dir) for filename in files])
+
+
+def test_cache_hit(feature_file, tmp_path):
+
+    try:
+        from feature_cache import Feature_Cache
+    except ModuleNotFoundError:
+        from .feature_cache import Feature_Cache
+
+    cache = Feature_Cache(str(tmp_path / "cache"))
+    calls = []
+    reader = _counting_reader(calls)
+    first = cache.read([feature_file], "FD", "C-PAC", reader)
+    second = cache.read([feature_file], "FD", "C-PAC", reader)
+
+    assert len(calls) == 1
+    np.testing.assert_array_equal(first, [0.1, 0.2, 0.3])
+    np.testing.assert_array_equal(second, first)
+    # nothing is left behind by the atomic write
+    assert [os.path.basename(path) for path in _cache_files(
+        tmp_path / "cache"
+    )] == [f"{Feature_Cache.key([feature_file], 'FD', 'C-PAC')}.npy"]
+
+
+def test_cache_miss_on_mtime_change(feature_file, tmp_path):
+
+    try:
+        from feature_cache import Feature_Cache
+    except ModuleNotFoundError:
+        from .feature_cache import Feature_Cache
+
+    cache = Feature_Cache(str(tmp_path / "cache"))
+    calls = []
+    reader = _counting_reader(calls)
+    cache.read([feature_file], "FD", "C-PAC", reader)
+    with open(feature_file, "w") as f:
+        f.write("0.4\n0.5\n0.6\n")
+    stat = os.stat(feature_file)
+    os.utime(feature_file, ns=(stat.st_atime_ns,
+                               stat.st_mtime_ns + 10**9))
+
+    np.testing.assert_array_equal(
+        cache.read([feature_file], "FD", "C-PAC", reader), [0.4, 0.5, 0.6]
+    )
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("contents", [b"", b"\x93NUMPY\x01\x00v\x00"])
+def test_corrupted_cache_file_is_recomputed(feature_file, tmp_path,
+                                            contents):
+
+    try:
+        from feature_cache import Feature_Cache
+    except ModuleNotFoundError:
+        from .feature_cache import Feature_Cache
+
+    cache = Feature_Cache(str(tmp_path / "cache"))
+    calls = []
+    reader = _counting_reader(calls)
+    cache.read([feature_file], "FD", "C-PAC", reader)
+    cache_file, = _cache_files(tmp_path / "cache")
+    with open(cache_file, "wb") as f:
+        f.write(contents)
+
+    np.testing.assert_array_equal(
+        cache.read([feature_file], "FD", "C-PAC", reader), [0.1, 0.2, 0.3]
+    )
+    assert len(calls) == 2
+    # the recomputed vector replaces the corrupted file
+    np.testing.assert_array_equal(np.load(cache_file), [0.1, 0.2, 0.3])
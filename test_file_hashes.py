@@ -0,0 +1,113 @@
+import os
+
+
+def test_digest_cache_identical(tmp_path):
+
+    try:
+        from file_hashes import Digest_Cache
+    except ModuleNotFoundError:
+        from .file_hashes import Digest_Cache
+
+    paths = {}
+    for name, content in [
+        ("a", b"1 2 3\n"), ("b", b"1 2 3\n"), ("c", b"1 2 4\n"), ("d", b"1\n")
+    ]:
+        paths[name] = str(tmp_path / f"{name}.1D")
+        with open(paths[name], "wb") as f:
+            f.write(content)
+
+    cache_dir = str(tmp_path / "digests")
+    digest_cache = Digest_Cache(cache_dir)
+
+    assert digest_cache.identical([paths["a"]], [paths["b"]])
+    assert not digest_cache.identical([paths["a"]], [paths["c"]])
+    assert not digest_cache.identical([], [])
+    assert digest_cache.identical_pairs([
+        (paths["a"], paths["b"]),
+        (paths["a"], paths["d"]),
+        (paths["a"], str(tmp_path / "missing.1D"))
+    ]) == [True, False, False]
+
+    # digests persist for a new cache, and a changed file is hashed again
+    assert Digest_Cache(cache_dir).digest(paths["c"]) == (
+        digest_cache.digest(paths["c"])
+    )
+    with open(paths["c"], "wb") as f:
+        f.write(b"1 2 3\n")
+    os.utime(paths["c"], ns=(0, 0))
+    assert Digest_Cache(cache_dir).identical([paths["a"]], [paths["c"]])
+
+
+def test_identical_missing_feature_is_nan(tmp_path):
+
+    try:
+        from benchmarks.synthetic_tree import make_cpac_run, subject_list
+        from correlation_matrix import Correlation_Matrix, identical_metrics
+        from parse_cache import parsed_files
+    except ModuleNotFoundError:
+        from .benchmarks.synthetic_tree import make_cpac_run, subject_list
+        from .correlation_matrix import Correlation_Matrix, identical_metrics
+        from .parse_cache import parsed_files
+
+    import glob
+    import numpy as np
+    import shutil
+
+    subjects = subject_list(2)
+    runs = [{"software": "C-PAC", "run_path": f"{tmp_path / name}/"} for
+            name in ["new", "old"]]
+    make_cpac_run(runs[0]["run_path"], subjects, n_timepoints=20)
+    # drop the global signal column's name from every regressor file
+    for path in glob.glob(f"{runs[0]['run_path']}**/nuisance_regressors.1D",
+                          recursive=True):
+        with open(path, "r") as f:
+            contents = f.read()
+        with open(path, "w") as f:
+            f.write(contents.replace("GlobalSignalMean0", "Unknown"))
+    shutil.copytree(runs[0]["run_path"], runs[1]["run_path"])
+    parsed_files.clear()
+
+    corrs = Correlation_Matrix(subjects, ["GS", "WM"], runs)
+
+    assert all(corrs.data[subject][feature].identical is (feature == "WM")
+               for subject in subjects for feature in ["GS", "WM"])
+    assert np.isnan(corrs.metrics[:, 0, :3]).all()
+    np.testing.assert_array_equal(
+        corrs.metrics[:, 1], [identical_metrics] * len(subjects)
+    )
+
+
+def test_subject_session_hashed_in_one_pass(tmp_path, monkeypatch):
+
+    try:
+        from benchmarks.synthetic_tree import make_cpac_run, subject_list
+        from configs.defaults import motion_list, regressor_list
+        import correlation_matrix
+        import file_hashes
+    except ModuleNotFoundError:
+        from .benchmarks.synthetic_tree import make_cpac_run, subject_list
+        from .configs.defaults import motion_list, regressor_list
+        from . import correlation_matrix
+        from . import file_hashes
+
+    import shutil
+
+    subject = subject_list(1)[0]
+    features = regressor_list + motion_list
+    make_cpac_run(str(tmp_path / "old"), [subject], n_timepoints=20)
+    shutil.copytree(tmp_path / "old", tmp_path / "new")
+    runs = [{"software": "C-PAC", "run_path": f"{tmp_path / name}/"} for
+            name in ["old", "new"]]
+    digest_cache = file_hashes.Digest_Cache()
+    correlation_matrix._hash_subject_session(subject, features, runs,
+                                             digest_cache)
+
+    def _unhashed(path, *args, **kwargs):
+        raise AssertionError(f"{path} wasn't hashed in the first pass")
+
+    monkeypatch.setattr(file_hashes, "hash_file", _unhashed)
+    for feature in features:
+        cell = correlation_matrix.Subject_Session_Feature(
+            subject, feature, runs, digest_cache=digest_cache
+        )
+        assert cell.identical
@@ -0,0 +1,51 @@
+import os
+import pytest
+import subprocess
+import sys
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+
+# dependencies only some code paths need, loaded when they're first used
+HEAVY_MODULES = ["afnipy", "matplotlib", "nibabel", "pandas", "scipy",
+                 "tabulate"]
+
+# time to import `correlation_matrix` once NumPy is loaded, as a fraction
+# of the time to import NumPy in the same process, so the budget scales
+# with the machine running it
+IMPORT_BUDGET = 1.0
+
+
+def _run(*args):
+    return(subprocess.run(
+        [sys.executable, *args], capture_output=True, text=True, cwd=REPO,
+        check=True
+    ))
+
+
+@pytest.mark.parametrize("module", [
+    "callback_log_time_parse", "corr_csv", "corr_two_ts", "correlation_matrix",
+    "cpac_correlations_wf", "cpac_pipe_diff"
+])
+def test_no_heavy_imports(module):
+    loaded = _run("-c", f"import sys, {module}; print(' '.join(["
+                  f"m for m in {HEAVY_MODULES!r} if m in sys.modules]))")
+    assert loaded.stdout.split() == []
+
+
+def test_correlation_matrix_import_time():
+
+    def _ratio():
+        importtime = _run("-X", "importtime", "-c",
+                          "import numpy, correlation_matrix")
+        cumulative = {
+            line.split("|")[-1].strip(): int(line.split("|")[1]) for
+            line in importtime.stderr.splitlines()[1:]
+        }
+        return(cumulative["correlation_matrix"] / cumulative["numpy"])
+
+    # best of a few, so one slow start doesn't fail the test
+    assert min(_ratio() for _ in range(3)) < IMPORT_BUDGET
+
+
+def test_correlation_matrix_help():
+    assert "feature name" in _run("correlation_matrix.py", "--help").stdout
@@ -0,0 +1,79 @@
+import numpy as np
+import os
+import pytest
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "test_data")
+
+EXPECTED_1D = {
+    "nuisance_regressors.1D": (
+        [[1.0, 1.0, 1.0],
+         [0.123456, -0.654321, 0.0],
+         [-0.45, 3.25, 1000.0],
+         [2.0, -2.0, 0.5]],
+        ["# C-PAC 1.8.0", "# Nuisance regressors:",
+         "# Intercept\tGlobalSignalMean0\tWhiteMatterMean0\t"
+         "CerebrospinalFluidMean0"]
+    ),
+    "aCompCor_components.1D": (
+        [[0.0, 0.1, -0.3, 0.5],
+         [0.0, 0.2, -0.2, 0.5],
+         [0.0, 0.3, -0.1, 0.5]],
+        ["#"]
+    ),
+    "FD.1D": (
+        [[0.1, 0.25, 0.3]],
+        ["# FD", "# a comment between values"]
+    )
+}
+
+
+@pytest.mark.parametrize("filename", list(EXPECTED_1D))
+def test_read_1D(filename):
+
+    try:
+        from parse_cache import read_1D
+    except ModuleNotFoundError:
+        from .parse_cache import read_1D
+
+    mat, header = read_1D(os.path.join(TEST_DATA, filename))
+    expected_mat, expected_header = EXPECTED_1D[filename]
+
+    np.testing.assert_array_equal(mat, expected_mat)
+    assert mat.flags["C_CONTIGUOUS"]
+    assert header == expected_header
+
+
+def test_read_1D_column_names():
+
+    try:
+        from parse_cache import read_1D
+    except ModuleNotFoundError:
+        from .parse_cache import read_1D
+
+    mat, header = read_1D(os.path.join(TEST_DATA, "nuisance_regressors.1D"))
+    columns = header[-1].split("\t")
+
+    # C-PAC's column names are on a '#'-prefixed line
+    assert columns == ["# Intercept", "GlobalSignalMean0", "WhiteMatterMean0",
+                       "CerebrospinalFluidMean0"]
+    np.testing.assert_array_equal(
+        mat[columns.index("WhiteMatterMean0")], [-0.45, 3.25, 1000.0]
+    )
+
+
+@pytest.mark.parametrize("filename", list(EXPECTED_1D))
+def test_read_1D_matches_afni1D(filename):
+    lib_afni1D = pytest.importorskip("afnipy.lib_afni1D")
+
+    try:
+        from parse_cache import read_1D
+    except ModuleNotFoundError:
+        from .parse_cache import read_1D
+
+    path = os.path.join(TEST_DATA, filename)
+    mat, header = read_1D(path)
+    expected = lib_afni1D.Afni1D(path)
+
+    np.testing.assert_array_equal(mat, np.array(expected.mat, dtype=float))
+    assert header == expected.header
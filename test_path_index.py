@@ -0,0 +1,60 @@
+import glob
+import os
+
+
+def _touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "w").close()
+
+
+def test_path_index_matches_glob(tmp_path):
+
+    try:
+        from path_index import Path_Index
+    except ModuleNotFoundError:
+        from .path_index import Path_Index
+
+    run_path = f"{tmp_path}/"
+    for path in [
+        "working/resting_preproc_sub-1_ses-1/nuisance_a_0/_s/_r/build_x/r.1D",
+        "working/resting_preproc_sub-1_ses-1/nuisance_a_0/_s/_c/"
+        "aCompCor_0/c.1D",
+        "working/resting_preproc_sub-2_ses-1/nuisance_a_0/_s/_r/.hidden.1D",
+        "output/pipe/sub-1_ses-1/frame_wise_displacement_power/_s/FD.1D"
+    ]:
+        _touch(os.path.join(run_path, path))
+
+    index = Path_Index(run_path)
+
+    for pattern in [
+        "working/resting_preproc_*sub-1*/nuisance_*_0/_*/*/build*/*1D",
+        "working/resting_preproc_*/nuisance_*_0/_*/_*/aCompCor_*/*1D",
+        "working/resting_preproc_*/nuisance_*_0/_*/_*/*",
+        "output/*/*sub-1*ses-1/frame_wise_displacement_power/*/*",
+        "output/pipe/",
+        "working/missing/*"
+    ]:
+        assert index.glob(f"{run_path}{pattern}") == sorted(
+            glob.glob(f"{run_path}{pattern}")
+        )
+
+
+def test_path_index_cache_refresh(tmp_path):
+
+    try:
+        from path_index import Path_Index
+    except ModuleNotFoundError:
+        from .path_index import Path_Index
+
+    run_path = f"{tmp_path}/run/"
+    cache_path = str(tmp_path / "index.json")
+    _touch(f"{run_path}output/pipe/sub-1/a.1D")
+
+    Path_Index(run_path, cache_path=cache_path)
+    _touch(f"{run_path}output/pipe/sub-2/b.1D")
+    index = Path_Index(run_path, cache_path=cache_path)
+
+    assert index.glob(f"{run_path}output/pipe/*/*.1D") == [
+        f"{run_path}output/pipe/sub-1/a.1D",
+        f"{run_path}output/pipe/sub-2/b.1D"
+    ]
@@ -0,0 +1,195 @@
+import os
+import pytest
+
+
+@pytest.fixture
+def s3_bucket(monkeypatch):
+    moto = pytest.importorskip("moto")
+    boto3 = pytest.importorskip("boto3")
+
+    for key, value in [
+        ("AWS_ACCESS_KEY_ID", "testing"),
+        ("AWS_SECRET_ACCESS_KEY", "testing"),
+        ("AWS_DEFAULT_REGION", "us-east-1")
+    ]:
+        monkeypatch.setenv(key, value)
+
+    with moto.mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket="regtest")
+        for key in [
+            "run/output/pipe/sub-1_ses-1/frame_wise_displacement_power/_s/"
+            "FD.1D",
+            "run/output/pipe/sub-2_ses-1/frame_wise_displacement_power/_s/"
+            "FD.1D",
+            "run/working/resting_preproc_sub-1_ses-1/nuisance_a_0/_s/_r/"
+            "build_x/r.1D",
+            "other/output/x.1D"
+        ]:
+            client.put_object(Bucket="regtest", Key=key, Body=key.encode())
+        yield("s3://regtest/run/")
+
+
+def test_s3_store_index_and_fetch(s3_bucket, tmp_path):
+
+    try:
+        from path_index import glob_run
+        from s3_inputs import S3_Store, local_file, register_store
+    except ModuleNotFoundError:
+        from .path_index import glob_run
+        from .s3_inputs import S3_Store, local_file, register_store
+
+    store = S3_Store(str(tmp_path / "cache"))
+    store.index(s3_bucket)
+
+    paths = glob_run(
+        f"{s3_bucket}output/*/*sub-1*ses-1/frame_wise_displacement_power/*/*",
+        s3_bucket
+    )
+    assert paths == [
+        f"{s3_bucket}output/pipe/sub-1_ses-1/frame_wise_displacement_power/"
+        "_s/FD.1D"
+    ]
+    # listing doesn't download anything
+    assert not os.listdir(tmp_path / "cache")
+
+    register_store(store)
+    try:
+        with open(local_file(paths[0]), "rb") as f:
+            assert f.read() == paths[0][len("s3://regtest/"):].encode()
+    finally:
+        register_store(None)
+
+
+def test_s3_store_cache_is_bounded(s3_bucket, tmp_path):
+
+    try:
+        from s3_inputs import S3_Store
+    except ModuleNotFoundError:
+        from .s3_inputs import S3_Store
+
+    store = S3_Store(str(tmp_path / "cache"), max_cache_bytes=150)
+    urls = [f"{s3_bucket}{key}" for key in store.list_keys(s3_bucket)]
+    store.prefetch(urls)
+    local_paths = [store.fetch(url) for url in urls]
+
+    assert store.nbytes <= 150
+    # the most recently fetched file is kept
+    assert os.path.exists(local_paths[-1])
+    # an evicted file is downloaded again when it's needed
+    assert os.path.exists(store.fetch(urls[0]))
+
+
+def test_s3_fmriprep_features(s3_bucket, tmp_path):
+    boto3 = pytest.importorskip("boto3")
+
+    try:
+        from correlation_matrix import Subject_Session_Feature
+        from s3_inputs import S3_Store, register_store
+    except ModuleNotFoundError:
+        from .correlation_matrix import Subject_Session_Feature
+        from .s3_inputs import S3_Store, register_store
+
+    client = boto3.client("s3")
+    paths = {}
+    for feature, body in [
+        ("FD", "FramewiseDisplacement\n0.1\n0.2\n0.3\n"),
+        ("GS", "global_signal\twhite_matter\n1.5\t2\n2.5\t3\n")
+    ]:
+        paths[feature] = Subject_Session_Feature.get_paths(
+            "sub-0025427", feature, s3_bucket, "fmriprep", "ses-1"
+        )
+        client.put_object(Bucket="regtest",
+                          Key=paths[feature][0][len("s3://regtest/"):],
+                          Body=body.encode())
+
+    register_store(S3_Store(str(tmp_path / "cache")))
+    try:
+        reader = Subject_Session_Feature.__new__(Subject_Session_Feature)
+        assert reader.read_feature(paths["FD"], "FD", "fmriprep") == [
+            0.1, 0.2, 0.3
+        ]
+        assert list(reader.read_feature(paths["GS"], "GS", "fmriprep")) == [
+            1.5, 2.5
+        ]
+    finally:
+        register_store(None)
+
+
+def test_s3_store_keeps_pinned_files(s3_bucket, tmp_path):
+
+    try:
+        from s3_inputs import S3_Store
+    except ModuleNotFoundError:
+        from .s3_inputs import S3_Store
+
+    store = S3_Store(str(tmp_path / "cache"), max_cache_bytes=1)
+    urls = [f"{s3_bucket}{key}" for key in store.list_keys(s3_bucket)]
+    with store.pinned(urls[0]) as local_path:
+        store.prefetch(urls[1:])
+        for url in urls[1:]:
+            store.fetch(url)
+        # downloads over the bound don't evict a file in use
+        with open(local_path, "rb") as f:
+            assert f.read() == urls[0][len("s3://regtest/"):].encode()
+    # it's evicted by the next download once it's released
+    assert os.path.exists(store.fetch(urls[0]))
+    store.fetch(urls[1])
+    assert not os.path.exists(local_path)
+
+
+def test_s3_store_downloads_rewritten_objects(s3_bucket, tmp_path):
+    boto3 = pytest.importorskip("boto3")
+
+    try:
+        from s3_inputs import S3_Store
+    except ModuleNotFoundError:
+        from .s3_inputs import S3_Store
+
+    key = "run/output/x.1D"
+    url = f"s3://regtest/{key}"
+    client = boto3.client("s3")
+    client.put_object(Bucket="regtest", Key=key, Body=b"1\n2\n")
+    stale_path = S3_Store(str(tmp_path / "cache")).fetch(url)
+
+    # a later run with the same cache, after the object is rewritten
+    client.put_object(Bucket="regtest", Key=key, Body=b"3\n4\n")
+    store = S3_Store(str(tmp_path / "cache"))
+    with open(store.fetch(url), "rb") as f:
+        assert f.read() == b"3\n4\n"
+    assert store.local_path(url) != stale_path
+
+    # an unchanged object is read from the cache
+    store = S3_Store(str(tmp_path / "cache"))
+    store.list_keys("s3://regtest/run/output/")
+    client.delete_object(Bucket="regtest", Key=key)
+    with open(store.fetch(url), "rb") as f:
+        assert f.read() == b"3\n4\n"
+
+
+def test_worker_stores_partition_the_cache(tmp_path):
+    import multiprocessing
+
+    try:
+        from s3_inputs import S3_Store, register_worker_store, \
+                              registered_store, register_store
+    except ModuleNotFoundError:
+        from .s3_inputs import S3_Store, register_worker_store, \
+                               registered_store, register_store
+
+    store = S3_Store(str(tmp_path / "cache"), max_cache_bytes=300)
+    worker_count = multiprocessing.Value("i", 0)
+    workers = []
+    try:
+        for _ in range(3):
+            register_worker_store(store, worker_count, 3)
+            workers.append(registered_store())
+    finally:
+        register_store(None)
+
+    # each worker evicts only its own files, within its share of the bound
+    assert len({worker.cache_dir for worker in workers}) == 3
+    assert all(os.path.dirname(worker.cache_dir) == os.path.join(
+        store.cache_dir, "_workers"
+    ) for worker in workers)
+    assert [worker.max_cache_bytes for worker in workers] == [100] * 3